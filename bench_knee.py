@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Capacity-knee finder: step the load up until an SLO breaks
+----------------------------------------------------------
+- Thay cho việc chỉnh --min-interval bằng tay: mỗi bước chạy một subprocess
+  replayer (clone của các device mẫu, schedule synthetic, probe seq/send_ns)
+  với load tăng dần theo --vary:
+    devices : số device tăng theo --factor, mỗi device --rate msg/s
+    rate    : --devices cố định, msg/s mỗi device tăng theo --factor
+- SLO (bước nào vượt một trong các ngưỡng là "breach" và dừng tăng):
+    p99 latency end-to-end  (--slo-p99-ms, đo bằng seq/send_ns ở subscriber)
+    error rate              (--slo-error-rate: publish lỗi + message mất / đã gửi)
+    lateness scheduler p99  (--slo-lateness-ms)
+  sau đó chia đôi --refine lần giữa bước đạt cuối cùng và bước breach
+- --target broker: replayer publish lên broker thật (TLS như mk_client), driver
+  giữ một subscriber paho đo latency / loss
+  --target local : broker giả một thread (queue + delivery), để tự kiểm tra
+  công cụ khi không có EMQX
+- Báo cáo: load tối đa còn đạt SLO, knee của đường p99 (điểm xa nhất khỏi dây
+  cung, kiểu Kneedle), tài nguyên bão hoà đầu tiên (CPU replayer, CPU
+  subscriber, connection, scheduler, broker) và ghi JSON (--out)
+Usage:
+  python bench_knee.py --zone office --target broker --broker emqx --port 8883 \\
+      --sub-username truongphong_office --sub-password 123 --vary devices --start 50
+  python bench_knee.py --zone office --target local --vary rate --devices 20 --start 50
+"""
+
+from __future__ import annotations
+import argparse, collections, importlib, json, math, os, subprocess, sys, threading, time
+from typing import Dict, List, Optional, Tuple
+
+import bench_replayers
+import replay_metrics
+import replay_schedule
+from replay_batch import iter_readings
+from replay_probes import LatencyTracker
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VARY = ("devices", "rate")
+MEASURING = "measuring"   # worker stdout marker: warmup is over, the window starts now
+
+
+# -----------------------------------------------------------------------------
+# Worker: one load level in this process
+# -----------------------------------------------------------------------------
+class QueueBroker(bench_replayers.LocalBroker):
+    """LocalBroker that delivers through one thread, so it saturates like a real hop."""
+
+    def __init__(self):
+        super().__init__()
+        self.tracker = LatencyTracker()
+        self._queue: collections.deque = collections.deque()
+        self._ready = threading.Event()
+        threading.Thread(target=self._deliver, daemon=True).start()
+
+    def received(self, topic: str, payload: bytes) -> None:
+        super().received(topic, payload)
+        self._queue.append(payload)
+        self._ready.set()
+
+    def _deliver(self) -> None:
+        while True:
+            self._ready.wait()
+            self._ready.clear()
+            while self._queue:
+                payload = self._queue.popleft()
+                recv_ns = time.time_ns()
+                try:
+                    doc = json.loads(payload)
+                except ValueError:
+                    continue
+                for reading in iter_readings(doc):
+                    self.tracker.observe(reading, recv_ns)
+
+
+class PublishCounter:
+    """Counts attempted and failed publishes of every client a factory makes."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def wrap(self, factory):
+        def make(*a, **kw):
+            client = factory(*a, **kw)
+            publish = client.publish
+
+            def counted(topic, payload=None, qos=0, retain=False, **kwargs):
+                try:
+                    info = publish(topic, payload, qos, retain, **kwargs)
+                except Exception:
+                    with self._lock:
+                        self.attempts += 1
+                        self.errors += 1
+                    raise
+                with self._lock:
+                    self.attempts += 1
+                    if getattr(info, "rc", 0):
+                        self.errors += 1
+                return info
+
+            client.publish = counted
+            return client
+        return make
+
+    def snapshot(self) -> Tuple[int, int]:
+        with self._lock:
+            return self.attempts, self.errors
+
+
+def split_devices(templates, count: int) -> List[Tuple[tuple, int]]:
+    """`count` devices spread over the zone's templates as clone groups."""
+    per, extra = divmod(count, len(templates))
+    return [(t, per + (j < extra)) for j, t in enumerate(templates) if per + (j < extra)]
+
+
+def run_worker(args, on_measure=None) -> Dict:
+    import replay_clones, replay_reconnect
+
+    zone = importlib.import_module(f"replayer_{args.zone}")
+    broker = None
+    if args.target == "local":
+        broker = QueueBroker()
+        factory, host, port = broker.client_factory, "local", 0
+    elif args.fast_publish:
+        import replay_fastpub
+        factory, host, port = replay_fastpub.make_factory(args.fast_tick_ms / 1000), args.broker, args.port
+    else:
+        factory, host, port = zone.mk_client, args.broker, args.port
+    counter = PublishCounter()
+    reconnect = replay_reconnect.ReconnectPolicy()
+    lateness = replay_metrics.Histogram()
+    schedule = replay_schedule.synthetic_schedule(args.rate)
+
+    groups = split_devices(zone.DEVICES, args.worker_devices)
+    for (name, fname, username, password), count in groups:
+        threading.Thread(
+            target=replay_clones.group_thread,
+            args=(name, os.path.join(args.indir, fname), host, port, username, password, 1.0, 0.0, count),
+            kwargs=dict(zone=zone.ZONE, tenant=zone.TENANT, random_value=zone.random_value_for_device,
+                        client_factory=counter.wrap(factory), schedule=schedule, lateness=lateness,
+                        probes=True, stagger=args.stagger, reconnect=reconnect),
+            daemon=True,
+        ).start()
+
+    time.sleep(args.warmup)
+    lateness.reset()
+    if broker is not None:
+        broker.tracker = LatencyTracker()
+    if on_measure is not None:
+        on_measure()
+    a0, e0 = counter.snapshot()
+    f0, d0 = reconnect.failures, reconnect.disconnects
+    cpu0, t0 = replay_metrics.cpu_seconds(), time.monotonic()
+    time.sleep(args.duration)
+    a1, e1 = counter.snapshot()
+    cpu1, t1 = replay_metrics.cpu_seconds(), time.monotonic()
+    elapsed = t1 - t0
+    result = {
+        "devices": args.worker_devices,
+        "rate_per_device": args.rate,
+        "connections": len(groups),
+        "offered_per_s": round(args.worker_devices * args.rate, 1),
+        "msg_per_s": round((a1 - a0) / elapsed, 1),
+        "attempts": a1 - a0,
+        "publish_errors": e1 - e0,
+        "connect_failures": reconnect.failures - f0,
+        "disconnects": reconnect.disconnects - d0,
+        "lateness_ms": lateness.summary(),
+        "cpu_util": round((cpu1 - cpu0) / elapsed, 3),
+        "rss_bytes": replay_metrics.rss_bytes(),
+    }
+    if broker is not None:
+        result["delivery"] = merge_zones(broker.tracker.summary())
+        result["backlog"] = len(broker._queue)
+    return result
+
+
+def merge_zones(summary: Dict[str, Dict]) -> Dict:
+    """Subscriber-side totals of one step: messages, loss and the worst zone p99."""
+    out = {"messages": 0, "lost": 0, "reordered": 0, "p50_ms": None, "p99_ms": None}
+    for z in summary.values():
+        out["messages"] += z["messages"]
+        out["lost"] += z["lost"]
+        out["reordered"] += z["reordered"]
+        for key, q in (("p50_ms", "p50"), ("p99_ms", "p99")):
+            v = z["latency_ms"][q]
+            if v is not None and (out[key] is None or v > out[key]):
+                out[key] = v
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Driver-side subscriber (--target broker)
+# -----------------------------------------------------------------------------
+class Subscriber:
+    """paho subscriber on the zone's telemetry topics feeding a swappable LatencyTracker."""
+
+    def __init__(self, args, tenant: str):
+        import ssl
+        import paho.mqtt.client as mqtt
+        self.tracker = LatencyTracker()
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"knee-{tenant}-{os.getpid()}",
+                                  protocol=mqtt.MQTTv311)
+        if args.sub_username:
+            self.client.username_pw_set(args.sub_username, args.sub_password)
+        if args.port == 8883 or args.tls:
+            ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=args.cafile)
+            if args.insecure:
+                ctx.check_hostname = False
+                ctx.verify_mode = ssl.CERT_NONE
+            self.client.tls_set_context(ctx)
+        topic = f"factory/{tenant}/+/telemetry"
+        self.client.on_connect = lambda c, u, f, rc, p=None: c.subscribe(topic, qos=args.sub_qos)
+        self.client.on_message = self._on_message
+        self.client.connect(args.broker, args.port, keepalive=60)
+        self.client.loop_start()
+
+    def _on_message(self, client, userdata, msg) -> None:
+        recv_ns = time.time_ns()
+        try:
+            doc = json.loads(msg.payload)
+        except ValueError:
+            return
+        tracker = self.tracker
+        for reading in iter_readings(doc):
+            tracker.observe(reading, recv_ns)
+
+    def reset(self) -> None:
+        self.tracker = LatencyTracker()
+
+    def close(self) -> None:
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+# -----------------------------------------------------------------------------
+# Driver
+# -----------------------------------------------------------------------------
+def run_step(args, devices: int, rate: float, sub: Optional[Subscriber]) -> Optional[Dict]:
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker", "--zone", args.zone,
+           "--target", args.target, "--broker", args.broker, "--port", str(args.port),
+           "--worker-devices", str(devices), "--rate", repr(rate), "--indir", args.indir,
+           "--duration", str(args.duration), "--warmup", str(args.warmup), "--stagger", args.stagger,
+           "--fast-tick-ms", str(args.fast_tick_ms)]
+    if args.fast_publish:
+        cmd.append("--fast-publish")
+    proc = subprocess.Popen(cmd, cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    deadline = time.monotonic() + args.duration + args.warmup + args.timeout
+    measuring = threading.Event()
+    out_lines: List[str] = []
+    err_lines: List[str] = []
+
+    def drain(stream, sink, marker=False):
+        for line in stream:
+            if marker and line.strip() == MEASURING:
+                measuring.set()
+            else:
+                sink.append(line)
+        measuring.set()   # worker died before the marker: don't hold the driver
+
+    readers = [threading.Thread(target=drain, args=(proc.stdout, out_lines, True), daemon=True),
+               threading.Thread(target=drain, args=(proc.stderr, err_lines), daemon=True)]
+    for r in readers:
+        r.start()
+    sub_cpu = None
+    if sub is not None:
+        # Reset when the worker says its window starts, not after our own guess at
+        # its warmup: interpreter start-up and imports would otherwise leak in.
+        measuring.wait(timeout=max(deadline - time.monotonic(), 0))
+        sub.reset()
+        cpu0, t0 = replay_metrics.cpu_seconds(), time.monotonic()
+    try:
+        proc.wait(timeout=max(deadline - time.monotonic(), 0))
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+    for r in readers:
+        r.join()
+    out, err = "".join(out_lines), "".join(err_lines)
+    if sub is not None:
+        sub_cpu = (replay_metrics.cpu_seconds() - cpu0) / max(time.monotonic() - t0, 1e-9)
+    lines = [l for l in out.splitlines() if l.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        print(f"  devices={devices} rate={rate:g}: FAILED (rc={proc.returncode})\n{err[-2000:]}")
+        return None
+    step = json.loads(lines[-1])
+    if sub is not None:
+        step["delivery"] = merge_zones(sub.tracker.summary())
+        step["subscriber_cpu_util"] = round(sub_cpu, 3)
+    return step
+
+
+def check_slo(step: Dict, args) -> List[str]:
+    """SLOs this step breaks."""
+    breaches = []
+    delivery = step.get("delivery") or {}
+    p99 = delivery.get("p99_ms")
+    if p99 is not None and p99 > args.slo_p99_ms:
+        breaches.append(f"p99 latency {p99}ms > {args.slo_p99_ms:g}ms")
+    if step["attempts"] and not delivery.get("messages"):
+        breaches.append("nothing delivered")
+    errors = step["publish_errors"] + delivery.get("lost", 0)
+    rate = errors / max(step["attempts"], 1)
+    step["error_rate"] = round(rate, 6)
+    if rate > args.slo_error_rate:
+        breaches.append(f"error rate {rate:.2%} > {args.slo_error_rate:.2%}")
+    late = step["lateness_ms"]["p99"]
+    if late is not None and late > args.slo_lateness_ms:
+        breaches.append(f"lateness p99 {late}ms > {args.slo_lateness_ms:g}ms")
+    return breaches
+
+
+def saturated(step: Dict, args) -> List[str]:
+    """Resources at their limit in this step, most specific first."""
+    out = []
+    if step["connect_failures"] or step["disconnects"]:
+        out.append("connections")
+    if step["cpu_util"] >= args.cpu_limit:
+        out.append("replayer-cpu")
+    if (step.get("subscriber_cpu_util") or 0) >= args.cpu_limit:
+        out.append("subscriber-cpu")
+    late = step["lateness_ms"]["p99"]
+    if late is not None and late > args.slo_lateness_ms and "replayer-cpu" not in out:
+        out.append("replayer-scheduler")
+    delivery = step.get("delivery") or {}
+    p99 = delivery.get("p99_ms")
+    if not out and ((p99 is not None and p99 > args.slo_p99_ms) or step.get("error_rate", 0) > args.slo_error_rate):
+        out.append("broker" if args.target == "broker" else "local-broker-thread")
+    return out
+
+
+def knee_point(steps: List[Dict], key) -> Optional[Dict]:
+    """Kneedle-style knee: the point of a rising curve farthest below its chord."""
+    pts = sorted((s["offered_per_s"], key(s), s) for s in steps if key(s) is not None)
+    if len(pts) < 3:
+        return None
+    x0, y0 = pts[0][0], pts[0][1]
+    dx, dy = (pts[-1][0] - x0) or 1.0, (pts[-1][1] - y0) or 1.0
+    best, best_d = None, 0.0
+    for x, y, s in pts[1:-1]:
+        d = (x - x0) / dx - (y - y0) / dy
+        if d > best_d:
+            best, best_d = s, d
+    return best
+
+
+def next_load(load: float, args) -> float:
+    return load * args.factor if args.vary == "rate" else max(load + 1, int(round(load * args.factor)))
+
+
+def midpoint(lo: float, hi: float, args) -> float:
+    mid = math.sqrt(lo * hi)
+    return mid if args.vary == "rate" else int(round(mid))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Step replayer load until an SLO breaks and report the capacity knee")
+    ap.add_argument("--zone", default="office")
+    ap.add_argument("--target", choices=("broker", "local"), default="broker")
+    ap.add_argument("--broker", default="emqx")
+    ap.add_argument("--port", type=int, default=8883)
+    ap.add_argument("--indir", default="datasets")
+    ap.add_argument("--vary", choices=VARY, default="devices")
+    ap.add_argument("--start", type=float, default=10, help="First device count (or msg/s per device with --vary rate)")
+    ap.add_argument("--factor", type=float, default=2.0, help="Load multiplier between steps")
+    ap.add_argument("--max-steps", type=int, default=12)
+    ap.add_argument("--max-load", type=float, default=None, help="Stop stepping past this device count / rate")
+    ap.add_argument("--refine", type=int, default=2, help="Bisection steps between the last pass and the breach")
+    ap.add_argument("--devices", type=int, default=50, help="Device count with --vary rate")
+    ap.add_argument("--rate", type=float, default=1.0, help="msg/s per device with --vary devices")
+    ap.add_argument("--stagger", choices=replay_schedule.STAGGER_MODES, default="time")
+    ap.add_argument("--fast-publish", action="store_true", help="Publish with replay_fastpub (QoS 0, coalesced writes)")
+    ap.add_argument("--fast-tick-ms", type=float, default=5.0)
+    ap.add_argument("--duration", type=float, default=20.0, help="Measured seconds per step")
+    ap.add_argument("--warmup", type=float, default=5.0, help="Seconds before measuring")
+    ap.add_argument("--timeout", type=float, default=120.0, help="Extra seconds allowed per step")
+    g = ap.add_argument_group("SLO")
+    g.add_argument("--slo-p99-ms", type=float, default=250.0, help="End-to-end p99 latency bound")
+    g.add_argument("--slo-error-rate", type=float, default=0.001, help="(failed + lost) / sent bound")
+    g.add_argument("--slo-lateness-ms", type=float, default=100.0, help="Scheduler lateness p99 bound")
+    g.add_argument("--cpu-limit", type=float, default=0.9,
+                   help="Process CPU (cores) counted as saturated; one GIL-bound process tops out near 1.0")
+    g = ap.add_argument_group("subscriber (--target broker)")
+    g.add_argument("--sub-username", default=None)
+    g.add_argument("--sub-password", default=None)
+    g.add_argument("--sub-qos", type=int, choices=(0, 1), default=0)
+    g.add_argument("--tls", action="store_true", help="TLS on a port other than 8883")
+    g.add_argument("--cafile", default=os.path.join(HERE, "certs", "ca-cert.pem"))
+    g.add_argument("--insecure", action="store_true")
+    ap.add_argument("--out", default="knee_report.json", help="JSON report path")
+    ap.add_argument("--label", default=None)
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--worker-devices", type=int, default=0, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        result_fd = os.dup(1)
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+        result = run_worker(args, on_measure=lambda: os.write(result_fd, (MEASURING + "\n").encode("utf-8")))
+        os.write(result_fd, (json.dumps(result) + "\n").encode("utf-8"))
+        os._exit(0)   # group threads never return
+    if args.factor <= 1:
+        ap.error("--factor must be > 1")
+
+    zone = importlib.import_module(f"replayer_{args.zone}")
+    env = bench_replayers.environment()
+    env["label"] = args.label
+    sub = None
+    if args.target == "broker":
+        try:
+            sub = Subscriber(args, zone.TENANT)
+        except OSError as e:
+            ap.error(f"subscriber could not connect to {args.broker}:{args.port}: {e}")
+    print(f"Knee search {args.zone} → {args.target}"
+          + (f" {args.broker}:{args.port}" if sub else "") + f", varying {args.vary} from {args.start:g}")
+
+    steps: List[Dict] = []
+
+    def measure(load: float) -> Optional[Dict]:
+        devices, rate = (int(load), args.rate) if args.vary == "devices" else (args.devices, load)
+        step = run_step(args, devices, rate, sub)
+        if step is None:
+            return None
+        step["load"] = load
+        step["breaches"] = check_slo(step, args)
+        step["saturated"] = saturated(step, args)
+        steps.append(step)
+        d = step.get("delivery") or {}
+        print(f"  {args.vary}={load:<8g} offered={step['offered_per_s']:>9.1f}/s sent={step['msg_per_s']:>9.1f}/s "
+              f"p99={d.get('p99_ms')}ms lateness p99={step['lateness_ms']['p99']}ms "
+              f"errors={step['error_rate']:.2%} cpu={step['cpu_util']:.2f}"
+              + (f" sub_cpu={step['subscriber_cpu_util']:.2f}" if "subscriber_cpu_util" in step else "")
+              + (f"  BREACH: {'; '.join(step['breaches'])}" if step["breaches"] else ""))
+        return step
+
+    try:
+        load: float = args.start if args.vary == "rate" else int(args.start)
+        good = bad = None
+        for _ in range(args.max_steps):
+            if args.max_load is not None and load > args.max_load:
+                break
+            step = measure(load)
+            if step is None:
+                break
+            if step["breaches"]:
+                bad = step
+                break
+            good = step
+            load = next_load(load, args)
+        for _ in range(args.refine if good is not None and bad is not None else 0):
+            mid = midpoint(good["load"], bad["load"], args)
+            if mid in (good["load"], bad["load"]):
+                break
+            step = measure(mid)
+            if step is None:
+                break
+            if step["breaches"]:
+                bad = step
+            else:
+                good = step
+    finally:
+        if sub is not None:
+            sub.close()
+
+    first = next((s for s in sorted(steps, key=lambda s: s["load"]) if s["saturated"]), None)
+    knee = knee_point(steps, lambda s: (s.get("delivery") or {}).get("p99_ms")) \
+        or knee_point(steps, lambda s: s["lateness_ms"]["p99"])
+    report = {
+        "env": env,
+        "zone": args.zone,
+        "target": args.target,
+        "vary": args.vary,
+        "slo": {"p99_ms": args.slo_p99_ms, "error_rate": args.slo_error_rate, "lateness_p99_ms": args.slo_lateness_ms},
+        "max_sustainable": None if good is None else {
+            "load": good["load"], "devices": good["devices"], "offered_per_s": good["offered_per_s"],
+            "msg_per_s": good["msg_per_s"]},
+        "breach": None if bad is None else {"load": bad["load"], "slo": bad["breaches"]},
+        "knee": None if knee is None else {"load": knee["load"], "offered_per_s": knee["offered_per_s"]},
+        "first_saturated": None if first is None else {
+            "resource": first["saturated"][0], "load": first["load"], "all": first["saturated"]},
+        "steps": steps,
+    }
+    tmp = args.out + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp, args.out)
+
+    print("=" * 70)
+    ms = report["max_sustainable"]
+    print("Max sustainable: " + (f"{args.vary}={ms['load']:g} ({ms['offered_per_s']:g} msg/s)" if ms
+                                  else "none (the first step already breached)"))
+    if bad is None:
+        print("No SLO breach within the stepped range; raise --max-steps / --max-load")
+    else:
+        print(f"Breach at {args.vary}={bad['load']:g}: {'; '.join(bad['breaches'])}")
+    if knee is not None:
+        print(f"Knee: {args.vary}={knee['load']:g} ({knee['offered_per_s']:g} msg/s)")
+    if first is not None:
+        print(f"First saturated: {first['saturated'][0]} at {args.vary}={first['load']:g}")
+    print(f"Report written to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+End-to-end replayer benchmark against a local MQTT stand-in
+-----------------------------------------------------------
+- Không cần EMQX / network: mk_client của zone replayer được thay bằng
+  LocalBroker (client giả lập API paho, đếm message + byte, trả CONNACK ngay)
+- Mỗi cấu hình (zone, số device, payload mode) chạy trong một subprocess riêng
+  để RSS / startup đo được sạch
+- Ghi: msg/s duy trì, lateness scheduler p50/p99, CPU µs/message, RSS/device,
+  startup (process start -> publish đầu tiên)
+- Kết quả append vào JSON kèm git commit + môi trường, nên so sánh được giữa
+  các commit
+Usage:
+  python bench_replayers.py --zone office --devices 10,100,1000,10000 --modes json,batch,mqtt5
+  python bench_replayers.py --zone storage --devices 100 --duration 20 --out bench_results.json
+"""
+
+from __future__ import annotations
+import argparse, importlib, json, os, platform, subprocess, sys, threading, time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import replay_schedule
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODES = ("json", "batch", "mqtt5")
+
+
+# -----------------------------------------------------------------------------
+# Local broker stand-in
+# -----------------------------------------------------------------------------
+class _Info:
+    __slots__ = ("rc", "mid")
+
+    def __init__(self, mid: int):
+        self.rc = 0
+        self.mid = mid
+
+    def is_published(self) -> bool:
+        return True
+
+
+class LocalClient:
+    """Just enough of paho.mqtt.client.Client for the replayers."""
+
+    def __init__(self, broker: "LocalBroker", client_id: str, protocol: int):
+        self.broker = broker
+        self.client_id = client_id
+        self.protocol = protocol
+        self.on_connect = None
+        self.on_publish = None
+        self.on_disconnect = None
+        self._connected = False
+        self._mid = 0
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host, port=1883, keepalive=60, **kw):
+        self.broker.connected(self)
+        self._connected = True
+        if self.on_connect is not None:
+            props = SimpleNamespace(TopicAliasMaximum=65535) if self.protocol == 5 else None
+            self.on_connect(self, None, {}, 0, props)
+        return 0
+
+    def reconnect(self):
+        return self.connect(None)
+
+    def loop_start(self):
+        return 0
+
+    def loop_stop(self, force=False):
+        return 0
+
+    def disconnect(self, *a, **kw):
+        self._connected = False
+        return 0
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        self.broker.received(topic, payload or b"")
+        self._mid += 1
+        if self.on_publish is not None:
+            self.on_publish(self, None, self._mid)
+        return _Info(self._mid)
+
+
+class LocalBroker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+
+    def connected(self, client) -> None:
+        with self.lock:
+            self.connections += 1
+
+    def received(self, topic: str, payload: bytes) -> None:
+        with self.lock:
+            self.messages += 1
+            self.bytes += len(topic) + len(payload)
+
+    def client_factory(self, client_id, username=None, password=None, protocol=4):
+        return LocalClient(self, client_id, protocol)
+
+
+# -----------------------------------------------------------------------------
+# Worker: one configuration in this process
+# -----------------------------------------------------------------------------
+def expand_devices(templates, count: int):
+    """`count` devices cycled from the zone's DEVICES with unique usernames."""
+    out = []
+    for k in range(count):
+        name, fname, username, password = templates[k % len(templates)]
+        out.append((name, fname, f"{username}-b{k}", password))
+    return out
+
+
+def run_worker(args) -> Dict:
+    import replay_metrics, replay_startup
+
+    zone = importlib.import_module(f"replayer_{args.zone}")
+    broker = LocalBroker()
+    zone.mk_client = broker.client_factory
+    devices = expand_devices(zone.DEVICES, args.worker_devices)
+
+    schedule = None
+    if args.dataset is None:
+        schedule = replay_schedule.synthetic_schedule(args.rate)
+    lateness = replay_metrics.Histogram()
+    startup = replay_startup.StartupReport(args.zone)
+    kwargs = dict(lateness=lateness, startup=startup, schedule=schedule, stagger=args.stagger,
+                  window=replay_schedule.window_from_args(args))
+    mode = args.worker_mode
+    if mode == "batch":
+        kwargs.update(batch_size=args.batch_size, batch_ms=1000.0)
+    elif mode == "mqtt5":
+        import replay_mqtt5
+        kwargs.update(client_factory=replay_mqtt5.make_factory(broker.client_factory, replay_mqtt5.V5Options()))
+
+    rss0 = replay_metrics.rss_bytes()
+    t_start = time.monotonic()
+    for name, fname, username, password in devices:
+        path = os.path.join(args.indir, args.dataset or fname)
+        threading.Thread(target=zone.device_thread,
+                         args=(name, path, "local", 0, username, password, args.speed_factor, args.min_interval),
+                         kwargs=kwargs, daemon=True).start()
+    spawn_s = time.monotonic() - t_start
+
+    time.sleep(args.warmup)
+    lateness.reset()
+    with broker.lock:
+        m0, b0 = broker.messages, broker.bytes
+    cpu0, t0 = replay_metrics.cpu_seconds(), time.monotonic()
+    time.sleep(args.duration)
+    with broker.lock:
+        m1, b1 = broker.messages, broker.bytes
+    cpu1, t1 = replay_metrics.cpu_seconds(), time.monotonic()
+    rss1 = replay_metrics.rss_bytes()
+
+    msgs = m1 - m0
+    readings = lateness.count   # scheduled rows; differs from msgs when batching
+    elapsed = t1 - t0
+    return {
+        "zone": args.zone,
+        "devices": len(devices),
+        "mode": mode,
+        "rate_per_device": None if args.dataset else args.rate,
+        "dataset": args.dataset,
+        "stagger": args.stagger,
+        "duration_s": round(elapsed, 3),
+        "messages": msgs,
+        "msg_per_s": round(msgs / elapsed, 1),
+        "readings_per_s": round(readings / elapsed, 1),
+        "bytes_per_s": round((b1 - b0) / elapsed, 1),
+        "connections": broker.connections,
+        "lateness_ms": lateness.summary(),
+        "cpu_us_per_msg": round((cpu1 - cpu0) / msgs * 1e6, 2) if msgs else None,
+        "cpu_us_per_reading": round((cpu1 - cpu0) / readings * 1e6, 2) if readings else None,
+        "cpu_util": round((cpu1 - cpu0) / elapsed, 3),
+        "rss_bytes": rss1,
+        "rss_per_device_bytes": round((rss1 - rss0) / len(devices)),
+        "spawn_s": round(spawn_s, 3),
+        "startup_ms": None if startup.elapsed_ms is None else round(startup.elapsed_ms, 1),
+    }
+
+
+# -----------------------------------------------------------------------------
+# Driver
+# -----------------------------------------------------------------------------
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=HERE, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE,
+                                    capture_output=True, text=True, timeout=30).stdout.strip())
+    except (OSError, subprocess.SubprocessError):
+        commit, dirty = None, None
+    return {
+        "commit": commit,
+        "dirty": dirty,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def run_config(args, devices: int, mode: str) -> Optional[Dict]:
+    cmd = [sys.executable, os.path.abspath(__file__), "--worker",
+           "--zone", args.zone, "--worker-devices", str(devices), "--worker-mode", mode,
+           "--indir", args.indir, "--rate", str(args.rate), "--speed-factor", str(args.speed_factor),
+           "--min-interval", str(args.min_interval), "--batch-size", str(args.batch_size),
+           "--duration", str(args.duration), "--warmup", str(args.warmup), "--stagger", args.stagger]
+    if args.dataset:
+        cmd += ["--dataset", args.dataset]
+    if args.start is not None:
+        cmd += ["--start", args.start]
+    if args.end is not None:
+        cmd += ["--end", args.end]
+    proc = subprocess.run(cmd, cwd=HERE, capture_output=True, text=True,
+                          timeout=args.duration + args.warmup + args.timeout)
+    lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+    if proc.returncode != 0 or not lines:
+        print(f"  devices={devices} mode={mode}: FAILED (rc={proc.returncode})\n{proc.stderr[-2000:]}")
+        return None
+    return json.loads(lines[-1])
+
+
+def load_results(path: str) -> List[Dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_results(path: str, results: List[Dict]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp, path)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark zone replayers against a local MQTT stand-in")
+    ap.add_argument("--zone", default="office")
+    ap.add_argument("--devices", default="10,100,1000,10000", help="Comma-separated device counts")
+    ap.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated payload modes {MODES}")
+    ap.add_argument("--indir", default="datasets")
+    ap.add_argument("--dataset", default=None,
+                    help="Replay this CSV for every device instead of the synthetic schedule")
+    ap.add_argument("--rate", type=float, default=1.0, help="Synthetic msg/s per device")
+    ap.add_argument("--speed-factor", type=float, default=1.0)
+    ap.add_argument("--min-interval", type=float, default=0.0)
+    ap.add_argument("--batch-size", type=int, default=10, help="Envelope size for the batch mode")
+    replay_schedule.add_arguments(ap)
+    ap.add_argument("--duration", type=float, default=10.0, help="Measured seconds per run")
+    ap.add_argument("--warmup", type=float, default=2.0, help="Seconds before measuring")
+    ap.add_argument("--timeout", type=float, default=300.0, help="Extra seconds allowed per run (spawn/teardown)")
+    ap.add_argument("--out", default="bench_results.json", help="JSON file the runs are appended to")
+    ap.add_argument("--label", default=None, help="Free-form label stored with this batch of runs")
+    ap.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--worker-devices", type=int, default=0, help=argparse.SUPPRESS)
+    ap.add_argument("--worker-mode", default="json", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        # the replayer prints every publish; keep that cost but send it to /dev/null
+        result_fd = os.dup(1)
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")
+        result = run_worker(args)
+        os.write(result_fd, (json.dumps(result) + "\n").encode("utf-8"))
+        os._exit(0)   # device threads never return
+
+    try:
+        replay_schedule.window_from_args(args)
+    except ValueError as e:
+        ap.error(f"--start/--end: {e}")
+    env = environment()
+    env["label"] = args.label
+    results = load_results(args.out)
+    print(f"Benchmark {args.zone} @ {env['commit'] or 'unknown commit'}{' (dirty)' if env['dirty'] else ''}")
+    for devices in [int(x) for x in args.devices.split(",") if x]:
+        for mode in [m for m in args.modes.split(",") if m]:
+            if mode not in MODES:
+                ap.error(f"unknown mode {mode!r}")
+            run = run_config(args, devices, mode)
+            if run is None:
+                continue
+            run["env"] = env
+            results.append(run)
+            save_results(args.out, results)
+            lat = run["lateness_ms"]
+            print(f"  devices={devices:<6} mode={mode:<6} {run['msg_per_s']:>10.1f} msg/s "
+                  f"({run['readings_per_s']:.1f} readings/s)  "
+                  f"lateness p50={lat['p50']}ms p99={lat['p99']}ms  cpu={run['cpu_us_per_msg']}µs/msg  "
+                  f"rss/dev={run['rss_per_device_bytes']}B  startup={run['startup_ms']}ms")
+    print(f"Results appended to {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+One-time extraction of the hex-encoded XML payloads in the gotham datasets
+-------------------------------------------------------------------------
+- *_gotham.csv mang nguyên document XML (hex) trong mqtt.msg / tcp.payload,
+  vài KB mỗi row; tool này decode một lần, song song trên nhiều process
+- Kết quả: bảng cột gọn cho mỗi dataset, <indir>/.cache/<file>.xml.npz
+    row   : index row trong CSV gốc (int64)
+    time  : frame.time_epoch (float64, NaN nếu không có)
+    <tên đo>: một cột float64 cho mỗi measurement (NaN = thiếu)
+  kèm size + mtime của CSV nguồn để phát hiện bảng cũ
+- replay_values đọc bảng này thay vì decode lại hex XML; job ML dùng
+  load_table() hoặc bản --csv
+Usage:
+  python extract_gotham.py --indir datasets
+  python extract_gotham.py datasets/air-quality_gotham.csv --jobs 4 --csv
+"""
+
+from __future__ import annotations
+import argparse, glob, os, time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import replay_schedule
+import replay_values
+
+PAYLOAD_COLUMN = "mqtt.msg"
+TIME_COLUMN = "frame.time_epoch"
+CHUNK_ROWS = 2000
+TABLE_SUFFIX = ".xml.npz"
+
+
+def table_path(csv_path: str) -> str:
+    d, name = os.path.split(csv_path)
+    return os.path.join(d, replay_schedule.CACHE_DIR, name + TABLE_SUFFIX)
+
+
+def _decode_chunk(cells: Sequence[str]) -> List[Dict[str, float]]:
+    """Worker: hex XML cells -> measurement dicts (empty for undecodable cells)."""
+    out = []
+    for cell in cells:
+        try:
+            out.append(replay_values.xml_fields(bytes.fromhex(cell)))
+        except (TypeError, ValueError):
+            out.append({})
+    return out
+
+
+def extract(csv_path: str, jobs: Optional[int] = None) -> Dict:
+    """Decode every payload of csv_path into {"row", "time", "fields", <field>: column}."""
+    import numpy as np
+    import pandas as pd
+
+    header = pd.read_csv(csv_path, nrows=0).columns
+    usecols = [c for c in (PAYLOAD_COLUMN, TIME_COLUMN) if c in header]
+    if PAYLOAD_COLUMN not in usecols:
+        raise ValueError(f"{csv_path}: no {PAYLOAD_COLUMN} column")
+    df = pd.read_csv(csv_path, usecols=usecols, dtype={PAYLOAD_COLUMN: "string"})
+    cells = df[PAYLOAD_COLUMN]
+    rows = np.flatnonzero(cells.notna().to_numpy())
+    hexes = cells.iloc[rows].astype(str).tolist()
+
+    chunks = [hexes[k:k + CHUNK_ROWS] for k in range(0, len(hexes), CHUNK_ROWS)]
+    if len(chunks) > 1 and (jobs is None or jobs > 1):
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            decoded = [d for part in pool.map(_decode_chunk, chunks) for d in part]
+    else:
+        decoded = [d for part in map(_decode_chunk, chunks) for d in part]
+
+    fields: List[str] = []
+    seen = set()
+    for d in decoded:
+        for name in d:
+            if name not in seen:
+                seen.add(name)
+                fields.append(name)
+    table: Dict = {"row": rows.astype(np.int64), "fields": fields}
+    if TIME_COLUMN in df.columns:
+        table["time"] = pd.to_numeric(df[TIME_COLUMN], errors="coerce").to_numpy(np.float64)[rows]
+    else:
+        table["time"] = np.full(len(rows), np.nan)
+    for name in fields:
+        table[name] = np.fromiter((d.get(name, np.nan) for d in decoded), np.float64, len(decoded))
+    return table
+
+
+def write_table(table: Dict, csv_path: str, path: Optional[str] = None) -> str:
+    import numpy as np
+    path = path or table_path(csv_path)
+    st = os.stat(csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {"row": table["row"], "time": table["time"],
+              "fields": np.array(table["fields"], dtype=str),
+              "source": np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)}
+    arrays.update({f"f{k}": table[name] for k, name in enumerate(table["fields"])})
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    return path
+
+
+def load_table(csv_path: str, path: Optional[str] = None) -> Optional[Dict]:
+    """Extracted table of csv_path, or None when missing or older than the CSV."""
+    path = path or table_path(csv_path)
+    if not os.path.exists(path):
+        return None
+    import numpy as np
+    try:
+        with np.load(path) as z:
+            if os.path.exists(csv_path):
+                st = os.stat(csv_path)
+                if tuple(z["source"].tolist()) != (st.st_size, st.st_mtime_ns):
+                    return None
+            fields = [str(f) for f in z["fields"]]
+            table: Dict = {"row": z["row"], "time": z["time"], "fields": fields}
+            for k, name in enumerate(fields):
+                table[name] = z[f"f{k}"]
+    except (OSError, KeyError, ValueError):
+        return None
+    return table
+
+
+def write_csv(table: Dict, path: str) -> None:
+    import pandas as pd
+    cols = {"row": table["row"], "time": table["time"]}
+    cols.update({name: table[name] for name in table["fields"]})
+    pd.DataFrame(cols).to_csv(path, index=False)
+
+
+def _targets(args) -> List[str]:
+    if args.csv_files:
+        return args.csv_files
+    return sorted(glob.glob(os.path.join(args.indir, "*_gotham.csv")))
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pre-extract hex XML payloads of the gotham datasets")
+    ap.add_argument("csv_files", nargs="*", help="Datasets to extract (default: <indir>/*_gotham.csv)")
+    ap.add_argument("--indir", default="datasets")
+    ap.add_argument("--jobs", type=int, default=None, help="Worker processes (default: CPU count)")
+    ap.add_argument("--csv", action="store_true", help="Also write <table>.csv next to the .npz for ML jobs")
+    ap.add_argument("--force", action="store_true", help="Re-extract even when the table is up to date")
+    args = ap.parse_args()
+
+    targets = _targets(args)
+    if not targets:
+        ap.error(f"no *_gotham.csv in {args.indir}")
+    for csv_path in targets:
+        if not args.force and load_table(csv_path) is not None:
+            print(f"{csv_path}: up to date ({table_path(csv_path)})")
+            continue
+        t0 = time.perf_counter()
+        table = extract(csv_path, args.jobs)
+        path = write_table(table, csv_path)
+        if args.csv:
+            write_csv(table, path[:-len(".npz")] + ".csv")
+        print(f"{csv_path}: {len(table['row'])} payloads, {len(table['fields'])} fields "
+              f"-> {path} ({os.path.getsize(path)} B, {(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
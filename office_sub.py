@@ -1,9 +1,18 @@
 #!/usr/bin/env python3
 # file: office_sub.py
-import argparse, json, uuid
+import argparse, json, time, uuid
 import paho.mqtt.client as mqtt
 import ssl
 
+from replay_batch import iter_readings
+from replay_diag import add_arguments as add_diag_arguments, install as install_diag
+from replay_probes import LatencyTracker, add_subscriber_arguments, start_reporter
+from replay_reconnect import ReconnectPolicy, add_arguments as add_reconnect_arguments
+from replay_startup import StartupReport
+
+STARTUP = StartupReport("sub", "first message")
+LATENCY = LatencyTracker()
+
 def build_client_id(prefix="truongphong_office"):
     return f"{prefix}_{uuid.uuid4().hex[:8]}"
 
@@ -18,12 +27,19 @@ def on_subscribe(client, userdata, mid, granted_qos, properties=None):
         print("=> BỊ TỪ CHỐI (kiểm tra ACL cho user này)")
 
 def on_message(client, userdata, msg):
+    recv_ns = time.time_ns()
+    STARTUP.mark()
     try:
         payload = json.loads(msg.payload.decode("utf-8"))
-        body = json.dumps(payload, ensure_ascii=False)
     except Exception:
         body = msg.payload[:200].decode("utf-8", errors="ignore")
-    print(f"[{msg.topic}] QoS={msg.qos} retain={int(msg.retain)} -> {body}")
+        print(f"[{msg.topic}] QoS={msg.qos} retain={int(msg.retain)} -> {body}")
+        return
+    # batched envelopes are unpacked so every reading prints like a single publish
+    for reading in iter_readings(payload):
+        LATENCY.observe(reading, recv_ns)
+        body = json.dumps(reading, ensure_ascii=False)
+        print(f"[{msg.topic}] QoS={msg.qos} retain={int(msg.retain)} -> {body}")
 
 def main():
     ap = argparse.ArgumentParser()
@@ -35,11 +51,15 @@ def main():
     ap.add_argument("--cafile", default="certs/ca-cert.pem") 
     ap.add_argument("--insecure", action="store_true")
     ap.add_argument("--client-id", default="truongphong_office_sub")         
+    add_subscriber_arguments(ap)
+    add_reconnect_arguments(ap, report=True)
+    add_diag_arguments(ap)
     args = ap.parse_args()
    
     ap.add_argument("--client-cert")
     ap.add_argument("--client-key")
     args = ap.parse_args()
+    install_diag(args, args.username)
 
    
     if args.port == 8883 and not args.tls:
@@ -79,7 +99,12 @@ def main():
     client.on_subscribe = on_subscribe
     client.on_message = on_message
 
-    client.connect(args.broker, args.port, keepalive=60)
+    # backoff with jitter for the first connect and every reconnect; on_connect resubscribes
+    reconnect = ReconnectPolicy.from_args(args)
+    reconnect.install(client, "sub")
+    reconnect.connect(client, args.broker, args.port, "sub")
+    start_reporter(LATENCY, args.latency_interval, args.latency_out)
+    reconnect.start_reporter(args.reconnect_report)
     client.loop_forever()
 
 if __name__ == "__main__":
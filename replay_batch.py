@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Batched telemetry envelopes
+---------------------------
+- Opt-in: gom nhiều reading (timestamp, value) vào một PUBLISH duy nhất
+- Flush khi đủ N reading hoặc T ms sau reading đầu tiên của batch
+- Scope "device": mỗi device một Batcher, publish trên topic của chính device
+- Scope "zone": một Batcher chung cho cả zone, publish qua user aggregator
+- Subscriber gọi iter_readings() để bung envelope thành payload như cũ
+
+Envelope:
+  {"type": "batch", "client_id": ..., "zone": ...,
+   "readings": [[timestamp, value], ...]}            # device scope
+   "readings": [[timestamp, value, client_id], ...]  # zone scope
+  With --probes every reading becomes [timestamp, value, client_id|null, seq, send_ns]
+  and the envelope carries "run": <replayer boot nonce>
+"""
+
+from __future__ import annotations
+import json, threading, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from replay_probes import RUN_ID
+
+ENVELOPE_TYPE = "batch"
+
+
+def make_envelope(client_id: str, zone: str, readings: List[list], run: Optional[str] = None) -> Dict[str, Any]:
+    envelope = {"type": ENVELOPE_TYPE, "client_id": client_id, "zone": zone, "readings": readings}
+    if run is not None:
+        envelope["run"] = run
+    return envelope
+
+
+def iter_readings(payload: Any) -> Iterator[Any]:
+    """Yield single-reading payloads; plain payloads are passed through unchanged."""
+    if not isinstance(payload, dict) or payload.get("type") != ENVELOPE_TYPE:
+        yield payload
+        return
+    for r in payload.get("readings") or []:
+        reading = {
+            "timestamp": r[0],
+            "value": r[1],
+            "client_id": r[2] if len(r) > 2 and r[2] is not None else payload.get("client_id"),
+            "zone": payload.get("zone"),
+        }
+        if len(r) > 4:
+            reading["seq"], reading["send_ns"] = r[3], r[4]
+            reading["run"] = payload.get("run")
+        yield reading
+
+
+class Batcher:
+    """Collects readings and hands one JSON envelope to `publish` per flush.
+
+    Thread-safe, so one instance can be shared by every device thread of a zone.
+    A background thread enforces the T ms deadline; size-triggered flushes run
+    in the caller's thread.
+    """
+
+    def __init__(self, publish: Callable[[str], Any], client_id: str, zone: str,
+                 max_items: int = 10, max_delay_ms: float = 1000.0, with_source: bool = False):
+        self.publish = publish
+        self.client_id = client_id
+        self.zone = zone
+        self.max_items = max(1, int(max_items))
+        self.max_delay = max(0.0, max_delay_ms) / 1000.0
+        self.with_source = with_source
+        self.envelopes = 0
+        self.readings = 0
+        self._items: List[list] = []
+        self._deadline: Optional[float] = None
+        self._cond = threading.Condition()
+        self._closed = False
+        self._timer: Optional[threading.Thread] = None
+        if self.max_delay > 0:
+            self._timer = threading.Thread(target=self._run_timer, daemon=True)
+            self._timer.start()
+
+    def add(self, timestamp: str, value: Any, source: Optional[str] = None,
+            probe: Optional[Tuple[int, int]] = None) -> None:
+        if probe is not None:
+            item = [timestamp, value, source if self.with_source else None, probe[0], probe[1]]
+        else:
+            item = [timestamp, value, source] if self.with_source else [timestamp, value]
+        with self._cond:
+            self._items.append(item)
+            if len(self._items) == 1 and self.max_delay > 0:
+                self._deadline = time.monotonic() + self.max_delay
+                self._cond.notify()
+            batch = self._take() if len(self._items) >= self.max_items else None
+        if batch:
+            self._send(batch)
+
+    def flush(self) -> None:
+        with self._cond:
+            batch = self._take()
+        if batch:
+            self._send(batch)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self.flush()
+
+    def _take(self) -> List[list]:
+        batch, self._items, self._deadline = self._items, [], None
+        return batch
+
+    def _send(self, batch: List[list]) -> None:
+        self.envelopes += 1
+        self.readings += len(batch)
+        run = RUN_ID if any(len(r) > 4 for r in batch) else None
+        self.publish(json.dumps(make_envelope(self.client_id, self.zone, batch, run)))
+
+    def _run_timer(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and self._deadline is None:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                delay = self._deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                batch = self._take()
+            if batch:
+                try:
+                    self._send(batch)
+                except Exception as e:
+                    print(f"[batch:{self.client_id}] Publish error: {e}")
+
+
+def add_arguments(parser) -> None:
+    g = parser.add_argument_group("batching")
+    g.add_argument("--batch-size", type=int, default=0,
+                   help="Readings per envelope (0 = one PUBLISH per reading, the default)")
+    g.add_argument("--batch-ms", type=float, default=1000.0,
+                   help="Flush a partial envelope this many ms after its first reading")
+    g.add_argument("--batch-scope", choices=["device", "zone"], default="device",
+                   help="device: one envelope stream per device; zone: one aggregator connection per zone")
+    g.add_argument("--aggregator-user", default=None, help="Username of the zone aggregator (zone scope)")
+    g.add_argument("--aggregator-password", default=None, help="Password of the zone aggregator (zone scope)")
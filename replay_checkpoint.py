@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Checkpoint / resume of replay positions
+---------------------------------------
+- Mỗi device ghi (row kế tiếp, số vòng đã lặp, seq) vào bộ nhớ sau mỗi row;
+  hot path chỉ là một phép gán dict
+- Thread nền ghi toàn bộ state ra file JSON nhỏ mỗi --checkpoint-interval giây
+  (chỉ khi có thay đổi): ghi file tạm + fsync + os.replace, nên file luôn
+  nguyên vẹn kể cả khi process bị kill giữa chừng
+- Khởi động lại với cùng --checkpoint: device tiếp tục từ row đã lưu thay vì
+  row 0; state của dataset khác (tên file không khớp) bị bỏ qua
+- Row được lưu kèm cửa sổ --start/--end đang chạy (first_row, rows): chạy lại
+  với cửa sổ khác thì row được quy về cùng source row trong cửa sổ mới, hoặc
+  bắt đầu lại nếu row đó nằm ngoài cửa sổ
+Usage:
+  python replayer_office.py --checkpoint state/office.json --checkpoint-interval 5
+"""
+
+from __future__ import annotations
+import json, os, threading, time
+from typing import Dict, Optional, Tuple
+
+FORMAT_VERSION = 2   # v2: records carry the window's first_row
+
+
+class Checkpoint:
+    """Row cursors of every device of one process, flushed atomically in batches."""
+
+    def __init__(self, path: str, interval: float = 5.0, zone: str = ""):
+        self.path = path
+        self.interval = max(0.1, interval)
+        self.zone = zone
+        self.writes = 0
+        self._saved: Dict[str, list] = self._read()
+        self._state: Dict[str, Tuple[str, int, int, int, int, int]] = {}
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _read(self) -> Dict[str, list]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                doc = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"[checkpoint] Ignoring unreadable {self.path}: {e}")
+            return {}
+        if doc.get("version") != FORMAT_VERSION:
+            print(f"[checkpoint] Ignoring {self.path}: format version {doc.get('version')} != {FORMAT_VERSION}")
+            return {}
+        return doc.get("devices") or {}
+
+    def resume(self, username: str, source: str, rows: int,
+               first_row: int = 0) -> Optional[Tuple[int, int, int]]:
+        """(row, loops, seq) saved for this device, or None to start fresh.
+
+        `rows`/`first_row` describe the current --start/--end window; a row saved
+        under another window is rebased onto the same source row.
+        """
+        saved = self._saved.get(username)
+        if not saved:
+            return None
+        saved_source, saved_rows, row, loops, seq, saved_first = saved
+        if os.path.basename(saved_source) != os.path.basename(source):
+            return None
+        if (saved_first, saved_rows) == (first_row, rows):
+            return (row, loops, seq) if 0 <= row < rows else None
+        absolute = saved_first + row
+        if not first_row <= absolute < first_row + rows:
+            print(f"[checkpoint] {username}: saved row {absolute} is outside the window "
+                  f"{first_row}..{first_row + rows - 1}; starting fresh")
+            return None
+        print(f"[checkpoint] {username}: window changed since the checkpoint; "
+              f"rebasing source row {absolute} into {first_row}..{first_row + rows - 1}")
+        return absolute - first_row, loops, seq
+
+    def update(self, username: str, source: str, rows: int, row: int, loops: int, seq: int = 0,
+               first_row: int = 0) -> None:
+        self._state[username] = (source, rows, row, loops, seq, first_row)
+        self._dirty = True
+
+    def flush(self) -> None:
+        if not self._dirty:
+            return
+        self._dirty = False
+        devices = dict(self._saved)
+        devices.update({k: list(v) for k, v in list(self._state.items())})
+        doc = {"version": FORMAT_VERSION, "zone": self.zone, "time": time.time(), "devices": devices}
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(doc, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.writes += 1
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"[checkpoint] Could not write {self.path}: {e}")
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--checkpoint", default=None,
+                        help="State file for device row cursors; resume from it on start")
+    parser.add_argument("--checkpoint-interval", type=float, default=5.0,
+                        help="Seconds between checkpoint writes")
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Synthetic device multiplier (--multiply N)
+------------------------------------------
+- Mỗi device mẫu trong DEVICES được nhân thành N clone (nguồn dữ liệu ảo,
+  không phải N client MQTT):
+    username  : <username>-c<k>
+    client_id : <zone>-<username>-c<k>-replayer   (ghi trong payload / batch)
+    topic     : factory/<tenant>/<username>-c<k>/telemetry
+  tên / topic sinh từ index lúc publish, không lưu
+- N clone của một mẫu chạy trong một thread, một connection (credential của
+  device mẫu, hoặc connection gateway nếu --gateway-size): heap theo deadline
+  kế tiếp, nên không cần thêm user EMQX; chỉ cần ACL cho topic clone
+  (--print-clone-acl)
+- Phía broker: số connection KHÔNG tăng theo N (vẫn một connection
+  <zone>-<username>-clones mỗi mẫu); client_id của clone chỉ nằm trong payload.
+  --multiply đo tải message / topic, không đo tải connection / session
+- Clone dùng chung schedule đã compile + mảng interval đã scale của mẫu; mỗi
+  clone chỉ giữ row hiện tại, seq (probe) và state RNG 64 bit trong array,
+  cộng một entry heap (deadline, index) -> khoảng trăm byte mỗi clone
+- Phase offset theo username clone (--stagger), giá trị random theo RNG riêng
+  của clone nên lặp lại được giữa các run
+- Không checkpoint (--checkpoint bị từ chối khi --multiply > 1) và không log
+  từng row cho clone
+Usage:
+  python replayer_office.py --multiply 500 --min-interval 0
+  python replayer_office.py --multiply 500 --print-clone-acl > acl_clones.txt
+  python replay_clones.py --zone office --multiply 20000       # đo byte / clone
+"""
+
+from __future__ import annotations
+import heapq, json, sys, time
+from array import array
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import replay_batch
+import replay_gateway
+import replay_mqtt5
+import replay_probes
+import replay_reconnect
+import replay_schedule
+
+_MASK64 = (1 << 64) - 1
+
+
+class CloneGroup:
+    """N virtual copies of one template device; per clone only arrays of cursors and RNG state."""
+
+    def __init__(self, username: str, count: int, zone: str, tenant: str):
+        self.username = username
+        self.count = count
+        self.zone = zone
+        self.tenant = tenant
+        self.rows = array("q", bytes(8 * count))
+        self.seq = array("Q", bytes(8 * count))
+        self.rng = array("Q", (int(replay_schedule.phase_fraction("rng:" + self.clone_username(k)) * 2 ** 64)
+                               & _MASK64 for k in range(count)))
+        self.heap: List[Tuple[float, int]] = []
+
+    def clone_username(self, k: int) -> str:
+        return f"{self.username}-c{k}"
+
+    def client_id(self, k: int) -> str:
+        return f"{self.zone}-{self.username}-c{k}-replayer"
+
+    def topic(self, k: int) -> str:
+        return f"factory/{self.tenant}/{self.username}-c{k}/telemetry"
+
+    def start(self, intervals: Sequence[float], stagger: str, now: float) -> None:
+        """Per-clone phase offset (same rules as phase_offset) and the initial deadline heap."""
+        rows = len(intervals)
+        mean = sum(intervals) / rows if rows else 0.0
+        heap = []
+        for k in range(self.count):
+            shift = 0.0
+            if stagger != "none" and rows:
+                u = replay_schedule.phase_fraction(self.clone_username(k))
+                if stagger == "row" and rows > 1:
+                    self.rows[k] = int(u * rows)
+                else:
+                    shift = u * mean
+            heap.append((now + shift, k))
+        heapq.heapify(heap)
+        self.heap = heap
+
+    def uniform(self, k: int) -> float:
+        """Next value in [0, 1) of clone k's splitmix64 stream."""
+        s = (self.rng[k] + 0x9E3779B97F4A7C15) & _MASK64
+        self.rng[k] = s
+        z = ((s ^ (s >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        return ((z ^ (z >> 31)) >> 11) * (1.0 / (1 << 53))
+
+    def nbytes(self) -> int:
+        """Bytes held for the clones of this group (arrays, heap list, its tuples and floats)."""
+        n = sum(a.itemsize * len(a) for a in (self.rows, self.seq, self.rng))
+        n += sys.getsizeof(self.heap)
+        for entry in self.heap:
+            n += sys.getsizeof(entry) + sys.getsizeof(entry[0]) + (sys.getsizeof(entry[1]) if entry[1] > 256 else 0)
+        return n
+
+
+class _CloneRandom:
+    """random.uniform-compatible view of one clone's RNG stream."""
+
+    __slots__ = ("group", "k")
+
+    def __init__(self, group: CloneGroup):
+        self.group = group
+        self.k = 0
+
+    def uniform(self, a: float, b: float) -> float:
+        return a + (b - a) * self.group.uniform(self.k)
+
+
+def clone_acl(devices: Sequence[Tuple[str, str, str, str]], count: int, zone: str, tenant: str) -> str:
+    """EMQX rules letting each template user publish on its clones' topics."""
+    gateways = []
+    for _, _, username, _ in devices:
+        group = CloneGroup(username, 0, zone, tenant)
+        gw = replay_gateway.Gateway(username=username, client_id=f"{zone}-{username}-clones")
+        gw.members = [group.clone_username(k) for k in range(count)]
+        gateways.append(gw)
+    return replay_gateway.acl_rules(gateways, tenant, "CLONES")
+
+
+def group_thread(device_name: str, csv_path: str, broker: str, port: int, username: str, password: str,
+                 speed_factor: float, min_interval: float, count: int, *,
+                 zone: str, tenant: str, random_value: Callable[..., float], client_factory: Callable,
+                 batch_size: int = 0, batch_ms: float = 1000.0,
+                 zone_batcher: Optional[replay_batch.Batcher] = None,
+                 gateway: Optional[replay_gateway.GatewayPool] = None,
+                 stats: Optional[replay_gateway.TopologyStats] = None,
+                 schedule: Optional[replay_schedule.Schedule] = None,
+                 startup=None, journal=None, lateness=None, real_values: bool = True, probes: bool = False,
+                 stagger: str = "none", limits=None, window=None,
+                 reconnect: Optional[replay_reconnect.ReconnectPolicy] = None, load_shape=None, faults=None):
+    """Replay `count` clones of one template device over one connection."""
+    label = f"{zone}:{device_name}x{count}"
+    client_id = f"{zone}-{username}-clones"
+    if gateway is not None:
+        client = gateway.acquire(username)
+    else:
+        client = client_factory(client_id, username, password)
+        if stats is not None:
+            stats.track(client)
+        reconnect = reconnect or replay_reconnect.ReconnectPolicy()
+        reconnect.install(client, label)
+        reconnect.connect(client, broker, port, label)
+        client.loop_start()
+
+    publish = replay_mqtt5.publisher(client)
+    if journal is not None:
+        publish = journal.wrap(publish)
+    if limits is not None:
+        # one quota for the whole group: it publishes over a single connection
+        connection = gateway.gateway_for(username).client_id if gateway is not None else client_id
+        publish = limits.wrap(publish, zone, connection)
+    if faults is not None:
+        # rules match the template: its username / type stands for every clone
+        publish = faults.wrap(publish, client, zone, device_name, username)
+
+    def close_client():
+        if gateway is not None:
+            gateway.release(username)
+        else:
+            client.loop_stop()
+            client.disconnect()
+
+    try:
+        if schedule is None:
+            schedule = replay_schedule.load_schedule(csv_path, label, window=window)
+    except Exception as e:
+        print(f"[{label}] Error loading CSV: {e}")
+        close_client()
+        return
+
+    intervals = schedule.scaled(speed_factor, min_interval)
+    publish_rows = schedule.publish
+    values = schedule.values if real_values else None
+    rows = len(schedule)
+    if load_shape is not None:
+        load_shape.register(intervals, publish_rows, devices=count)
+
+    batcher = zone_batcher
+    if batcher is None and batch_size > 0:
+        template_topic = f"factory/{tenant}/{username}/telemetry"
+        batcher = replay_batch.Batcher(lambda body: publish(template_topic, body),
+                                       client_id, zone, batch_size, batch_ms, with_source=True)
+
+    group = CloneGroup(username, count, zone, tenant)
+    group.start(intervals, stagger, time.monotonic())
+    rng = _CloneRandom(group)
+    heap, seqs, cursor = group.heap, group.seq, group.rows
+    print(f"[{label}] {count} clones on {rows} shared rows from {schedule.source}, "
+          f"{group.nbytes() / max(count, 1):.0f} B/clone")
+
+    try:
+        while True:
+            at, k = heap[0]
+            delay = at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            if lateness is not None:
+                lateness.add(time.monotonic() - at)
+            i = cursor[k]
+            if publish_rows[i]:
+                value = values[i] if values is not None else None
+                if value is None or value != value:
+                    rng.k = k
+                    value = random_value(username, rng)
+                cid = group.client_id(k)
+                payload = {
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "value": float(value),
+                    "client_id": cid,
+                    "zone": zone,
+                }
+                probe = None
+                if probes:
+                    probe = (seqs[k], time.time_ns())
+                    payload["seq"], payload["send_ns"] = probe
+                    payload["run"] = replay_probes.RUN_ID
+                    seqs[k] += 1
+                try:
+                    if batcher is not None:
+                        batcher.add(payload["timestamp"], payload["value"], cid, probe)
+                    else:
+                        publish(group.topic(k), json.dumps(payload))
+                    if startup is not None:
+                        startup.mark()
+                    if load_shape is not None:
+                        load_shape.count()
+                except Exception as e:
+                    print(f"[{label}] Publish error (clone {k}): {e}")
+            if load_shape is None:
+                at += intervals[i]
+            else:
+                at = load_shape.advance(at, intervals[i])
+            cursor[k] = i + 1 if i + 1 < rows else 0
+            heapq.heapreplace(heap, (at, k))
+    finally:
+        if batcher is not None and batcher is not zone_batcher:
+            batcher.close()
+        close_client()
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--multiply", type=int, default=1,
+                        help="Replay N virtual clones of every device on their own topics. All N clones of a "
+                             "template publish over ONE MQTT connection ({zone}-{username}-clones); the clone "
+                             "client_id exists only in the payload, so broker connection counts do not grow with N")
+    parser.add_argument("--print-clone-acl", action="store_true",
+                        help="Print EMQX ACL rules for the clone topics of --multiply and exit")
+
+
+def main():
+    import argparse, importlib, os, tracemalloc
+    ap = argparse.ArgumentParser(description="Measure the per-clone memory of --multiply")
+    ap.add_argument("--zone", required=True)
+    ap.add_argument("--multiply", type=int, default=1000)
+    ap.add_argument("--indir", default="datasets")
+    ap.add_argument("--speed-factor", type=float, default=1.0)
+    ap.add_argument("--min-interval", type=float, default=0.05)
+    ap.add_argument("--stagger", choices=replay_schedule.STAGGER_MODES, default="row")
+    args = ap.parse_args()
+
+    zone = importlib.import_module(f"replayer_{args.zone}")
+    templates = []
+    for name, fname, username, _ in zone.DEVICES:
+        path = os.path.join(args.indir, fname)
+        if os.path.exists(path) or os.path.exists(replay_schedule.cache_path(path)):
+            schedule = replay_schedule.load_schedule(path, fname)
+        else:
+            schedule = replay_schedule.synthetic_schedule(1.0)
+        templates.append((username, schedule.scaled(args.speed_factor, args.min_interval)))
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    groups = []
+    now = time.monotonic()
+    for username, intervals in templates:
+        group = CloneGroup(username, args.multiply, zone.ZONE, zone.TENANT)
+        group.start(intervals, args.stagger, now)
+        groups.append(group)
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    clones = len(groups) * args.multiply
+    counted = sum(g.nbytes() for g in groups)
+    print(f"[{args.zone}] {len(groups)} templates x {args.multiply} = {clones} clones: "
+          f"{counted / clones:.0f} B/clone counted, {traced / clones:.0f} B/clone traced "
+          f"({traced / 1e6:.1f} MB total, schedules shared)")
+
+if __name__ == "__main__":
+    main()
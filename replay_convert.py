@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Slim replay-format converter for the capture exports
+----------------------------------------------------
+- MQTTset / Edge-IIoTset / gotham export ~54 cột (eth.src, tcp.payload,
+  mqtt.conflag.*, ...); replayer chỉ cần:
+    timestamp : cột đầu tiên khớp TIMESTAMP_CANDIDATES
+    msg type  : cột đầu tiên khớp MSGTYP_CANDIDATES
+    topic     : mqtt.topic (tuỳ chọn, --no-topic để bỏ)
+    payload   : cột đầu tiên khớp PAYLOAD_CANDIDATES (tuỳ chọn, --no-payload;
+                cần cho real values / extract_gotham)
+- Đọc stream theo chunk (usecols + dtype "string" khai báo sẵn), nên bộ nhớ
+  không phụ thuộc kích thước file và text gốc được giữ nguyên từng ký tự
+- File slim giữ đúng tên file gốc trong --outdir, nên replayer dùng trực tiếp
+  bằng --indir <outdir>, không đổi code
+- Provenance ghi ở sidecar <file>.provenance.json cạnh file slim (không ghi
+  vào CSV để pandas.read_csv của replayer vẫn đọc như cũ): file nguồn, sha256,
+  size, số row, cột giữ lại / bỏ đi, thời điểm convert
+Usage:
+  python replay_convert.py datasets/*.csv --outdir datasets_slim
+  python replayer_office.py --indir datasets_slim
+"""
+
+from __future__ import annotations
+import argparse, json, os, time
+from typing import Dict, List, Optional
+
+import replay_profile
+import replay_schedule
+import replay_values
+
+TOPIC_CANDIDATES = ["mqtt.topic", "topic"]
+CHUNK_ROWS = 200_000
+PROVENANCE_SUFFIX = ".provenance.json"
+
+
+def provenance_path(path: str) -> str:
+    return path + PROVENANCE_SUFFIX
+
+
+def replay_columns(header: List[str], topic: bool = True, payload: bool = True) -> List[str]:
+    """Columns of header the replay path reads, in their original order."""
+    cols = set()
+    for candidates, wanted in ((replay_schedule.TIMESTAMP_CANDIDATES, True),
+                               (replay_schedule.MSGTYP_CANDIDATES, True),
+                               (TOPIC_CANDIDATES, topic),
+                               (replay_values.PAYLOAD_CANDIDATES, payload)):
+        col = next((c for c in candidates if c in header), None) if wanted else None
+        if col is not None:
+            cols.add(col)
+    return [c for c in header if c in cols]
+
+
+def convert(src: str, dst: str, topic: bool = True, payload: bool = True,
+            chunk_rows: int = CHUNK_ROWS) -> Dict:
+    """Stream src into the slim replay file dst; returns the provenance record."""
+    import pandas as pd
+
+    header = list(pd.read_csv(src, nrows=0).columns)
+    keep = replay_columns(header, topic, payload)
+    if not keep:
+        raise ValueError(f"{src}: none of the replay columns are present")
+    d = os.path.dirname(dst)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = dst + ".tmp"
+    rows = 0
+    with open(tmp, "w", encoding="utf-8", newline="") as out:
+        reader = pd.read_csv(src, usecols=keep, dtype={c: "string" for c in keep}, chunksize=chunk_rows)
+        for chunk in reader:
+            chunk[keep].to_csv(out, index=False, header=rows == 0)
+            rows += len(chunk)
+        if rows == 0:
+            pd.DataFrame(columns=keep).to_csv(out, index=False)
+    os.replace(tmp, dst)
+
+    st = os.stat(src)
+    record = {
+        "source": os.path.abspath(src),
+        "source_sha256": replay_profile.content_hash(src),
+        "source_size": st.st_size,
+        "source_mtime_ns": st.st_mtime_ns,
+        "rows": rows,
+        "columns": keep,
+        "dropped": [c for c in header if c not in keep],
+        "size": os.path.getsize(dst),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "tool": "replay_convert.py",
+    }
+    with open(provenance_path(dst), "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+    return record
+
+
+def load_provenance(path: str) -> Optional[Dict]:
+    """Provenance of a slim replay file, or None for an original export."""
+    try:
+        with open(provenance_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Convert capture exports into slim replay files")
+    ap.add_argument("csv", nargs="+", help="Source dataset CSV files")
+    ap.add_argument("--outdir", required=True, help="Folder for the slim files (same file names)")
+    ap.add_argument("--no-topic", action="store_true", help="Drop the topic column")
+    ap.add_argument("--no-payload", action="store_true", help="Drop the payload column (random values only)")
+    ap.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    args = ap.parse_args()
+
+    for src in args.csv:
+        dst = os.path.join(args.outdir, os.path.basename(src))
+        if os.path.abspath(dst) == os.path.abspath(src):
+            ap.error(f"{src}: --outdir must differ from the source folder")
+        t0 = time.perf_counter()
+        record = convert(src, dst, not args.no_topic, not args.no_payload, args.chunk_rows)
+        print(f"{src}: {record['rows']} rows, {len(record['columns'])}/{len(record['columns']) + len(record['dropped'])} "
+              f"columns {record['columns']} -> {dst} ({record['source_size']} B -> {record['size']} B, "
+              f"{(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+On-demand profiling of long-running replayers / subscribers
+-----------------------------------------------------------
+- Process chạy nhiều giờ rồi chậm dần: bật profiler ngay trên process đang chạy
+  thay vì restart (mất luôn trạng thái cần điều tra)
+- SIGUSR1: bật / tắt sampling profiler (thread nền đọc sys._current_frames()
+  mỗi --diag-interval-ms); lúc tắt ghi top-N dòng nóng (self) và hàm nóng
+  (cumulative) ra file
+- SIGUSR2: bật / tắt tracemalloc; lúc bật chụp snapshot gốc, lúc tắt ghi top-N
+  chỗ cấp phát và top-N chỗ tăng so với snapshot gốc
+- --diag-port: control socket TCP chỉ trên 127.0.0.1 (dùng được cả trên Windows,
+  nơi không có SIGUSR1/2), một lệnh mỗi dòng:
+    profile start|stop|dump    alloc start|stop|dump    status
+- Khi tắt không có thread, không có hook: handler signal chỉ nằm chờ
+- File: <--diag-dir>/<label>-<pid>-cpu-YYYYmmdd-HHMMSS.txt / ...-alloc-...txt
+- Profiler là wall-clock: thread đang ngủ hiện ở đúng dòng sleep / wait của nó
+Usage:
+  python replayer_office.py --diag-port 7011 ...
+  kill -USR1 <pid>            # start, ... kill -USR1 <pid> again to stop + dump
+  python replay_diag.py 7011 alloc start
+  python replay_diag.py 7011 alloc dump
+"""
+
+from __future__ import annotations
+import os, signal, socket, sys, threading, time
+from collections import Counter
+from typing import Optional
+
+
+def _stamp() -> str:
+    return time.strftime("%Y%m%d-%H%M%S")
+
+
+def _short(path: str) -> str:
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:])
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler over every thread of the process."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = max(interval, 0.0005)
+        self.lines: Counter = Counter()
+        self.functions: Counter = Counter()
+        self.samples = 0
+        self.started = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self.lines, self.functions, self.samples = Counter(), Counter(), 0
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="diag-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self) -> None:
+        # the sampler and the control socket thread are not what we are looking for
+        skip = {t.ident for t in threading.enumerate() if t.name.startswith("diag-")}
+        skip.add(threading.get_ident())
+        lines, functions = self.lines, self.functions
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident in skip:
+                    continue
+                code = frame.f_code
+                lines[(code.co_filename, frame.f_lineno, code.co_name)] += 1
+                seen = set()
+                while frame is not None:
+                    code = frame.f_code
+                    if code not in seen:
+                        seen.add(code)
+                        functions[(code.co_filename, code.co_firstlineno, code.co_name)] += 1
+                    frame = frame.f_back
+                self.samples += 1
+
+    def report(self, top: int) -> str:
+        total = max(self.samples, 1)
+        out = [f"# sampling profile: {self.samples} thread samples over {time.time() - self.started:.1f}s "
+               f"(interval {self.interval * 1000:g} ms, wall clock)", "", f"## top {top} lines (self)"]
+        for (path, line, name), n in self.lines.most_common(top):
+            out.append(f"{n:>8} {n / total:6.1%}  {_short(path)}:{line} {name}")
+        out += ["", f"## top {top} functions (cumulative)"]
+        for (path, line, name), n in self.functions.most_common(top):
+            out.append(f"{n:>8} {n / total:6.1%}  {_short(path)}:{line} {name}")
+        return "\n".join(out) + "\n"
+
+
+class Diagnostics:
+    """Profiler + tracemalloc switches driven by signals and an optional control socket."""
+
+    def __init__(self, label: str, outdir: str = "diag", top: int = 30, interval: float = 0.005,
+                 frames: int = 10):
+        self.label = label
+        self.outdir = outdir
+        self.top = top
+        self.frames = frames
+        self.profiler = SamplingProfiler(interval)
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def _write(self, kind: str, text: str) -> str:
+        os.makedirs(self.outdir, exist_ok=True)
+        path = os.path.join(self.outdir, f"{self.label}-{os.getpid()}-{kind}-{_stamp()}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"[diag] {kind} report written to {path}")
+        return path
+
+    # -- profiler ---------------------------------------------------------------
+    def profile(self, action: str) -> str:
+        with self._lock:
+            if action == "toggle":
+                action = "stop" if self.profiler.running else "start"
+            if action == "start":
+                if self.profiler.running:
+                    return "profiler already running"
+                self.profiler.start()
+                print(f"[diag] profiler started ({self.profiler.interval * 1000:g} ms)")
+                return "profiler started"
+            if not self.profiler.running:
+                return "profiler not running"
+            if action == "stop":
+                self.profiler.stop()
+            elif action != "dump":
+                return f"unknown profile action {action!r}"
+            return self._write("cpu", self.profiler.report(self.top))
+
+    # -- tracemalloc ------------------------------------------------------------
+    def alloc(self, action: str) -> str:
+        import tracemalloc
+        with self._lock:
+            if action == "toggle":
+                action = "stop" if tracemalloc.is_tracing() else "start"
+            if action == "start":
+                if tracemalloc.is_tracing():
+                    return "tracemalloc already tracing"
+                tracemalloc.start(self.frames)
+                self._baseline = tracemalloc.take_snapshot()
+                print(f"[diag] tracemalloc started ({self.frames} frames)")
+                return "tracemalloc started"
+            if not tracemalloc.is_tracing():
+                return "tracemalloc not tracing"
+            if action not in ("stop", "dump"):
+                return f"unknown alloc action {action!r}"
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+            out = [f"# tracemalloc: traced {current / 1e6:.1f} MB now, peak {peak / 1e6:.1f} MB", "",
+                   f"## top {self.top} allocation sites"]
+            out += [str(s) for s in snapshot.statistics("lineno")[:self.top]]
+            if self._baseline is not None:
+                out += ["", f"## top {self.top} growth since start"]
+                out += [str(s) for s in snapshot.compare_to(self._baseline, "lineno")[:self.top]]
+            if action == "stop":
+                tracemalloc.stop()
+                self._baseline = None
+            return self._write("alloc", "\n".join(out) + "\n")
+
+    def status(self) -> str:
+        import tracemalloc
+        return (f"profiler={'on' if self.profiler.running else 'off'} "
+                f"tracemalloc={'on' if tracemalloc.is_tracing() else 'off'}")
+
+    def command(self, line: str) -> str:
+        words = line.split()
+        if words[:1] == ["status"]:
+            return self.status()
+        if len(words) == 2 and words[0] == "profile":
+            return self.profile(words[1])
+        if len(words) == 2 and words[0] == "alloc":
+            return self.alloc(words[1])
+        return "commands: profile start|stop|dump, alloc start|stop|dump, status"
+
+    # -- triggers ---------------------------------------------------------------
+    def install_signals(self) -> bool:
+        """SIGUSR1 toggles the profiler, SIGUSR2 tracemalloc (POSIX, main thread only)."""
+        if not hasattr(signal, "SIGUSR1") or threading.current_thread() is not threading.main_thread():
+            return False
+
+        def later(fn, action):
+            # handlers run between bytecodes of the main thread; keep the work off it
+            return lambda signum, frame: threading.Thread(target=fn, args=(action,), daemon=True).start()
+
+        signal.signal(signal.SIGUSR1, later(self.profile, "toggle"))
+        signal.signal(signal.SIGUSR2, later(self.alloc, "toggle"))
+        return True
+
+    def serve(self, port: int) -> threading.Thread:
+        server = socket.create_server(("127.0.0.1", port))
+
+        def run():
+            while True:
+                conn, _ = server.accept()
+                with conn:
+                    try:
+                        line = conn.makefile("r", encoding="utf-8").readline()
+                        reply = self.command(line.strip())
+                    except Exception as e:   # a bad command must not kill the control thread
+                        reply = f"error: {e}"
+                    try:
+                        conn.sendall((reply + "\n").encode("utf-8"))
+                    except OSError:
+                        pass
+
+        t = threading.Thread(target=run, name="diag-control", daemon=True)
+        t.start()
+        return t
+
+
+def install(args, label: str) -> Diagnostics:
+    """Wire the signal handlers (and control socket with --diag-port) for this process."""
+    diag = Diagnostics(label, args.diag_dir, args.diag_top, args.diag_interval_ms / 1000)
+    triggers = []
+    if diag.install_signals():
+        triggers.append(f"kill -USR1/-USR2 {os.getpid()}")
+    if args.diag_port:
+        diag.serve(args.diag_port)
+        triggers.append(f"python replay_diag.py {args.diag_port} profile|alloc start|stop|dump")
+    if triggers:
+        print(f"[diag] profiling on demand: {'; '.join(triggers)}")
+    return diag
+
+
+def add_arguments(parser) -> None:
+    g = parser.add_argument_group("on-demand profiling")
+    g.add_argument("--diag-port", type=int, default=0,
+                   help="Local control socket port for profile/alloc commands (0 = signals only)")
+    g.add_argument("--diag-dir", default="diag", help="Directory for profiler / tracemalloc reports")
+    g.add_argument("--diag-top", type=int, default=30, help="Entries per report section")
+    g.add_argument("--diag-interval-ms", type=float, default=5.0, help="Profiler sampling interval")
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Send a profiling command to a running replayer / subscriber")
+    ap.add_argument("port", type=int, help="--diag-port of the target process")
+    ap.add_argument("command", nargs="+", help="profile start|stop|dump, alloc start|stop|dump, status")
+    ap.add_argument("--host", default="127.0.0.1")
+    args = ap.parse_args()
+    with socket.create_connection((args.host, args.port), timeout=60) as conn:
+        conn.sendall((" ".join(args.command) + "\n").encode("utf-8"))
+        print(conn.makefile("r", encoding="utf-8").readline().rstrip())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""
+Lightweight QoS 0 publisher with pre-encoded PUBLISH frames
+-----------------------------------------------------------
+- Ở tốc độ cao nhất, phần dựng packet bằng Python của paho (mỗi message một
+  MQTTMessage, một packet, một lần ghi socket) là nút cổ chai
+- FastClient nói vừa đủ MQTT 3.1.1 cho telemetry QoS 0 của replayer:
+    CONNECT / CONNACK, PUBLISH QoS 0, PINGREQ, DISCONNECT
+  topic (độ dài 2 byte + UTF-8) được encode một lần cho mỗi topic; mỗi publish
+  chỉ ghép byte header (0x30 + remaining length) với topic đã cache và payload
+- Publish chỉ xếp các mảnh byte vào hàng đợi; thread loop mỗi tick (--fast-tick-ms)
+  nối tất cả lại và gọi sendall một lần -> nhiều frame / một lần ghi TLS
+- Cùng bề mặt với paho mà replayer dùng (connect, loop_start, publish,
+  on_connect / on_disconnect / on_publish, reconnect_delay_set), nên
+  replay_reconnect, TopologyStats, gateway, journal, rate limit vẫn hoạt động
+- Không hỗ trợ QoS > 0 và MQTT v5 (--mqtt5); TLS giống mk_client
+  (certs/ca-cert.pem, kiểm tra hostname)
+- main(): benchmark paho vs FastClient trên cùng một sink TLS local
+Usage:
+  python replayer_storage.py --fast-publish --fast-tick-ms 5 --min-interval 0
+  python replay_fastpub.py --messages 200000 --payload 120
+"""
+
+from __future__ import annotations
+import os, select, socket, ssl, threading, time
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional
+
+PublishInfo = namedtuple("PublishInfo", "rc mid")
+
+PINGREQ = b"\xc0\x00"
+DISCONNECT = b"\xe0\x00"
+MAX_PENDING_BYTES = 8 << 20
+
+
+def _remaining(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+
+def _utf8(s: str) -> bytes:
+    b = s.encode("utf-8")
+    return len(b).to_bytes(2, "big") + b
+
+
+def connect_packet(client_id: str, keepalive: int, username: Optional[str], password: Optional[str]) -> bytes:
+    flags = 0x02   # clean session
+    payload = _utf8(client_id)
+    if username is not None:
+        flags |= 0x80
+        payload += _utf8(username)
+        if password is not None:
+            flags |= 0x40
+            payload += _utf8(password)
+    var = _utf8("MQTT") + bytes((4, flags)) + keepalive.to_bytes(2, "big")
+    return b"\x10" + _remaining(len(var) + len(payload)) + var + payload
+
+
+def default_ssl_context(cafile: Optional[str] = None) -> ssl.SSLContext:
+    """Same verification as the replayers' mk_client."""
+    cafile = cafile or os.path.join(os.path.dirname(os.path.abspath(__file__)), "certs", "ca-cert.pem")
+    ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=cafile)
+    ctx.check_hostname = True
+    ctx.verify_mode = ssl.CERT_REQUIRED
+    return ctx
+
+
+class FastClient:
+    """QoS 0 MQTT 3.1.1 publisher with cached topic bytes and one sendall per loop tick."""
+
+    # callbacks get paho's VERSION2 arguments: on_disconnect(client, userdata, flags, rc, properties)
+    callback_api_version = "VERSION2"
+
+    def __init__(self, client_id: str, tick: float = 0.005, max_pending: int = MAX_PENDING_BYTES):
+        self.client_id = client_id
+        self.tick = max(tick, 0.0)
+        self.max_pending = max_pending
+        self.username: Optional[str] = None
+        self.password: Optional[str] = None
+        self.on_connect: Optional[Callable] = None
+        self.on_disconnect: Optional[Callable] = None
+        self.on_connect_fail: Optional[Callable] = None
+        self.on_publish: Optional[Callable] = None
+        self.frames = self.writes = self.bytes = self.dropped = 0
+        self._ctx: Optional[ssl.SSLContext] = None
+        self._host, self._port, self._keepalive = "", 1883, 60
+        self._topics: Dict[str, bytes] = {}
+        self._pending: List[bytes] = []
+        self._pending_bytes = 0
+        self._pending_frames = 0
+        self._cond = threading.Condition()
+        self._sock: Optional[socket.socket] = None
+        self._connected = False
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+        self._mid = 0
+        self._sent_mid = 0
+        self._reconnect_delay = 1.0
+
+    # -- paho-compatible setup ------------------------------------------------
+    def username_pw_set(self, username: str, password: Optional[str] = None) -> None:
+        self.username, self.password = username, password
+
+    def tls_set_context(self, context: ssl.SSLContext) -> None:
+        self._ctx = context
+
+    def reconnect_delay_set(self, min_delay: float = 1, max_delay: float = 120) -> None:
+        self._reconnect_delay = min_delay
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def socket(self) -> Optional[socket.socket]:
+        return self._sock if self._connected else None
+
+    def connect(self, host: str, port: int = 1883, keepalive: int = 60, **kw) -> int:
+        self._host, self._port, self._keepalive = host, port, keepalive
+        return self.reconnect()
+
+    def reconnect(self) -> int:
+        sock = socket.create_connection((self._host, self._port), timeout=10)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self._ctx is not None:
+                sock = self._ctx.wrap_socket(sock, server_hostname=self._host)
+            sock.sendall(connect_packet(self.client_id, self._keepalive, self.username, self.password))
+            ack = b""
+            while len(ack) < 4:
+                chunk = sock.recv(4 - len(ack))
+                if not chunk:
+                    raise ConnectionError("connection closed before CONNACK")
+                ack += chunk
+        except BaseException:
+            sock.close()
+            raise
+        if ack[0] != 0x20 or ack[3] != 0:
+            sock.close()
+            raise ConnectionRefusedError(f"CONNACK return code {ack[3]}")
+        sock.settimeout(None)
+        self._sock = sock
+        self._connected = True
+        if self.on_connect is not None:
+            self.on_connect(self, None, {"session present": ack[2] & 1}, 0, None)
+        return 0
+
+    # -- publish path -----------------------------------------------------------
+    def publish(self, topic: str, payload=None, qos: int = 0, retain: bool = False, properties=None) -> PublishInfo:
+        if qos:
+            raise ValueError("FastClient only publishes QoS 0")
+        head = self._topics.get(topic)
+        if head is None:
+            head = self._topics[topic] = _utf8(topic)
+        if payload is None:
+            payload = b""
+        elif isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        n = len(head) + len(payload)
+        if n < 128:
+            fixed = bytes((0x31 if retain else 0x30, n))
+        elif n < 16384:
+            fixed = bytes((0x31 if retain else 0x30, (n & 0x7F) | 0x80, n >> 7))
+        else:
+            fixed = (b"\x31" if retain else b"\x30") + _remaining(n)
+        size = len(fixed) + n
+        with self._cond:
+            while self._pending_bytes + size > self.max_pending:
+                if not self._connected or self._stop:
+                    self.dropped += 1
+                    return PublishInfo(1, 0)
+                self._cond.wait(0.1)
+            self._pending += (fixed, head, payload)
+            self._pending_bytes += size
+            self._pending_frames += 1
+            self._mid += 1
+            if self.tick == 0:
+                self._cond.notify_all()
+            return PublishInfo(0, self._mid)
+
+    def _flush(self) -> None:
+        with self._cond:
+            if not self._pending:
+                return
+            parts, self._pending = self._pending, []
+            nbytes, frames, last_mid = self._pending_bytes, self._pending_frames, self._mid
+            self._pending_bytes = self._pending_frames = 0
+            self._cond.notify_all()
+        self._sock.sendall(b"".join(parts))
+        self.writes += 1
+        self.frames += frames
+        self.bytes += nbytes
+        first, self._sent_mid = self._sent_mid + 1, last_mid
+        if self.on_publish is not None:
+            for mid in range(first, last_mid + 1):
+                self.on_publish(self, None, mid)
+
+    # -- loop -------------------------------------------------------------------
+    def _drain(self) -> None:
+        """Read and discard broker packets (PINGRESP); raises when the broker closed."""
+        sock = self._sock
+        while True:
+            if not (isinstance(sock, ssl.SSLSocket) and sock.pending()):
+                readable, _, _ = select.select([sock], [], [], 0)
+                if not readable:
+                    return
+            if not sock.recv(65536):
+                raise ConnectionError("broker closed the connection")
+
+    def _lost(self, err: Exception) -> None:
+        self._connected = False
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, None, 1, None)
+        while not self._stop:
+            time.sleep(self._reconnect_delay)
+            if self._stop:
+                return
+            try:
+                self.reconnect()
+                return
+            except OSError:
+                if self.on_connect_fail is not None:
+                    self.on_connect_fail(self, None)
+
+    def _loop(self) -> None:
+        ping_every = max(self._keepalive / 2, 1.0)
+        last_io = time.monotonic()
+        while True:
+            with self._cond:
+                if not self._pending and not self._stop:
+                    self._cond.wait(self.tick if self.tick > 0 else ping_every)
+                stop = self._stop
+            if self._connected:
+                try:
+                    if self._pending:
+                        self._flush()
+                        last_io = time.monotonic()
+                    elif time.monotonic() - last_io >= ping_every:
+                        self._sock.sendall(PINGREQ)
+                        last_io = time.monotonic()
+                    self._drain()
+                except OSError as e:
+                    if not stop:
+                        self._lost(e)
+                    continue
+            if stop:
+                return
+            if self.tick > 0:
+                # the tick is what lets concurrent publishes coalesce into one write
+                time.sleep(self.tick)
+
+    def loop_start(self) -> int:
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return 0
+
+    def loop_stop(self, force: bool = False) -> int:
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        return 0
+
+    def disconnect(self, *a, **kw) -> int:
+        if self._sock is not None and self._connected:
+            try:
+                self._flush()
+                self._sock.sendall(DISCONNECT)
+                self._sock.close()
+            except OSError:
+                pass
+        was = self._connected
+        self._connected = False
+        if was and self.on_disconnect is not None:
+            self.on_disconnect(self, None, None, 0, None)
+        return 0
+
+
+def make_factory(tick: float = 0.005, cafile: Optional[str] = None, tls: bool = True) -> Callable[..., FastClient]:
+    """Replacement for a replayer's mk_client producing FastClients."""
+    ctx = default_ssl_context(cafile) if tls else None
+
+    def factory(client_id: str, username: Optional[str] = None, password: Optional[str] = None,
+                protocol: int = 4) -> FastClient:
+        if protocol != 4:
+            raise ValueError("FastClient speaks MQTT 3.1.1 only (drop --mqtt5)")
+        client = FastClient(client_id, tick)
+        if username and password:
+            client.username_pw_set(username, password)
+        if ctx is not None:
+            client.tls_set_context(ctx)
+        return client
+
+    return factory
+
+
+def add_arguments(parser) -> None:
+    g = parser.add_argument_group("fast publisher")
+    g.add_argument("--fast-publish", action="store_true",
+                   help="Publish QoS 0 telemetry with pre-encoded frames and coalesced writes instead of paho")
+    g.add_argument("--fast-tick-ms", type=float, default=5.0,
+                   help="Write coalescing tick of --fast-publish in ms (0 = write as soon as possible)")
+
+
+# -----------------------------------------------------------------------------
+# Benchmark: paho vs FastClient over the same local TLS sink
+# -----------------------------------------------------------------------------
+class _Sink:
+    """TLS MQTT sink: answers CONNECT with CONNACK and counts PUBLISH frames."""
+
+    def __init__(self, certfile: str, keyfile: str):
+        self.ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        self.ctx.load_cert_chain(certfile, keyfile)
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.port = self.server.getsockname()[1]
+        self.publishes = 0
+        self.reads = 0
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            conn, _ = self.server.accept()
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn) -> None:
+        try:
+            conn = self.ctx.wrap_socket(conn, server_side=True)
+        except (OSError, ssl.SSLError):
+            return
+        buf = bytearray()
+        while True:
+            try:
+                data = conn.recv(1 << 20)
+            except OSError:
+                return
+            if not data:
+                return
+            self.reads += 1
+            buf += data
+            pos, count = 0, 0
+            while pos + 2 <= len(buf):
+                n, mult, k = 0, 1, pos + 1
+                while k < len(buf):
+                    n += (buf[k] & 0x7F) * mult
+                    mult <<= 7
+                    k += 1
+                    if not buf[k - 1] & 0x80:
+                        break
+                else:
+                    break
+                if k + n > len(buf):
+                    break
+                kind = buf[pos] >> 4
+                if kind == 1:
+                    conn.sendall(b"\x20\x02\x00\x00")
+                elif kind == 3:
+                    count += 1
+                elif kind == 12:
+                    conn.sendall(b"\xd0\x00")
+                pos = k + n
+            del buf[:pos]
+            with self._lock:
+                self.publishes += count
+
+
+def _bench_one(mode: str, sink: _Sink, messages: int, payload: bytes, tick: float) -> Dict:
+    import paho.mqtt.client as mqtt
+    ctx = default_ssl_context()
+    if mode == "paho":
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench-{mode}", protocol=mqtt.MQTTv311)
+        client.tls_set_context(ctx)
+        client.max_queued_messages_set(0)
+    else:
+        client = FastClient(f"bench-{mode}", tick)
+        client.tls_set_context(ctx)
+    client.connect("localhost", sink.port, keepalive=60)
+    client.loop_start()
+    time.sleep(0.2)
+    topic = "factory/bench/sensor-temp1-replayer/telemetry"
+    start = sink.publishes
+    reads0 = sink.reads
+    cpu0, t0 = time.process_time(), time.perf_counter()
+    for _ in range(messages):
+        client.publish(topic, payload)
+    while sink.publishes - start < messages and time.perf_counter() - t0 < 120:
+        time.sleep(0.001)
+    elapsed, cpu = time.perf_counter() - t0, time.process_time() - cpu0
+    received = sink.publishes - start
+    client.disconnect()
+    client.loop_stop()
+    return {"mode": mode, "messages": messages, "received": received, "seconds": round(elapsed, 3),
+            "msg_per_s": round(received / elapsed, 1), "cpu_us_per_msg": round(cpu / max(received, 1) * 1e6, 2),
+            "sink_reads": sink.reads - reads0,
+            "writes": getattr(client, "writes", None)}
+
+
+def main():
+    import argparse, json
+    ap = argparse.ArgumentParser(description="Benchmark paho vs the pre-encoded QoS 0 publisher over TLS")
+    ap.add_argument("--messages", type=int, default=100000)
+    ap.add_argument("--payload", type=int, default=120, help="Payload bytes (JSON-sized telemetry)")
+    ap.add_argument("--tick-ms", type=float, default=5.0)
+    ap.add_argument("--certs", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "certs"))
+    ap.add_argument("--out", default=None, help="Append the results as one JSON line")
+    args = ap.parse_args()
+
+    sink = _Sink(os.path.join(args.certs, "server-cert.pem"), os.path.join(args.certs, "server-key.pem"))
+    payload = (b'{"timestamp":"2025-01-14T18:49:28.000000+00:00","value":21.5,"client_id":"x","zone":"bench"}'
+               * (args.payload // 90 + 1))[:args.payload]
+    results = [_bench_one(mode, sink, args.messages, payload, args.tick_ms / 1000) for mode in ("paho", "fast")]
+    for r in results:
+        print(f"{r['mode']:5s} {r['received']}/{r['messages']} msgs in {r['seconds']}s: {r['msg_per_s']:.0f} msg/s, "
+              f"{r['cpu_us_per_msg']} µs CPU/msg, {r['sink_reads']} TLS reads at the sink"
+              + (f", {r['writes']} writes" if r["writes"] is not None else ""))
+    paho, fast = results
+    print(f"fast/paho: {fast['msg_per_s'] / max(paho['msg_per_s'], 1e-9):.1f}x throughput, "
+          f"{paho['cpu_us_per_msg'] / max(fast['cpu_us_per_msg'], 1e-9):.1f}x less CPU per message")
+    if args.out:
+        with open(args.out, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.time(), "payload": args.payload, "results": results}) + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Scheduled fault injection for the replayers
+-------------------------------------------
+- Kịch bản lỗi là một file JSON nhỏ (--fault-plan); mỗi rule gồm loại lỗi,
+  device áp dụng, và khi nào xảy ra:
+    drop       : bỏ message, không publish
+    delay      : publish trễ "delay_ms" (số hoặc [min, max]) bằng timer, nên
+                 schedule của device không bị lùi và message có thể đến sai thứ tự
+    duplicate  : publish thêm "copies" bản (mặc định 1)
+    skew       : cộng "skew_s" giây vào timestamp trong payload (cả batch envelope)
+    disconnect : cắt đột ngột socket của connection (shutdown, không DISCONNECT),
+                 reconnect đi theo policy của replay_reconnect như lỗi mạng thật
+- Chọn device: "devices" (username, chấp nhận glob: "office-sensortemp*") và / hoặc
+  "types" (tên device trong DEVICES: "Temperature"); không có cả hai = mọi device
+- Khi nào: "probability" cho mỗi publish, "window": [from_s, to_s] tính từ lúc
+  process bắt đầu replay, "repeat": chu kỳ lặp lại window; "once": true (mặc
+  định cho disconnect) -> tối đa một lần mỗi window cho mỗi device
+- Device không khớp rule nào giữ nguyên hàm publish cũ, không có --fault-plan
+  thì không có gì được bọc: đường không lỗi không tốn gì
+- Mỗi lỗi đã tiêm là một event có nhãn ("label" của rule), in ra và append JSONL
+  vào --fault-log (thread nền ghi) để đối chiếu với kết quả detector
+- RNG theo (seed, username) nên cùng seed cho cùng chuỗi lỗi
+- Zone-scope batch (aggregator) không đi qua publish của device nên không bị tiêm
+Usage:
+  python replayer_office.py --fault-plan faults/office.json --fault-log runs/faults_office.jsonl
+Plan:
+  {"seed": 7, "rules": [
+      {"kind": "drop", "types": ["Temperature"], "probability": 0.02, "label": "temp-loss"},
+      {"kind": "delay", "devices": ["office-sensorhum1-replayer"], "probability": 0.1, "delay_ms": [500, 3000]},
+      {"kind": "duplicate", "probability": 0.005},
+      {"kind": "skew", "types": ["Light"], "skew_s": -300, "window": [120, 600]},
+      {"kind": "disconnect", "devices": ["office-sensordoor*"], "window": [60, 70], "repeat": 600}]}
+"""
+
+from __future__ import annotations
+import fnmatch, json, queue, random, socket, threading, time, zlib
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import replay_batch
+
+KINDS = ("drop", "delay", "duplicate", "skew", "disconnect")
+
+_STOP = object()
+
+
+class FaultRule:
+    """One line of the plan: what to inject, on which devices, and when."""
+
+    def __init__(self, kind: str, label: Optional[str] = None, devices: Sequence[str] = (),
+                 types: Sequence[str] = (), probability: Optional[float] = None,
+                 window: Optional[Sequence[float]] = None, repeat: Optional[float] = None,
+                 once: Optional[bool] = None, **params):
+        if kind not in KINDS:
+            raise ValueError(f"unknown fault kind {kind!r} (expected one of {', '.join(KINDS)})")
+        if probability is not None and not 0 <= probability <= 1:
+            raise ValueError(f"{kind}: probability must be within [0, 1]")
+        if window is not None and (len(window) != 2 or window[1] <= window[0]):
+            raise ValueError(f"{kind}: window must be [from_s, to_s] with to_s > from_s")
+        if repeat is not None and (window is None or repeat < window[1] - window[0]):
+            raise ValueError(f"{kind}: repeat needs a window no longer than the period")
+        self.kind = kind
+        self.label = label
+        self.devices = [devices] if isinstance(devices, str) else list(devices)
+        self.types = [types] if isinstance(types, str) else list(types)
+        self.probability = probability
+        self.window = (float(window[0]), float(window[1])) if window is not None else None
+        self.repeat = repeat
+        self.once = kind == "disconnect" if once is None else bool(once)
+        delay = params.pop("delay_ms", 1000.0)
+        self.delay = tuple(d / 1000 for d in delay) if isinstance(delay, (list, tuple)) else (delay / 1000,) * 2
+        self.copies = int(params.pop("copies", 1))
+        self.skew = float(params.pop("skew_s", 0.0))
+        if kind == "skew" and not self.skew:
+            raise ValueError("skew: skew_s is required")
+        if params:
+            raise ValueError(f"{kind}: unknown fields {', '.join(sorted(params))}")
+
+    def matches(self, device_name: str, username: str) -> bool:
+        if not self.devices and not self.types:
+            return True
+        return any(fnmatch.fnmatchcase(username, p) for p in self.devices) or device_name in self.types
+
+    def occurrence(self, t: float) -> Optional[int]:
+        """Index of the window occurrence containing t (0 without a window), None outside."""
+        if self.window is None:
+            return 0
+        start, end = self.window
+        if t < start:
+            return None
+        if self.repeat is None:
+            return 0 if t < end else None
+        k, into = divmod(t - start, self.repeat)
+        return int(k) if into < end - start else None
+
+
+class FaultPlan:
+    """Fault rules of one process plus the labeled event log of what was injected."""
+
+    def __init__(self, rules: List[FaultRule], seed: int = 0, name: str = "plan"):
+        self.rules = rules
+        self.seed = seed
+        self.name = name
+        self.t0 = time.monotonic()
+        self.counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._log: Optional["queue.SimpleQueue"] = None
+        self._writer: Optional[threading.Thread] = None
+        for k, rule in enumerate(rules):
+            rule.label = rule.label or f"{rule.kind}#{k}"
+
+    @classmethod
+    def load(cls, path: str, seed: Optional[int] = None) -> "FaultPlan":
+        with open(path, encoding="utf-8") as f:
+            doc = json.load(f)
+        if isinstance(doc, list):
+            doc = {"rules": doc}
+        rules = [FaultRule(**r) for r in doc["rules"]]
+        return cls(rules, doc.get("seed", 0) if seed is None else seed, path)
+
+    # -- event log --------------------------------------------------------------
+    def start_log(self, path: Optional[str]) -> None:
+        if not path:
+            return
+        self._log = queue.SimpleQueue()
+        self._writer = threading.Thread(target=self._write, args=(path,), daemon=True)
+        self._writer.start()
+
+    def _write(self, path: str) -> None:
+        with open(path, "a", encoding="utf-8") as f:
+            while True:
+                item = self._log.get()
+                if item is _STOP:
+                    return
+                f.write(json.dumps(item) + "\n")
+                if self._log.empty():
+                    f.flush()
+
+    def event(self, rule: FaultRule, zone: str, device_name: str, username: str, topic: str,
+              payload: Any = None, **detail) -> None:
+        with self._lock:
+            self.counts[rule.label] = self.counts.get(rule.label, 0) + 1
+        print(f"[{zone}:{device_name}] Fault {rule.kind} ({rule.label})"
+              + "".join(f" {k}={v}" for k, v in detail.items()))
+        if self._log is None:
+            return
+        record = {"time": time.time(), "t": round(time.monotonic() - self.t0, 3), "zone": zone,
+                  "device": device_name, "username": username, "fault": rule.kind, "label": rule.label,
+                  "topic": topic}
+        record.update(detail)
+        record.update(_identity(payload))
+        self._log.put(record)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._log.put(_STOP)
+            self._writer.join(timeout=5)
+            self._writer = None
+
+    def summary(self) -> str:
+        with self._lock:
+            counts = dict(self.counts)
+        return "faults: " + (" ".join(f"{k}={v}" for k, v in counts.items()) or "none injected yet")
+
+    # -- publish path -----------------------------------------------------------
+    def wrap(self, publish: Callable, client, zone: str, device_name: str, username: str) -> Callable:
+        """Publish callable injecting this device's faults; `publish` itself when none apply."""
+        rules = [r for r in self.rules if r.matches(device_name, username)]
+        if not rules:
+            return publish
+        rng = random.Random((self.seed << 32) ^ zlib.crc32(username.encode("utf-8")))
+        fired: Dict[int, int] = {}
+        monotonic = time.monotonic
+
+        def faulty(topic: str, payload=None, qos: int = 0, retain: bool = False, **kw):
+            t = monotonic() - self.t0
+            copies, delay = 1, 0.0
+            for k, rule in enumerate(rules):
+                occ = rule.occurrence(t)
+                if occ is None or (rule.once and fired.get(k) == occ):
+                    continue
+                if rule.probability is not None and rng.random() >= rule.probability:
+                    continue
+                fired[k] = occ
+                kind = rule.kind
+                if kind == "drop":
+                    self.event(rule, zone, device_name, username, topic, payload)
+                    return None
+                if kind == "delay":
+                    d = rng.uniform(*rule.delay)
+                    delay += d
+                    self.event(rule, zone, device_name, username, topic, payload, delay_s=round(d, 3))
+                elif kind == "duplicate":
+                    copies += rule.copies
+                    self.event(rule, zone, device_name, username, topic, payload, copies=rule.copies)
+                elif kind == "skew":
+                    payload = skew_payload(payload, rule.skew)
+                    self.event(rule, zone, device_name, username, topic, payload, skew_s=rule.skew)
+                else:
+                    how = drop_connection(client)
+                    self.event(rule, zone, device_name, username, topic, payload, how=how)
+            if delay > 0:
+                timer = threading.Timer(delay, _publish_copies, (publish, copies, topic, payload, qos, retain, kw))
+                timer.daemon = True
+                timer.start()
+                return None
+            return _publish_copies(publish, copies, topic, payload, qos, retain, kw)
+
+        return faulty
+
+
+def _publish_copies(publish: Callable, copies: int, topic: str, payload, qos: int, retain: bool, kw: Dict):
+    info = None
+    for _ in range(copies):
+        info = publish(topic, payload, qos, retain, **kw)
+    return info
+
+
+def _identity(payload: Any) -> Dict[str, Any]:
+    """timestamp / seq of the faulted message, so events line up with what the subscriber saw."""
+    try:
+        doc = json.loads(payload) if isinstance(payload, (str, bytes)) else None
+    except ValueError:
+        return {}
+    if not isinstance(doc, dict):
+        return {}
+    if doc.get("type") == replay_batch.ENVELOPE_TYPE:
+        readings = doc.get("readings") or []
+        return {"readings": len(readings), "timestamp": readings[0][0] if readings else None}
+    out = {"timestamp": doc.get("timestamp")}
+    if "seq" in doc:
+        out["seq"] = doc["seq"]
+    return out
+
+
+def _shift(ts: Any, seconds: float) -> Any:
+    try:
+        return (datetime.fromisoformat(ts) + timedelta(seconds=seconds)).isoformat()
+    except (TypeError, ValueError):
+        return ts
+
+
+def skew_payload(payload: Any, seconds: float) -> Any:
+    """JSON payload (single reading or batch envelope) with its timestamps moved by `seconds`."""
+    try:
+        doc = json.loads(payload)
+    except (TypeError, ValueError):
+        return payload
+    if not isinstance(doc, dict):
+        return payload
+    if doc.get("type") == replay_batch.ENVELOPE_TYPE:
+        for r in doc.get("readings") or []:
+            r[0] = _shift(r[0], seconds)
+    elif "timestamp" in doc:
+        doc["timestamp"] = _shift(doc["timestamp"], seconds)
+    return json.dumps(doc)
+
+
+def drop_connection(client) -> str:
+    """Abruptly cut the client's connection so its loop sees a network error and reconnects."""
+    get_socket = getattr(client, "socket", None)
+    sock = get_socket() if get_socket is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        return "socket shutdown"
+    # stand-in clients without a socket: a plain disconnect + reconnect
+    client.disconnect()
+    client.reconnect()
+    return "disconnect"
+
+
+def add_arguments(parser) -> None:
+    g = parser.add_argument_group("fault injection")
+    g.add_argument("--fault-plan", default=None, help="JSON fault rules (drop, delay, duplicate, skew, disconnect)")
+    g.add_argument("--fault-log", default=None, help="Append every injected fault as a labeled JSON line")
+    g.add_argument("--fault-seed", type=int, default=None, help="Override the plan's RNG seed")
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Vectorized MQTT frame parser for captured tcp.payload hex
+---------------------------------------------------------
+- Cột tcp.payload chứa nguyên byte MQTT (hex), vd "30c809..." là PUBLISH;
+  parser này đọc trực tiếp thay vì phụ thuộc các cột mqtt.* mà Wireshark
+  có/không xuất ra
+- Cả cột được nối thành một buffer uint8 (một lần bytes.fromhex), sau đó mọi
+  bước là phép toán NumPy trên toàn bộ frame cùng lúc:
+    fixed header  : type, DUP / QoS / RETAIN
+    remaining len : varint 1-4 byte, giải bằng 4 bước vector
+    PUBLISH       : offset + độ dài topic, packet id (QoS>0), properties
+                    (--mqtt5), offset + độ dài payload
+  Một tcp.payload chứa nhiều frame được tách theo từng vòng vector (số vòng =
+  số frame tối đa trong một cell)
+- Cell không phải hex / frame cụt được đếm là malformed, không làm hỏng cell khác
+- topics() gom topic theo từng độ dài, không có vòng lặp Python theo frame
+Usage:
+  python replay_frames.py datasets/air-quality_gotham.csv
+  python replay_frames.py datasets/air-quality_gotham.csv --compare --repeat 20000
+  python replay_frames.py capture.csv --mqtt5 --out publish_stream.csv
+"""
+
+from __future__ import annotations
+import argparse, os, time
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+PAYLOAD_COLUMN = "tcp.payload"
+MQTT_TYPES = {1: "CONNECT", 2: "CONNACK", 3: "PUBLISH", 4: "PUBACK", 5: "PUBREC", 6: "PUBREL",
+              7: "PUBCOMP", 8: "SUBSCRIBE", 9: "SUBACK", 10: "UNSUBSCRIBE", 11: "UNSUBACK",
+              12: "PINGREQ", 13: "PINGRESP", 14: "DISCONNECT", 15: "AUTH"}
+# control packets whose variable header starts with a packet identifier
+_PACKET_ID_TYPES = (4, 5, 6, 7, 8, 9, 10, 11)
+MAX_FRAMES_PER_CELL = 64
+_PAD = 8
+
+
+def hex_buffer(cells):
+    """(buf, starts, ends, bad) for a column of hex cells; bad cells become empty."""
+    import numpy as np
+    import pandas as pd
+    s = pd.Series(cells, dtype="string").fillna("")
+    ok = (s.str.len().to_numpy(dtype=np.int64) % 2) == 0
+    s = s.where(ok, "")
+    lens = s.str.len().to_numpy(dtype=np.int64) // 2
+    try:
+        raw = bytes.fromhex("".join(s.tolist()))
+    except ValueError:
+        raw = b""
+    if len(raw) != lens.sum():
+        # some cell is not plain hex: only now pay for the per-cell regex check
+        ok &= s.str.fullmatch(r"(?:[0-9A-Fa-f]{2})*").fillna(False).to_numpy(dtype=bool)
+        s = s.where(ok, "")
+        lens = s.str.len().to_numpy(dtype=np.int64) // 2
+        raw = bytes.fromhex("".join(s.tolist()))
+    ends = np.cumsum(lens)
+    # padding lets the fixed-offset gathers below run past the last cell safely
+    buf = np.frombuffer(raw + bytes(_PAD), dtype=np.uint8)
+    return buf, ends - lens, ends, int((~ok).sum())
+
+
+def _at(buf, pos):
+    import numpy as np
+    return buf[np.minimum(pos, len(buf) - 1)].astype(np.int64)
+
+
+def _varint(buf, pos, end):
+    """MQTT variable byte integers starting at pos: (value, nbytes, ok)."""
+    import numpy as np
+    value = np.zeros(len(pos), dtype=np.int64)
+    nbytes = np.zeros(len(pos), dtype=np.int64)
+    done = np.zeros(len(pos), dtype=bool)
+    short = np.zeros(len(pos), dtype=bool)
+    for k in range(4):
+        b = _at(buf, pos + k)
+        active = ~done
+        short |= active & (pos + k >= end)
+        value += np.where(active, (b & 0x7F) << (7 * k), 0)
+        nbytes += active
+        done |= active & (b < 0x80)
+    return value, nbytes, done & ~short
+
+
+def _parse_one(buf, pos, end, mqtt5: bool) -> Dict:
+    """First frame at every pos (< end) as a dict of equally long arrays."""
+    import numpy as np
+    b0 = _at(buf, pos)
+    ptype, flags = b0 >> 4, b0 & 0x0F
+    remaining, nlen, ok = _varint(buf, pos + 1, end)
+    body = pos + 1 + nlen
+    frame_end = body + remaining
+    ok &= (ptype > 0) & (frame_end <= end)
+
+    publish = ptype == 3
+    qos = np.where(publish, (flags >> 1) & 3, 0)
+    ok &= ~(publish & (qos == 3))
+    topic_len = np.where(publish, (_at(buf, body) << 8) | _at(buf, body + 1), 0)
+    topic_off = np.where(publish, body + 2, -1)
+    after = body + 2 + topic_len
+    has_id = (publish & (qos > 0)) | (np.isin(ptype, _PACKET_ID_TYPES) & (remaining >= 2))
+    id_at = np.where(publish, after, body)
+    packet_id = np.where(has_id, (_at(buf, id_at) << 8) | _at(buf, id_at + 1), -1)
+    after = after + np.where(publish & (qos > 0), 2, 0)
+    if mqtt5:
+        plen, pn, pok = _varint(buf, after, frame_end)
+        ok &= ~publish | pok
+        after = after + np.where(publish, pn + plen, 0)
+    ok &= ~publish | (after <= frame_end)
+    payload_off = np.where(publish, after, body)
+    return {
+        "offset": pos, "type": ptype, "flags": flags,
+        "dup": np.where(publish, (flags >> 3) & 1, 0), "qos": qos, "retain": np.where(publish, flags & 1, 0),
+        "remaining": remaining, "header_len": 1 + nlen, "packet_id": packet_id,
+        "topic_off": topic_off, "topic_len": topic_len,
+        "payload_off": payload_off, "payload_len": frame_end - payload_off,
+        "ok": ok,
+    }
+
+
+@dataclass
+class Frames:
+    """Flat table of the MQTT frames found in a column of captured payloads.
+
+    cell[i] is the source row of frame i; every other field is an int64 array
+    indexed like cell, with offsets pointing into buf.
+    """
+    buf: object
+    cell: object
+    offset: object
+    type: object
+    flags: object
+    dup: object
+    qos: object
+    retain: object
+    remaining: object
+    header_len: object
+    packet_id: object
+    topic_off: object
+    topic_len: object
+    payload_off: object
+    payload_len: object
+    cells: int = 0
+    malformed: int = 0
+
+    def __len__(self) -> int:
+        return len(self.cell)
+
+    def topics(self):
+        """Topic string of every frame ("" for non-PUBLISH), gathered one topic length at a time."""
+        import numpy as np
+        out = np.full(len(self), "", dtype=object)
+        for n in np.unique(self.topic_len[self.topic_len > 0]):
+            sel = np.flatnonzero(self.topic_len == n)
+            idx = self.topic_off[sel, None] + np.arange(n)
+            raw = np.ascontiguousarray(self.buf[idx]).view(f"S{n}").ravel()
+            out[sel] = np.char.decode(raw, "utf-8", errors="replace")
+        return out
+
+    def payload(self, i: int) -> bytes:
+        o = int(self.payload_off[i])
+        return self.buf[o:o + int(self.payload_len[i])].tobytes()
+
+    def to_frame(self, payload_hex: bool = False):
+        """pandas view of the table (one row per frame)."""
+        import pandas as pd
+        df = pd.DataFrame({
+            "row": self.cell, "type": self.type,
+            "type_name": pd.Series(self.type).map(MQTT_TYPES).fillna("RESERVED").to_numpy(),
+            "dup": self.dup, "qos": self.qos, "retain": self.retain, "packet_id": self.packet_id,
+            "topic": self.topics(), "payload_len": self.payload_len,
+        })
+        if payload_hex:
+            df["payload"] = [self.payload(i).hex() for i in range(len(self))]
+        return df
+
+
+def parse_column(cells, mqtt5: bool = False, max_frames: int = MAX_FRAMES_PER_CELL) -> Frames:
+    """Every MQTT frame in a column of hex tcp.payload cells."""
+    import numpy as np
+    buf, starts, ends, bad = hex_buffer(cells)
+    pos = starts.copy()
+    broken = np.zeros(len(pos), dtype=bool)
+    parts: List[Dict] = []
+    malformed = bad
+    for rnd in range(max_frames):
+        idx = np.flatnonzero((pos < ends) & ~broken)
+        if not len(idx):
+            break
+        one = _parse_one(buf, pos[idx], ends[idx], mqtt5)
+        ok = one.pop("ok")
+        broken[idx[~ok]] = True
+        malformed += int((~ok).sum())
+        keep = idx[ok]
+        one = {k: v[ok] for k, v in one.items()}
+        one["cell"], one["round"] = keep, np.full(len(keep), rnd)
+        pos[keep] = one["payload_off"] + one["payload_len"]
+        parts.append(one)
+    names = ("cell", "offset", "type", "flags", "dup", "qos", "retain", "remaining", "header_len",
+             "packet_id", "topic_off", "topic_len", "payload_off", "payload_len")
+    if parts:
+        cols = {k: np.concatenate([p[k] for p in parts]) for k in names + ("round",)}
+        order = np.lexsort((cols.pop("round"), cols["cell"]))
+        cols = {k: v[order] for k, v in cols.items()}
+    else:
+        cols = {k: np.zeros(0, dtype=np.int64) for k in names}
+    return Frames(buf=buf, cells=len(starts), malformed=malformed, **cols)
+
+
+def parse_csv(csv_path: str, column: str = PAYLOAD_COLUMN, mqtt5: bool = False) -> Frames:
+    import pandas as pd
+    df = pd.read_csv(csv_path, usecols=[column], dtype={column: "string"})
+    return parse_column(df[column], mqtt5)
+
+
+def compare(frames: Frames, csv_path: str) -> Dict[str, Tuple[int, int]]:
+    """(matching, compared) of the first frame per row against Wireshark's mqtt.* columns."""
+    import numpy as np
+    import pandas as pd
+    header = pd.read_csv(csv_path, nrows=0).columns
+    cols = [c for c in ("mqtt.msgtype", "mqtt.topic", "mqtt.qos", "mqtt.retain") if c in header]
+    df = pd.read_csv(csv_path, usecols=cols)
+    first = np.ones(len(frames), dtype=bool)
+    first[1:] = frames.cell[1:] != frames.cell[:-1]
+    rows = frames.cell[first]
+    out = {}
+    checks = {"mqtt.msgtype": frames.type[first], "mqtt.qos": frames.qos[first],
+              "mqtt.retain": frames.retain[first], "mqtt.topic": frames.topics()[first]}
+    for col in cols:
+        ref = df[col].to_numpy()[rows]
+        mine = checks[col]
+        known = pd.notna(ref)
+        if col == "mqtt.topic":
+            same = ref[known].astype(str) == mine[known].astype(str)
+        else:
+            same = ref[known].astype(np.int64) == mine[known]
+        out[col] = (int(same.sum()), int(known.sum()))
+    return out
+
+
+def main():
+    import numpy as np
+    import pandas as pd
+    ap = argparse.ArgumentParser(description="Decode MQTT frames from captured tcp.payload hex")
+    ap.add_argument("csv")
+    ap.add_argument("--column", default=PAYLOAD_COLUMN)
+    ap.add_argument("--mqtt5", action="store_true", help="PUBLISH frames carry MQTT 5 properties")
+    ap.add_argument("--compare", action="store_true", help="Check against the mqtt.* columns of the CSV")
+    ap.add_argument("--repeat", type=int, default=1, help="Tile the column N times to measure throughput")
+    ap.add_argument("--out", default=None, help="Write the PUBLISH stream (row, topic, qos, retain, payload) as CSV")
+    args = ap.parse_args()
+
+    df = pd.read_csv(args.csv, usecols=[args.column], dtype={args.column: "string"})
+    cells = df[args.column]
+    if args.repeat > 1:
+        cells = pd.concat([cells] * args.repeat, ignore_index=True)
+    t0 = time.perf_counter()
+    frames = parse_column(cells, args.mqtt5)
+    elapsed = time.perf_counter() - t0
+    counts = pd.Series(frames.type).map(MQTT_TYPES).value_counts()
+    print(f"{args.csv}: {frames.cells} cells -> {len(frames)} frames, {frames.malformed} malformed "
+          f"in {elapsed * 1000:.1f} ms ({len(frames) / max(elapsed, 1e-9) * 60 / 1e6:.1f} M frames/min)")
+    print("  " + ", ".join(f"{name}={n}" for name, n in counts.items()))
+    publish = frames.type == 3
+    if publish.any():
+        topics = pd.Series(frames.topics()[publish]).value_counts().head(5)
+        qos = pd.Series(frames.qos[publish]).value_counts().sort_index()
+        print(f"  PUBLISH qos={ {int(k): int(n) for k, n in qos.items()} } "
+              f"retain={int(frames.retain[publish].sum())} "
+              f"payload p50={int(np.median(frames.payload_len[publish]))} B; topics: "
+              + ", ".join(f"{t} ({n})" for t, n in topics.items()))
+    if args.compare:
+        if args.repeat > 1:
+            ap.error("--compare needs --repeat 1")
+        for col, (same, total) in compare(frames, args.csv).items():
+            print(f"  {col}: {same}/{total} match")
+    if args.out:
+        stream = frames.to_frame(payload_hex=True)
+        stream = stream[stream["type"] == 3][["row", "topic", "qos", "retain", "dup", "packet_id", "payload"]]
+        stream.to_csv(args.out, index=False)
+        print(f"  {len(stream)} PUBLISH rows -> {args.out} ({os.path.getsize(args.out)} B)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Edge-gateway topology for the replayers
+---------------------------------------
+- Gom DEVICES thành nhóm K device; mỗi nhóm dùng chung một kết nối MQTT/TLS
+- Gateway publish thay cho device lên đúng topic riêng của từng device
+- Sinh ACL (EMQX file authorizer) cho user gateway
+- TopologyStats đếm số kết nối và số message để so sánh chi phí broker / message
+  giữa hai topology (một kết nối mỗi device vs. một kết nối mỗi gateway)
+Usage:
+  python replayer_office.py --gateway-size 50 --gateway-password gw123
+  python replayer_office.py --gateway-size 50 --print-gateway-acl >> acl.txt
+"""
+
+from __future__ import annotations
+import threading, time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import replay_reconnect
+
+
+@dataclass
+class Gateway:
+    username: str
+    client_id: str
+    members: List[str] = field(default_factory=list)   # device usernames
+
+
+def plan_gateways(devices: Sequence[Tuple[str, str, str, str]], size: int, zone: str) -> List[Gateway]:
+    """Split DEVICES (name, csv, username, password) into gateways of `size` devices, in order."""
+    size = max(1, int(size))
+    gateways: List[Gateway] = []
+    for start in range(0, len(devices), size):
+        username = f"{zone}-gateway{len(gateways) + 1}"
+        gw = Gateway(username=username, client_id=f"{zone}-{username}-replayer")
+        gw.members = [d[2] for d in devices[start:start + size]]
+        gateways.append(gw)
+    return gateways
+
+
+def acl_rules(gateways: Sequence[Gateway], tenant: str, title: str = "GATEWAYS") -> str:
+    """EMQX file-authorizer rules letting each gateway publish only on its members' topics."""
+    lines = [f"% ===================== {tenant.upper()} {title} ====================="]
+    for gw in gateways:
+        topics = ",\n    ".join(f'"factory/{tenant}/{u}/telemetry"' for u in gw.members)
+        lines.append(f'{{allow, {{username, "{gw.username}"}}, publish, [\n    {topics}\n]}}.')
+    return "\n".join(lines) + "\n"
+
+
+class TopologyStats:
+    """Counts connections and published messages of one replayer process."""
+
+    def __init__(self, topology: str):
+        self.topology = topology
+        self.connections = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+
+    def track(self, client) -> None:
+        with self._lock:
+            self.connections += 1
+        client.on_publish = self._on_publish
+
+    def _on_publish(self, client, userdata, mid, *args) -> None:
+        with self._lock:
+            self.messages += 1
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self._t0, 1e-9)
+        conns = max(self.connections, 1)
+        return (f"topology={self.topology} connections={self.connections} messages={self.messages} "
+                f"msg/s={self.messages / elapsed:.1f} msg/s/conn={self.messages / elapsed / conns:.2f}")
+
+
+class GatewayPool:
+    """Lazily connects one shared client per gateway and hands it to member device threads."""
+
+    def __init__(self, gateways: Sequence[Gateway], factory: Callable[..., object],
+                 broker: str, port: int, password: Optional[str], stats: Optional[TopologyStats] = None,
+                 label: str = "gateway", reconnect: Optional[replay_reconnect.ReconnectPolicy] = None):
+        self.gateways = list(gateways)
+        self.factory = factory
+        self.broker = broker
+        self.port = port
+        self.password = password
+        self.stats = stats
+        self.label = label
+        self.reconnect = reconnect or replay_reconnect.ReconnectPolicy()
+        self._by_device: Dict[str, Gateway] = {u: gw for gw in self.gateways for u in gw.members}
+        self._locks: Dict[str, threading.Lock] = {gw.username: threading.Lock() for gw in self.gateways}
+        self._clients: Dict[str, list] = {}   # gateway username -> [client, refcount]
+
+    def gateway_for(self, device_username: str) -> Gateway:
+        return self._by_device[device_username]
+
+    def acquire(self, device_username: str):
+        gw = self.gateway_for(device_username)
+        with self._locks[gw.username]:
+            entry = self._clients.get(gw.username)
+            if entry is None:
+                client = self.factory(gw.client_id, gw.username, self.password)
+                if self.stats is not None:
+                    self.stats.track(client)
+                self.reconnect.install(client, f"{self.label}:{gw.username}")
+                self.reconnect.connect(client, self.broker, self.port, f"{self.label}:{gw.username}")
+                client.loop_start()
+                print(f"[{self.label}:{gw.username}] Connected to {self.broker}:{self.port} "
+                      f"for {len(gw.members)} devices")
+                entry = self._clients[gw.username] = [client, 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, device_username: str) -> None:
+        gw = self.gateway_for(device_username)
+        with self._locks[gw.username]:
+            entry = self._clients.get(gw.username)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._clients[gw.username]
+                entry[0].loop_stop()
+                entry[0].disconnect()
+
+
+def add_arguments(parser) -> None:
+    g = parser.add_argument_group("gateway topology")
+    g.add_argument("--gateway-size", type=int, default=0,
+                   help="Devices per gateway connection (0 = one connection per device, the default)")
+    g.add_argument("--gateway-password", default=None, help="Password shared by the gateway users")
+    g.add_argument("--print-gateway-acl", action="store_true",
+                   help="Print EMQX ACL rules for the gateway users and exit")
+    g.add_argument("--stats-interval", type=float, default=10.0,
+                   help="Seconds between connection/message summaries (0 disables)")
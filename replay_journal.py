@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+Append-only binary journal of exactly what the replayers published
+------------------------------------------------------------------
+- Ghi (monotonic time, topic id, QoS, payload bytes) cho từng PUBLISH
+- Hot path chỉ tra topic id + đẩy tuple vào queue; thread nền lo pack + ghi file
+- Topic được ghi một lần dưới dạng record định nghĩa, message chỉ mang topic id
+- Reader dùng mmap; lệnh replay publish lại byte-for-byte theo timing gốc
+  (hoặc nhân/chia tốc độ)
+
+File layout (little endian):
+  header  : b"RJNL" u16 version
+  topic   : u8 1, u32 topic_id, u16 len, topic utf-8
+  message : u8 2, f64 t (s since journal start), u32 topic_id, u8 qos, u32 len, payload
+Usage:
+  python replayer_office.py --journal runs/office.rjnl ...
+  python replay_journal.py info runs/office.rjnl
+  python replay_journal.py replay runs/office.rjnl --broker emqx --port 8883 \\
+      --username <user allowed on the journal topics> --password ... --speed 2
+"""
+
+from __future__ import annotations
+import argparse, mmap, os, queue, ssl, struct, threading, time
+from typing import Callable, Dict, Iterator, Tuple
+
+MAGIC = b"RJNL"
+VERSION = 1
+_HEADER = struct.Struct("<4sH")
+_TOPIC = struct.Struct("<BIH")
+_MSG = struct.Struct("<BdIBI")
+REC_TOPIC = 1
+REC_MSG = 2
+
+_STOP = object()
+
+
+class JournalWriter:
+    """Background writer; record() is safe to call from any publishing thread."""
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.records = 0
+        self._topics: Dict[str, int] = {}
+        self._topics_lock = threading.Lock()
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._t0 = time.monotonic()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._file = open(path, "ab")
+        size = self._file.tell()
+        if 0 < size < _HEADER.size:
+            print(f"[journal] {path}: torn header ({size} B), starting it over")
+            self._file.truncate(0)
+            size = 0
+        if size == 0:
+            self._file.write(_HEADER.pack(MAGIC, VERSION))
+        else:
+            # appending to an existing journal: continue its topic ids and clock
+            reader = JournalReader(path)
+            try:
+                for rec in reader.records():
+                    if rec[0] == REC_TOPIC:
+                        self._topics[rec[2]] = rec[1]
+                    else:
+                        self._t0 = time.monotonic() - rec[1]
+            except ValueError:
+                if reader.complete == 0:
+                    raise   # not a journal at all: refuse rather than destroy it
+            if reader.complete < size:
+                # a crash left a partial record; appending after it would make every new record unreadable
+                print(f"[journal] {path}: dropping {size - reader.complete} B of incomplete record(s) "
+                      f"at offset {reader.complete}")
+                self._file.truncate(reader.complete)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def record(self, topic: str, payload, qos: int = 0) -> None:
+        tid = self._topics.get(topic)
+        if tid is None:
+            with self._topics_lock:
+                tid = self._topics.get(topic)
+                if tid is None:
+                    tid = len(self._topics) + 1
+                    self._queue.put((REC_TOPIC, tid, topic))
+                    self._topics[topic] = tid
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        elif payload is None:
+            payload = b""
+        self._queue.put((REC_MSG, time.monotonic() - self._t0, tid, qos, bytes(payload)))
+
+    def wrap(self, publish: Callable) -> Callable:
+        """Publish callable that journals every message before sending it."""
+
+        def journaled(topic: str, payload=None, qos: int = 0, retain: bool = False, **kw):
+            self.record(topic, payload, qos)
+            return publish(topic, payload, qos, retain, **kw)
+
+        return journaled
+
+    def close(self) -> None:
+        self._queue.put(_STOP)
+        self._thread.join(timeout=10)
+
+    def _run(self) -> None:
+        f = self._file
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                if item[0] == REC_TOPIC:
+                    raw = item[2].encode("utf-8")
+                    f.write(_TOPIC.pack(REC_TOPIC, item[1], len(raw)))
+                    f.write(raw)
+                else:
+                    _, t, tid, qos, payload = item
+                    f.write(_MSG.pack(REC_MSG, t, tid, qos, len(payload)))
+                    f.write(payload)
+                    self.records += 1
+            if time.monotonic() - last_flush >= self.flush_interval:
+                f.flush()
+                last_flush = time.monotonic()
+        f.flush()
+        f.close()
+
+
+class JournalReader:
+    """Memory-mapped reader; only the records being visited are paged in."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.topics: Dict[int, str] = {}
+        # byte offset just past the last complete record seen by records()
+        self.complete = 0
+
+    def records(self) -> Iterator[Tuple]:
+        """Raw records: (REC_TOPIC, id, topic) or (REC_MSG, t, topic_id, qos, payload bytes)."""
+        self.complete = 0
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < _HEADER.size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                magic, version = _HEADER.unpack_from(mm, 0)
+                if magic != MAGIC or version != VERSION:
+                    raise ValueError(f"{self.path}: not a replay journal (v{VERSION})")
+                pos, end = _HEADER.size, len(mm)
+                self.complete = pos
+                while pos < end:
+                    kind = mm[pos]
+                    if kind == REC_TOPIC:
+                        if pos + _TOPIC.size > end:
+                            break
+                        _, tid, n = _TOPIC.unpack_from(mm, pos)
+                        pos += _TOPIC.size
+                        if pos + n > end:
+                            break
+                        topic = mm[pos:pos + n].decode("utf-8")
+                        pos += n
+                        self.topics[tid] = topic
+                        self.complete = pos
+                        yield (REC_TOPIC, tid, topic)
+                    elif kind == REC_MSG:
+                        if pos + _MSG.size > end:
+                            break
+                        _, t, tid, qos, n = _MSG.unpack_from(mm, pos)
+                        pos += _MSG.size
+                        if pos + n > end:
+                            break   # torn tail of a journal that is still being written
+                        payload = mm[pos:pos + n]
+                        pos += n
+                        self.complete = pos
+                        yield (REC_MSG, t, tid, qos, payload)
+                    else:
+                        raise ValueError(f"{self.path}: corrupt record at offset {pos}")
+
+    def messages(self) -> Iterator[Tuple[float, str, bytes, int]]:
+        for rec in self.records():
+            if rec[0] == REC_MSG:
+                yield rec[1], self.topics[rec[2]], rec[4], rec[3]
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--journal", default=None,
+                        help="Append every published message to this binary journal")
+
+
+# -----------------------------------------------------------------------------
+# CLI: info / replay
+# -----------------------------------------------------------------------------
+def _mk_client(args):
+    import paho.mqtt.client as mqtt
+    c = mqtt.Client(client_id=args.client_id)
+    if args.username:
+        c.username_pw_set(args.username, args.password)
+    if args.port == 8883 or args.tls:
+        ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=args.cafile)
+        c.tls_set_context(ctx)
+    return c
+
+def cmd_info(args) -> None:
+    reader = JournalReader(args.journal)
+    count, size, first, last = 0, 0, None, None
+    per_topic: Dict[str, int] = {}
+    for t, topic, payload, _ in reader.messages():
+        count += 1
+        size += len(payload)
+        first = t if first is None else first
+        last = t
+        per_topic[topic] = per_topic.get(topic, 0) + 1
+    if not count:
+        print(f"{args.journal}: empty")
+        return
+    span = max((last or 0) - (first or 0), 1e-9)
+    print(f"{args.journal}: {count} messages, {len(per_topic)} topics, {size} payload bytes, "
+          f"{span:.1f}s ({count / span:.1f} msg/s)")
+    for topic, n in sorted(per_topic.items(), key=lambda kv: -kv[1])[:args.top]:
+        print(f"  {n:8d}  {topic}")
+
+def cmd_replay(args) -> None:
+    client = _mk_client(args)
+    client.connect(args.broker, args.port, keepalive=60)
+    client.loop_start()
+    speed = max(args.speed, 1e-6)
+    sent, start, first = 0, None, None
+    try:
+        for t, topic, payload, qos in JournalReader(args.journal).messages():
+            if start is None:
+                start, first = time.monotonic(), t
+            delay = start + (t - first) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            client.publish(topic, payload, qos)
+            sent += 1
+    finally:
+        print(f"Replayed {sent} messages from {args.journal}")
+        client.loop_stop()
+        client.disconnect()
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect or re-publish a replay journal")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("info", help="Summarize a journal")
+    p.add_argument("journal")
+    p.add_argument("--top", type=int, default=10)
+    p.set_defaults(func=cmd_info)
+    p = sub.add_parser("replay", help="Re-publish a journal byte-for-byte")
+    p.add_argument("journal")
+    p.add_argument("--broker", default="emqx")
+    p.add_argument("--port", type=int, default=8883)
+    p.add_argument("--username", default=None, help="User whose ACL allows publishing on the journal topics")
+    p.add_argument("--password", default=None)
+    p.add_argument("--client-id", default="journal-replayer")
+    p.add_argument("--tls", action="store_true", help="Force TLS (implied on port 8883)")
+    p.add_argument("--cafile", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "certs", "ca-cert.pem"))
+    p.add_argument("--speed", type=float, default=1.0, help=">1 replays faster than recorded")
+    p.set_defaults(func=cmd_replay)
+    args = ap.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
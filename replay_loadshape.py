@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Load-shape profiles: ramps, steps, diurnal curves and bursts
+------------------------------------------------------------
+- --speed-factor là hằng số cho cả run; capacity test cần tải thay đổi theo
+  thời gian. Profile là một file JSON nhỏ gồm các segment nối tiếp nhau, mỗi
+  segment cho hệ số nhân tốc độ x(t) (1 = đúng --speed-factor, 2 = nhanh gấp đôi)
+    hold    : {"duration": 60, "rate": 2}
+    ramp    : {"duration": 300, "from": 1, "to": 10}
+    steps   : {"duration": 600, "levels": [1, 2, 4, 8]}   (chia đều duration)
+    diurnal : {"duration": 3600, "min": 0.2, "max": 3, "peak": 0.58}
+              (24h nén vào duration, đỉnh tại 58% ngày ~ 14:00)
+    burst   : {"duration": 600, "base": 1, "rate": 20, "every": 60, "length": 5}
+  Hết profile: "repeat": true thì lặp lại, không thì giữ giá trị cuối
+- Áp dụng trong scheduler của device_thread: deadline kế tiếp là thời điểm
+  mà tích phân x(t) đủ bằng interval của row, nên một interval dài vẫn bị
+  co/giãn đúng khi burst hay ramp bắt đầu giữa chừng; không cấu hình profile
+  thì hot path không đổi
+- Mỗi giây log tốc độ yêu cầu (tổng msg/s gốc của các device x hệ số) và tốc
+  độ đạt được (publish thực tế), in ra và append JSONL vào --load-log
+Usage:
+  python replayer_storage.py --load-profile profiles/ramp.json --load-log load_storage.jsonl
+  python replay_loadshape.py profiles/diurnal.json --step 60       # xem trước hệ số
+Profile:
+  {"repeat": false, "segments": [
+      {"type": "ramp", "duration": 300, "from": 1, "to": 10},
+      {"type": "burst", "duration": 600, "base": 10, "rate": 40, "every": 60, "length": 5}]}
+"""
+
+from __future__ import annotations
+import bisect, json, math, threading, time
+from typing import Dict, List, Optional
+
+# continuous segments are integrated in slices of this many seconds
+RESOLUTION = 0.25
+# a 0 rate pauses a device; it is floored so a paused schedule still ends
+MIN_MULTIPLIER = 1e-3
+
+
+class Segment:
+    """x(t) over [0, duration); edge() is the next change point of a piecewise-constant segment."""
+
+    def __init__(self, duration: float):
+        if duration <= 0:
+            raise ValueError("segment duration must be > 0")
+        self.duration = float(duration)
+
+    def value(self, t: float) -> float:
+        raise NotImplementedError
+
+    def edge(self, t: float) -> Optional[float]:
+        return None
+
+
+class Hold(Segment):
+    def __init__(self, duration: float, rate: float):
+        super().__init__(duration)
+        self.rate = float(rate)
+
+    def value(self, t: float) -> float:
+        return self.rate
+
+    def edge(self, t: float) -> Optional[float]:
+        return self.duration
+
+
+class Ramp(Segment):
+    def __init__(self, duration: float, start: float, end: float):
+        super().__init__(duration)
+        self.start, self.end = float(start), float(end)
+
+    def value(self, t: float) -> float:
+        return self.start + (self.end - self.start) * min(max(t / self.duration, 0.0), 1.0)
+
+
+class Steps(Segment):
+    def __init__(self, duration: float, levels: List[float]):
+        super().__init__(duration)
+        if not levels:
+            raise ValueError("steps needs at least one level")
+        self.levels = [float(v) for v in levels]
+        self.span = self.duration / len(self.levels)
+
+    def value(self, t: float) -> float:
+        return self.levels[min(int(t / self.span), len(self.levels) - 1)]
+
+    def edge(self, t: float) -> Optional[float]:
+        return min((int(t / self.span) + 1) * self.span, self.duration)
+
+
+class Diurnal(Segment):
+    def __init__(self, duration: float, low: float, high: float, peak: float = 14 / 24):
+        super().__init__(duration)
+        self.low, self.high, self.peak = float(low), float(high), float(peak)
+
+    def value(self, t: float) -> float:
+        day = t / self.duration
+        return self.low + (self.high - self.low) * 0.5 * (1 + math.cos(2 * math.pi * (day - self.peak)))
+
+
+class Burst(Segment):
+    def __init__(self, duration: float, base: float, rate: float, every: float, length: float):
+        super().__init__(duration)
+        if every <= 0 or not 0 < length <= every:
+            raise ValueError("burst needs every > 0 and 0 < length <= every")
+        self.base, self.rate, self.every, self.length = float(base), float(rate), float(every), float(length)
+
+    def value(self, t: float) -> float:
+        return self.rate if t % self.every < self.length else self.base
+
+    def edge(self, t: float) -> Optional[float]:
+        start = t - t % self.every
+        nxt = start + self.length if t % self.every < self.length else start + self.every
+        return min(nxt, self.duration)
+
+
+def segment_from_dict(d: Dict) -> Segment:
+    kind = d.get("type")
+    if kind == "hold":
+        return Hold(d["duration"], d["rate"])
+    if kind == "ramp":
+        return Ramp(d["duration"], d["from"], d["to"])
+    if kind == "steps":
+        return Steps(d["duration"], d["levels"])
+    if kind == "diurnal":
+        return Diurnal(d["duration"], d["min"], d["max"], d.get("peak", 14 / 24))
+    if kind == "burst":
+        return Burst(d["duration"], d.get("base", 1.0), d["rate"], d["every"], d["length"])
+    raise ValueError(f"unknown load segment type {kind!r}")
+
+
+class LoadShape:
+    """Time-varying speed multiplier shared by every device of a process."""
+
+    def __init__(self, segments: List[Segment], repeat: bool = False, name: str = "profile"):
+        if not segments:
+            raise ValueError("load profile has no segments")
+        self.segments = segments
+        self.repeat = repeat
+        self.name = name
+        self.starts: List[float] = []
+        total = 0.0
+        for seg in segments:
+            self.starts.append(total)
+            total += seg.duration
+        self.length = total
+        self.t0 = time.monotonic()
+        self.sent = 0
+        self._base: Dict[int, float] = {}
+        self.base_rate = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> "LoadShape":
+        with open(path, encoding="utf-8") as f:
+            doc = json.load(f)
+        if isinstance(doc, list):
+            doc = {"segments": doc}
+        return cls([segment_from_dict(s) for s in doc["segments"]], bool(doc.get("repeat", False)), path)
+
+    def _locate(self, t: float):
+        """(segment, time inside it, absolute start of it) for t seconds into the run."""
+        if t < 0:
+            t = 0.0
+        offset = 0.0
+        if t >= self.length:
+            if not self.repeat:
+                seg = self.segments[-1]
+                return seg, seg.duration, None
+            offset = t - t % self.length
+            t -= offset
+        k = bisect.bisect_right(self.starts, t) - 1
+        return self.segments[k], t - self.starts[k], offset + self.starts[k]
+
+    def at(self, t: float) -> float:
+        """Multiplier t seconds after the run started."""
+        seg, local, _ = self._locate(t)
+        return seg.value(local)
+
+    def advance(self, now: float, work: float) -> float:
+        """Monotonic time at which `work` seconds of the x1 schedule have elapsed after `now`."""
+        t = now - self.t0
+        while work > 1e-12:
+            seg, local, start = self._locate(t)
+            if start is None:
+                # past a non-repeating profile: the last value holds forever
+                return self.t0 + t + work / max(seg.value(local), MIN_MULTIPLIER)
+            edge = seg.edge(local)
+            if edge is None:
+                # continuous segment: midpoint value of a short slice
+                edge = min(local + RESOLUTION, seg.duration)
+                x = seg.value((local + edge) / 2)
+            else:
+                x = seg.value(local)
+            x = max(x, MIN_MULTIPLIER)
+            span = max(start + edge - t, 1e-9)
+            if work <= span * x:
+                return self.t0 + t + work / x
+            work -= span * x
+            t += span
+        return self.t0 + t
+
+    # -- achieved vs requested -------------------------------------------------
+    def register(self, intervals, publish, devices: int = 1) -> None:
+        """Add the x1 publish rate of `devices` devices replaying these scaled intervals.
+
+        Devices sharing a scaled interval array share the computation.
+        """
+        key = id(intervals)
+        with self._lock:
+            rate = self._base.get(key)
+            if rate is None:
+                loop = sum(intervals)
+                rate = self._base[key] = publish.count() / loop if loop > 0 else 0.0
+            self.base_rate += rate * devices
+
+    def count(self) -> None:
+        with self._lock:
+            self.sent += 1
+
+
+def start_reporter(shape: LoadShape, label: str, path: Optional[str] = None,
+                   interval: float = 1.0) -> threading.Thread:
+    """Every `interval` s: requested (base rate x multiplier) vs achieved publishes/s."""
+
+    def run():
+        last_t, last_sent = time.monotonic(), shape.sent
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            sent = shape.sent
+            elapsed = max(now - last_t, 1e-9)
+            t = now - shape.t0
+            # average multiplier over the last interval, sampled like the scheduler integrates it
+            n = max(1, int(elapsed / RESOLUTION))
+            x = sum(shape.at(t - elapsed + (k + 0.5) * elapsed / n) for k in range(n)) / n
+            requested = shape.base_rate * x
+            achieved = (sent - last_sent) / elapsed
+            last_t, last_sent = now, sent
+            print(f"[{label}:load] t={t:.0f}s x{x:.2f} requested={requested:.1f} msg/s "
+                  f"achieved={achieved:.1f} msg/s")
+            if path:
+                line = {"time": time.time(), "t": round(t, 3), "multiplier": round(x, 4),
+                        "requested": round(requested, 3), "achieved": round(achieved, 3)}
+                try:
+                    with open(path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(line) + "\n")
+                except OSError as e:
+                    print(f"[{label}:load] Could not write {path}: {e}")
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--load-profile", default=None,
+                        help="JSON load-shape profile modulating the publish rate over time")
+    parser.add_argument("--load-log", default=None,
+                        help="Append requested vs achieved msg/s each second as JSON lines")
+
+
+def main():
+    import argparse
+    ap = argparse.ArgumentParser(description="Preview the multiplier of a load-shape profile")
+    ap.add_argument("profile")
+    ap.add_argument("--step", type=float, default=10.0, help="Seconds between printed samples")
+    ap.add_argument("--seconds", type=float, default=None, help="How far to preview (default: one pass)")
+    args = ap.parse_args()
+    shape = LoadShape.load(args.profile)
+    end = args.seconds if args.seconds is not None else shape.length
+    t = 0.0
+    while t <= end:
+        x = shape.at(t)
+        print(f"{t:8.1f}s  x{x:6.2f}  " + "#" * min(80, int(round(x * 4))))
+        t += args.step
+    # the x1 schedule time one pass of the profile is worth
+    print(f"{shape.length:g}s profile = {sum(_mean(seg) for seg in shape.segments):.1f}s "
+          f"of x1 schedule")
+
+
+def _mean(seg: Segment, n: int = 1000) -> float:
+    return sum(seg.value((k + 0.5) * seg.duration / n) for k in range(n)) * seg.duration / n
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Small, dependency-free metrics used by replayers, subscribers and benchmarks
+---------------------------------------------------------------------------
+- Histogram: log-bucket (≈5% resolution) cho latency / lateness, bộ nhớ cố định,
+  thread-safe, percentile xấp xỉ
+- rss_bytes() / cpu_seconds(): đọc tài nguyên của chính process
+"""
+
+from __future__ import annotations
+import math, threading, time
+from typing import Dict, List, Optional
+
+_MIN = 1e-6          # 1 µs
+_GROWTH = 1.05       # bucket width ratio
+_BUCKETS = int(math.log(1e3 / _MIN, _GROWTH)) + 2   # up to ~1000 s
+_LOG_GROWTH = math.log(_GROWTH)
+
+
+class Histogram:
+    """Log-bucketed histogram of non-negative seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.counts: List[int] = [0] * _BUCKETS
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        if seconds <= _MIN:
+            idx = 0
+        else:
+            idx = min(_BUCKETS - 1, int(math.log(seconds / _MIN) / _LOG_GROWTH) + 1)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def merge(self, other: "Histogram") -> None:
+        with other._lock:
+            counts, count, total, mx = list(other.counts), other.count, other.total, other.max
+        with self._lock:
+            self.counts = [a + b for a, b in zip(self.counts, counts)]
+            self.count += count
+            self.total += total
+            self.max = max(self.max, mx)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * (self.count - 1)
+            seen = 0
+            for idx, c in enumerate(self.counts):
+                seen += c
+                if seen > rank:
+                    # upper edge of the bucket, capped by the observed max
+                    return min(self.max, 0.0 if idx == 0 else _MIN * _GROWTH ** idx)
+        return self.max
+
+    def summary(self, scale: float = 1000.0) -> Dict[str, Optional[float]]:
+        """count/mean/p50/p90/p99/max, values multiplied by scale (default: ms)."""
+        def s(v):
+            return None if v is None else round(v * scale, 3)
+        mean = self.total / self.count if self.count else None
+        return {"count": self.count, "mean": s(mean), "p50": s(self.quantile(0.50)),
+                "p90": s(self.quantile(0.90)), "p99": s(self.quantile(0.99)),
+                "max": s(self.max if self.count else None)}
+
+
+def rss_bytes() -> int:
+    """Current resident set size (Linux /proc), falling back to the peak RSS."""
+    try:
+        with open("/proc/self/status", "rb") as f:
+            for line in f:
+                if line.startswith(b"VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource   # not available on Windows
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def cpu_seconds() -> float:
+    """User + system CPU of this process at the clock's full resolution (os.times ticks at 10 ms)."""
+    return time.process_time()
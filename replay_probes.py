@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency probes: replayer -> EMQX -> subscriber
+---------------------------------------------------------
+- Replayer (--probes) thêm vào mỗi reading:
+    "seq"     : số thứ tự tăng dần theo device (không reset khi dataset lặp lại)
+    "send_ns" : time.time_ns() lúc tạo reading
+    "run"     : nonce của process replayer (RUN_ID), đổi mỗi lần khởi động
+  Trong batch envelope, seq/send_ns đi theo từng reading (run nằm ở envelope),
+  nên latency đo được đã gồm cả thời gian chờ gom batch
+- Subscriber gọi LatencyTracker.observe() cho mỗi reading: histogram latency
+  một chiều + đếm mất (khoảng trống seq) / đảo thứ tự / trùng lặp theo zone;
+  run đổi -> replayer đã restart: giữ tổng cũ, bắt đầu chuỗi seq mới
+- Định kỳ in tóm tắt và append một dòng JSON vào --latency-out
+- Latency một chiều cần đồng hồ replayer và subscriber đồng bộ (NTP/chrony);
+  giá trị âm được đếm riêng là "skewed"
+Usage:
+  python replayer_office.py --probes ...
+  python office_sub.py --latency-interval 10 --latency-out latency_office.jsonl
+"""
+
+from __future__ import annotations
+import json, os, threading, time
+from typing import Any, Dict, Optional
+
+from replay_metrics import Histogram
+
+# boot nonce of this process; a subscriber seeing it change knows the replayer restarted
+RUN_ID = f"{os.getpid():x}-{os.urandom(4).hex()}"
+# payloads without "run" (older replayers): a seq this far behind the highest one means a restart
+RESTART_GAP = 10000
+# how far behind the highest seq a repeat is still recognised as a duplicate
+DUPLICATE_WINDOW = 1024
+
+
+class _Sequence:
+    __slots__ = ("run", "first", "high", "seen", "received", "reordered", "duplicates", "restarts")
+
+    def __init__(self, seq: int, run: Optional[str] = None):
+        self.run = run
+        self.first = seq
+        self.high = seq
+        self.seen = 1           # bit k set: seq high - k arrived
+        self.received = 1
+        self.reordered = 0
+        self.duplicates = 0
+        self.restarts = 0
+
+    def observe(self, seq: int, run: Optional[str] = None) -> None:
+        if run != self.run or (run is None and self.high - seq > RESTART_GAP):
+            # new replayer run: keep the old totals, restart the window
+            self.run = run
+            self.restarts += 1
+            self.first -= (self.high + 1) - seq
+            self.high = seq
+            self.seen = 1
+            self.received += 1
+        elif seq > self.high:
+            self.seen = ((self.seen << (seq - self.high)) | 1) & ((1 << DUPLICATE_WINDOW) - 1)
+            self.high = seq
+            self.received += 1
+        else:
+            bit = 1 << (self.high - seq) if self.high - seq < DUPLICATE_WINDOW else 0
+            if self.seen & bit:
+                self.duplicates += 1
+                return
+            self.seen |= bit
+            self.reordered += 1
+            self.received += 1
+
+    @property
+    def lost(self) -> int:
+        return max(0, (self.high - self.first + 1) - self.received)
+
+
+class _Zone:
+    def __init__(self):
+        self.latency = Histogram()
+        self.devices: Dict[str, _Sequence] = {}
+        self.messages = 0
+        self.unprobed = 0
+        self.skewed = 0
+
+
+class LatencyTracker:
+    """Per-zone latency histograms and loss / reorder counts; thread-safe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._zones: Dict[str, _Zone] = {}
+        self._t0 = time.monotonic()
+
+    def observe(self, reading: Any, recv_ns: Optional[int] = None) -> None:
+        if not isinstance(reading, dict):
+            return
+        if recv_ns is None:
+            recv_ns = time.time_ns()
+        zone_name = str(reading.get("zone") or "unknown")
+        seq, send_ns = reading.get("seq"), reading.get("send_ns")
+        with self._lock:
+            zone = self._zones.get(zone_name)
+            if zone is None:
+                zone = self._zones[zone_name] = _Zone()
+            zone.messages += 1
+            if not isinstance(seq, int) or not isinstance(send_ns, int):
+                zone.unprobed += 1
+                return
+            device = str(reading.get("client_id"))
+            run = reading.get("run")
+            state = zone.devices.get(device)
+            if state is None:
+                zone.devices[device] = _Sequence(seq, run)
+            else:
+                state.observe(seq, run)
+        delay = (recv_ns - send_ns) / 1e9
+        if delay < 0:
+            with self._lock:
+                zone.skewed += 1
+            delay = 0.0
+        zone.latency.add(delay)
+
+    @property
+    def probed(self) -> bool:
+        """True once at least one reading carried a probe."""
+        with self._lock:
+            return any(z.messages > z.unprobed for z in self._zones.values())
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        elapsed = max(time.monotonic() - self._t0, 1e-9)
+        out = {}
+        with self._lock:
+            zones = list(self._zones.items())
+        for name, zone in zones:
+            with self._lock:
+                states = list(zone.devices.values())
+                messages, unprobed, skewed = zone.messages, zone.unprobed, zone.skewed
+            out[name] = {
+                "messages": messages,
+                "msg_per_s": round(messages / elapsed, 2),
+                "devices": len(states),
+                "latency_ms": zone.latency.summary(),
+                "lost": sum(s.lost for s in states),
+                "reordered": sum(s.reordered for s in states),
+                "duplicates": sum(s.duplicates for s in states),
+                "restarts": sum(s.restarts for s in states),
+                "unprobed": unprobed,
+                "skewed": skewed,
+            }
+        return out
+
+    def describe(self) -> str:
+        lines = []
+        for name, z in sorted(self.summary().items()):
+            lat = z["latency_ms"]
+            lines.append(f"[latency:{name}] msgs={z['messages']} devices={z['devices']} "
+                         f"p50={lat['p50']}ms p99={lat['p99']}ms max={lat['max']}ms "
+                         f"lost={z['lost']} reordered={z['reordered']}"
+                         + (f" duplicates={z['duplicates']}" if z["duplicates"] else "")
+                         + (f" unprobed={z['unprobed']}" if z["unprobed"] else "")
+                         + (f" skewed={z['skewed']}" if z["skewed"] else ""))
+        return "\n".join(lines) or "[latency] no messages yet"
+
+
+def start_reporter(tracker: LatencyTracker, interval: float, path: Optional[str] = None) -> Optional[threading.Thread]:
+    """Print the summary every `interval` s and append it as one JSON line to `path`.
+
+    Stays silent until a probed reading arrives, so subscribers of replayers
+    running without --probes print what they always did.
+    """
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            if not tracker.probed:
+                continue
+            print(tracker.describe())
+            if path:
+                line = {"time": time.time(), "zones": tracker.summary()}
+                try:
+                    with open(path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(line) + "\n")
+                except OSError as e:
+                    print(f"[latency] Could not write {path}: {e}")
+
+    t = threading.Thread(target=run, daemon=True)
+    t.start()
+    return t
+
+
+def add_arguments(parser) -> None:
+    """Replayer side."""
+    parser.add_argument("--probes", action="store_true",
+                        help="Embed a per-device seq and send_ns in every reading for latency tracking")
+
+
+def add_subscriber_arguments(parser) -> None:
+    parser.add_argument("--latency-interval", type=float, default=10.0,
+                        help="Seconds between latency summaries (0 = off)")
+    parser.add_argument("--latency-out", default=None,
+                        help="Append each latency summary as a JSON line to this file")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Dataset profiler for load planning
+----------------------------------
+- Đọc mỗi CSV đúng một lần (pandas, vectorized) và tính:
+    rows, publish rows / tỉ lệ publish
+    phân bố inter-arrival giữa các publish và giữa các row (quantile)
+    phân bố kích thước payload gốc (mqtt.msg / payload; hex tính theo byte)
+    msg/s mà một device sinh ra ở --speed-factor / --min-interval cho trước
+- Kết quả lưu ở sidecar <indir>/.cache/<file>.profile.json, khoá bằng
+  sha256 nội dung CSV; size + mtime khớp thì không cần hash lại, nên các lần
+  hỏi sau gần như tức thì, kể cả với speed-factor khác
+- Msg/s tính từ histogram log-bucket của khoảng cách row (chính xác ~5%),
+  nên không cần giữ lại toàn bộ cột thời gian
+- Cùng lần đọc đó cũng ghi schedule cache (.sched) nếu nó đã cũ
+- --zone cộng tải của mọi device trong DEVICES của replayer zone đó
+Usage:
+  python replay_profile.py datasets/air-quality_gotham.csv --speed-factor 10
+  python replay_profile.py --zone office --indir datasets --speed-factor 10 --min-interval 0
+  python replay_profile.py --zone storage --json
+"""
+
+from __future__ import annotations
+import argparse, hashlib, importlib, json, math, os, time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import replay_schedule
+import replay_values
+
+PROFILE_VERSION = 1
+PROFILE_SUFFIX = ".profile.json"
+QUANTILES = (0.5, 0.9, 0.99)
+# gap histogram buckets: [BUCKET_MIN * GROWTH**(k-1), BUCKET_MIN * GROWTH**k)
+BUCKET_MIN = 1e-6
+GROWTH = 1.05
+
+
+def profile_path(csv_path: str) -> str:
+    d, name = os.path.split(csv_path)
+    return os.path.join(d, replay_schedule.CACHE_DIR, name + PROFILE_SUFFIX)
+
+
+def content_hash(path: str, chunk: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _distribution(a) -> Optional[Dict[str, float]]:
+    import numpy as np
+    if len(a) == 0:
+        return None
+    qs = np.quantile(a, QUANTILES)
+    out = {"min": float(a.min())}
+    out.update({f"p{round(q * 100)}": float(v) for q, v in zip(QUANTILES, qs)})
+    out.update({"max": float(a.max()), "mean": float(a.mean())})
+    return {k: round(v, 6) for k, v in out.items()}
+
+
+def _gap_buckets(deltas) -> List[List[float]]:
+    """Non-empty [bucket, count, sum] of the log-bucketed row gaps."""
+    import numpy as np
+    idx = np.zeros(len(deltas), dtype=np.int64)
+    big = deltas > BUCKET_MIN
+    idx[big] = np.floor(np.log(deltas[big] / BUCKET_MIN) / math.log(GROWTH)).astype(np.int64) + 1
+    counts = np.bincount(idx)
+    sums = np.bincount(idx, weights=deltas)
+    return [[int(k), int(counts[k]), float(sums[k])] for k in np.flatnonzero(counts)]
+
+
+def _payload_sizes(df, publish):
+    """Byte sizes of the captured payloads of the publish rows, and the column used."""
+    import numpy as np
+    col = next((c for c in replay_values.PAYLOAD_CANDIDATES if c in df.columns), None)
+    if col is None:
+        return None, None
+    cells = df[col][publish]
+    cells = cells[cells.notna()].astype(str)
+    if cells.empty:
+        return None, col
+    fmt = next((f for f in map(replay_values.detect_format, cells.head(20)) if f is not None), None)
+    sizes = cells.str.len().to_numpy(dtype=np.float64)
+    if fmt is not None and fmt.startswith("hex-"):
+        sizes //= 2
+    return sizes, col
+
+
+def build_profile(csv_path: str, label: Optional[str] = None) -> Dict:
+    """Profile of one dataset from a single CSV scan (also refreshes its schedule cache)."""
+    import numpy as np
+    import pandas as pd
+
+    label = label or os.path.basename(csv_path)
+    t0 = time.perf_counter()
+    df = pd.read_csv(csv_path, low_memory=False)
+    schedule = replay_schedule.schedule_from_frame(df, csv_path, label)
+    cpath = replay_schedule.cache_path(csv_path)
+    if replay_schedule.read_cache(csv_path, cpath) is None:
+        try:
+            replay_schedule.write_cache(schedule, cpath)
+        except OSError as e:
+            print(f"[{label}] Could not write schedule cache {cpath}: {e}")
+
+    deltas = np.frombuffer(schedule.deltas, dtype=np.float64)
+    publish = schedule.publish.unpack()
+    mask = np.frombuffer(bytes(publish), dtype=np.uint8).astype(bool)
+    # publish -> next publish gap, wrapping around the end of the dataset like the replay loop
+    starts = np.concatenate(([0.0], np.cumsum(deltas)))
+    at = starts[:-1][mask]
+    gaps = np.diff(np.concatenate((at, at[:1] + starts[-1]))) if len(at) else at
+    sizes, payload_col = _payload_sizes(df, mask)
+    return {
+        "dataset": os.path.basename(csv_path),
+        "rows": len(schedule),
+        "publish": int(mask.sum()),
+        "publish_ratio": round(float(mask.mean()), 6) if len(mask) else 0.0,
+        "loop_s": round(float(deltas.sum()), 6),
+        "interarrival_s": _distribution(gaps),
+        "row_gap_s": _distribution(deltas),
+        "payload_column": payload_col,
+        "payload_bytes": _distribution(sizes) if sizes is not None else None,
+        "gap_buckets": _gap_buckets(deltas),
+        "scan_ms": round((time.perf_counter() - t0) * 1000, 1),
+    }
+
+
+def _read_sidecar(path: str) -> Optional[Dict]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            doc = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return doc if doc.get("version") == PROFILE_VERSION else None
+
+
+def _write_sidecar(path: str, doc: Dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(doc, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load_profile(csv_path: str, force: bool = False) -> Tuple[Dict, str]:
+    """(profile, "cached" | "rehashed" | "scanned") for csv_path.
+
+    The sidecar is keyed by the CSV's sha256; size + mtime are only a shortcut
+    that skips hashing when the file is untouched.
+    """
+    path = profile_path(csv_path)
+    st = os.stat(csv_path)
+    doc = None if force else _read_sidecar(path)
+    if doc is not None and (doc.get("size"), doc.get("mtime_ns")) == (st.st_size, st.st_mtime_ns):
+        return doc["profile"], "cached"
+    digest = content_hash(csv_path)
+    how = "rehashed"
+    if doc is None or doc.get("sha256") != digest:
+        doc = {"version": PROFILE_VERSION, "sha256": digest, "profile": build_profile(csv_path)}
+        how = "scanned"
+    doc.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+    try:
+        _write_sidecar(path, doc)
+    except OSError as e:
+        print(f"[profile] Could not write {path}: {e}")
+    return doc["profile"], how
+
+
+def implied_rate(profile: Dict, speed_factor: float, min_interval: float) -> Tuple[float, float]:
+    """(messages/s, seconds per dataset loop) of one device replaying this dataset.
+
+    Mirrors Schedule.scaled(): every row sleeps max(gap / speed, min_interval).
+    Only the bucket straddling min_interval * speed is approximated.
+    """
+    speed = max(speed_factor, 1e-6)
+    floor = min_interval * speed
+    total = 0.0
+    for k, count, s in profile["gap_buckets"]:
+        lo = 0.0 if k == 0 else BUCKET_MIN * GROWTH ** (k - 1)
+        hi = BUCKET_MIN * GROWTH ** k
+        if hi <= floor:
+            total += count * floor
+        elif lo >= floor:
+            total += s
+        else:
+            total += max(s, count * floor)
+    loop = total / speed
+    return (profile["publish"] / loop if loop > 0 else 0.0), loop
+
+
+def describe(profile: Dict, speed_factor: float, min_interval: float) -> str:
+    rate, loop = implied_rate(profile, speed_factor, min_interval)
+    gap, size = profile["interarrival_s"] or {}, profile["payload_bytes"] or {}
+    return (f"{profile['dataset']}: rows={profile['rows']} publish={profile['publish']} "
+            f"({profile['publish_ratio'] * 100:.1f}%) "
+            f"gap p50={gap.get('p50')}s p90={gap.get('p90')}s p99={gap.get('p99')}s "
+            f"payload p50={size.get('p50')}B p99={size.get('p99')}B max={size.get('max')}B "
+            f"-> {rate:.4g} msg/s per device (loop {loop:.1f}s)")
+
+
+def zone_profile(devices: Sequence[Tuple[str, str, str, str]], indir: str, speed_factor: float,
+                 min_interval: float, force: bool = False) -> Dict:
+    """Expected publish load of every DEVICES entry whose dataset is present."""
+    datasets: Dict[str, Dict] = {}
+    msg_rate = byte_rate = 0.0
+    devices_seen = 0
+    for _, fname, _, _ in devices:
+        path = os.path.join(indir, fname)
+        if not os.path.exists(path):
+            continue
+        if fname not in datasets:
+            profile, _ = load_profile(path, force)
+            rate, _ = implied_rate(profile, speed_factor, min_interval)
+            datasets[fname] = {"profile": profile, "msg_per_s": rate, "devices": 0}
+        entry = datasets[fname]
+        entry["devices"] += 1
+        devices_seen += 1
+        msg_rate += entry["msg_per_s"]
+        mean = (entry["profile"]["payload_bytes"] or {}).get("mean") or 0.0
+        byte_rate += entry["msg_per_s"] * mean
+    return {"devices": devices_seen, "msg_per_s": round(msg_rate, 3),
+            "payload_bytes_per_s": round(byte_rate, 1), "datasets": datasets}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Profile replay datasets for load planning (cached by content hash)")
+    ap.add_argument("csv", nargs="*", help="Dataset CSV files")
+    ap.add_argument("--zone", default=None, help="Sum the load of every device of replayer_<zone>.py instead")
+    ap.add_argument("--indir", default="datasets")
+    ap.add_argument("--speed-factor", type=float, default=1.0)
+    ap.add_argument("--min-interval", type=float, default=0.05)
+    ap.add_argument("--force", action="store_true", help="Rescan even when the cached profile is current")
+    ap.add_argument("--json", action="store_true", help="Print the profiles as JSON")
+    args = ap.parse_args()
+
+    if args.zone:
+        zone = importlib.import_module(f"replayer_{args.zone}")
+        report = zone_profile(zone.DEVICES, args.indir, args.speed_factor, args.min_interval, args.force)
+        if args.json:
+            print(json.dumps(report, indent=2))
+            return
+        for fname, entry in report["datasets"].items():
+            print(f"{describe(entry['profile'], args.speed_factor, args.min_interval)} x {entry['devices']} devices")
+        print(f"[{args.zone}] {report['devices']} devices: {report['msg_per_s']:.1f} msg/s, "
+              f"~{report['payload_bytes_per_s'] / 1e3:.1f} kB/s of captured payload "
+              f"at speed {args.speed_factor} / min-interval {args.min_interval}")
+        return
+
+    if not args.csv:
+        ap.error("give dataset CSV files or --zone ZONE")
+    profiles = {}
+    for path in args.csv:
+        t0 = time.perf_counter()
+        profile, how = load_profile(path, args.force)
+        profiles[path] = profile
+        if not args.json:
+            print(describe(profile, args.speed_factor, args.min_interval)
+                  + f" [{how}, {(time.perf_counter() - t0) * 1000:.0f} ms]")
+    if args.json:
+        print(json.dumps(profiles, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Client-side token-bucket limits matching the broker quotas
+----------------------------------------------------------
+- EMQX giới hạn message/s và byte/s theo client; với --min-interval 0 replayer
+  vượt quota và bị throttle / disconnect, làm bẩn số đo
+- Ba cấp, mỗi cấp có bucket msg/s và byte/s (0 = không giới hạn):
+    device : một bucket cho mỗi connection MQTT, theo client id (khớp quota
+             per-client của EMQX; device sau một gateway / clone group dùng
+             chung bucket của connection đó)
+    zone   : dùng chung cho mọi device của một zone
+    process: dùng chung cho mọi publish trong process
+- Publish path: reserve ở mọi cấp rồi ngủ một lần theo wait lớn nhất; không
+  cấu hình limit nào thì publish không bị bọc, nên không tốn gì
+- Byte tính theo độ dài UTF-8 của topic + payload (byte trên dây, không phải ký tự)
+- Counter "engaged" cho biết mỗi limiter đã bắt publish chờ bao nhiêu lần
+Usage:
+  python replayer_office.py --min-interval 0 --device-msg-rate 50 --zone-byte-rate 2000000
+"""
+
+from __future__ import annotations
+import threading, time
+from typing import Callable, Dict, List, Optional
+
+
+class TokenBucket:
+    """Refills at `rate` tokens/s up to `capacity`; reserve() may go into debt."""
+
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = max(float(capacity), 1.0)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+
+    def reserve(self, n: float, now: float) -> float:
+        """Take n tokens; returns how long the caller must wait before using them."""
+        tokens = self.tokens + (now - self.stamp) * self.rate
+        if tokens > self.capacity:
+            tokens = self.capacity
+        self.stamp = now
+        self.tokens = tokens - n
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class Limiter:
+    """msg/s and byte/s buckets of one scope, with engagement counters."""
+
+    def __init__(self, name: str, msg_rate: float = 0.0, byte_rate: float = 0.0, burst_s: float = 1.0):
+        self.name = name
+        self.msgs = TokenBucket(msg_rate, msg_rate * burst_s) if msg_rate > 0 else None
+        self.bytes = TokenBucket(byte_rate, byte_rate * burst_s) if byte_rate > 0 else None
+        self.engaged = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int, now: float) -> float:
+        with self._lock:
+            wait = 0.0
+            if self.msgs is not None:
+                wait = self.msgs.reserve(1, now)
+            if self.bytes is not None:
+                wait = max(wait, self.bytes.reserve(nbytes, now))
+            if wait > 0:
+                self.engaged += 1
+                self.waited += wait
+            return wait
+
+
+def _wire_len(s) -> int:
+    """Encoded length; ASCII str (the common case) needs no encode."""
+    if isinstance(s, str) and not s.isascii():
+        return len(s.encode("utf-8"))
+    return len(s)
+
+
+class RateLimits:
+    """Device / zone / process limiters of one replayer process."""
+
+    def __init__(self, device_msg: float = 0.0, device_bytes: float = 0.0,
+                 zone_msg: float = 0.0, zone_bytes: float = 0.0,
+                 process_msg: float = 0.0, process_bytes: float = 0.0, burst_s: float = 1.0):
+        self.device_rates = (device_msg, device_bytes)
+        self.zone_rates = (zone_msg, zone_bytes)
+        self.burst_s = burst_s
+        self.process = Limiter("process", process_msg, process_bytes, burst_s) \
+            if process_msg > 0 or process_bytes > 0 else None
+        self.zones: Dict[str, Limiter] = {}
+        self.devices: Dict[str, Limiter] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args) -> Optional["RateLimits"]:
+        """None when no limit is configured, so the publish path stays unwrapped."""
+        rates = (args.device_msg_rate, args.device_byte_rate, args.zone_msg_rate,
+                 args.zone_byte_rate, args.process_msg_rate, args.process_byte_rate)
+        if not any(r > 0 for r in rates):
+            return None
+        return cls(*rates, burst_s=args.limit_burst)
+
+    def _chain(self, zone: str, client_id: str) -> List[Limiter]:
+        chain = []
+        with self._lock:
+            if any(r > 0 for r in self.device_rates):
+                if client_id not in self.devices:
+                    self.devices[client_id] = Limiter(client_id, *self.device_rates, burst_s=self.burst_s)
+                chain.append(self.devices[client_id])
+            if any(r > 0 for r in self.zone_rates):
+                if zone not in self.zones:
+                    self.zones[zone] = Limiter(zone, *self.zone_rates, burst_s=self.burst_s)
+                chain.append(self.zones[zone])
+        if self.process is not None:
+            chain.append(self.process)
+        return chain
+
+    def wrap(self, publish: Callable, zone: str, client_id: str) -> Callable:
+        """Publish callable that waits for every applicable bucket first.
+
+        `client_id` is the connection the publish goes out on: the broker's
+        per-client quota is shared by every device behind a gateway or clone group.
+        """
+        chain = self._chain(zone, client_id)
+        if not chain:
+            return publish
+        monotonic, sleep = time.monotonic, time.sleep
+
+        def limited(topic: str, payload=None, qos: int = 0, retain: bool = False, **kw):
+            nbytes = _wire_len(topic) + (_wire_len(payload) if payload is not None else 0)
+            now = monotonic()
+            wait = 0.0
+            for limiter in chain:
+                w = limiter.reserve(nbytes, now)
+                if w > wait:
+                    wait = w
+            if wait > 0:
+                sleep(wait)
+            return publish(topic, payload, qos, retain, **kw)
+
+        return limited
+
+    def summary(self) -> str:
+        parts = []
+        with self._lock:
+            devices = list(self.devices.values())
+            zones = list(self.zones.values())
+        if devices:
+            hit = [d for d in devices if d.engaged]
+            parts.append(f"connection engaged={sum(d.engaged for d in devices)} "
+                         f"({len(hit)}/{len(devices)} connections) waited={sum(d.waited for d in devices):.1f}s")
+        for z in zones:
+            parts.append(f"zone:{z.name} engaged={z.engaged} waited={z.waited:.1f}s")
+        if self.process is not None:
+            parts.append(f"process engaged={self.process.engaged} waited={self.process.waited:.1f}s")
+        return "rate limits: " + ("; ".join(parts) or "idle")
+
+
+def add_arguments(parser) -> None:
+    g = parser.add_argument_group("rate limits (0 = unlimited)")
+    g.add_argument("--device-msg-rate", type=float, default=0.0,
+                   help="Messages/s per client connection (a gateway or clone group counts once)")
+    g.add_argument("--device-byte-rate", type=float, default=0.0,
+                   help="Bytes/s per client connection (a gateway or clone group counts once)")
+    g.add_argument("--zone-msg-rate", type=float, default=0.0, help="Messages/s for the whole zone")
+    g.add_argument("--zone-byte-rate", type=float, default=0.0, help="Bytes/s for the whole zone")
+    g.add_argument("--process-msg-rate", type=float, default=0.0, help="Messages/s for this process")
+    g.add_argument("--process-byte-rate", type=float, default=0.0, help="Bytes/s for this process")
+    g.add_argument("--limit-burst", type=float, default=1.0,
+                   help="Bucket depth in seconds of the configured rate")
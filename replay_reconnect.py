@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Reconnect policy shared by replayers and subscribers
+----------------------------------------------------
+- Trước đây: connect lần đầu retry cố định time.sleep(5), reconnect giữa run
+  để paho tự lo (1s -> 120s, không jitter); broker restart là mọi client
+  connect lại cùng một nhịp -> herd
+- Exponential backoff + full jitter: chờ uniform(0, min(cap, base * 2^n)),
+  n = số lần thất bại liên tiếp của client đó, reset khi CONNACK thành công
+- Áp cho cả connect ban đầu lẫn auto-reconnect của paho (on_disconnect /
+  on_connect_fail đặt trước delay cho lần thử kế tiếp qua reconnect_delay_set)
+- --reconnect-rate: token bucket chung cho cả process (TokenBucket của
+  replay_ratelimit), giới hạn số lần thử connect mỗi giây
+- Metrics: attempts / connects / failures / disconnects, tốc độ thử trong
+  cửa sổ STORM_WINDOW giây và peak; vượt --reconnect-storm attempts/s là in
+  cảnh báo ngay lúc đó, không chờ tới summary
+- Subscriber subscribe lại trong on_connect, nên mỗi lần reconnect đều có lại
+  subscription (kể cả khi broker không giữ session)
+Usage:
+  python replayer_office.py --reconnect-base 1 --reconnect-cap 60 --reconnect-rate 20
+  python office_sub.py --reconnect-cap 30 --reconnect-report 10
+"""
+
+from __future__ import annotations
+import random, threading, time
+from collections import deque
+from typing import Callable, Optional
+
+from replay_ratelimit import TokenBucket
+
+STORM_WINDOW = 5.0
+
+
+def _disconnect_rc(client, args) -> object:
+    """Reason code of an on_disconnect call.
+
+    paho's VERSION2 API passes (flags, reason_code, properties); VERSION1 passes
+    (rc,) for 3.1.1 and (rc, properties) for v5.
+    """
+    version = getattr(client, "callback_api_version", None)
+    if getattr(version, "name", version) == "VERSION2":
+        return args[1]
+    return args[0] if args else 0
+
+
+class ReconnectPolicy:
+    """Full-jitter exponential backoff plus a process-wide connect-attempt rate limit."""
+
+    def __init__(self, base: float = 1.0, cap: float = 60.0, rate: float = 0.0, burst: float = 1.0,
+                 storm: float = 10.0, seed: Optional[int] = None):
+        self.base = max(base, 0.0)
+        self.cap = max(cap, self.base)
+        self.storm = storm
+        self.bucket = TokenBucket(rate, rate * burst) if rate > 0 else None
+        self.attempts = self.connects = self.failures = self.disconnects = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self.peak_rate = 0.0
+        self._in_storm = False
+        self._recent: deque = deque()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args) -> "ReconnectPolicy":
+        return cls(args.reconnect_base, args.reconnect_cap, args.reconnect_rate,
+                   args.reconnect_burst, args.reconnect_storm)
+
+    def delay(self, failures: int) -> float:
+        """Seconds to wait before the next attempt after `failures` consecutive failures."""
+        with self._lock:
+            wait = self._rng.uniform(0.0, min(self.cap, self.base * 2 ** min(failures, 32))) if failures else 0.0
+            if self.bucket is not None:
+                gate = self.bucket.reserve(1, time.monotonic())
+                if gate > wait:
+                    self.throttled += 1
+                    wait = gate
+            self.waited += wait
+            return wait
+
+    def _attempt(self) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self.attempts += 1
+            recent = self._recent
+            recent.append(now)
+            while recent and now - recent[0] > STORM_WINDOW:
+                recent.popleft()
+            rate = len(recent) / STORM_WINDOW
+            if rate > self.peak_rate:
+                self.peak_rate = rate
+            if self.storm > 0 and rate >= self.storm and not self._in_storm:
+                self._in_storm = True
+                print(f"[reconnect] storm: {len(recent)} connect attempts in the last {STORM_WINDOW:g}s "
+                      f"(failures={self.failures} disconnects={self.disconnects})")
+            elif self._in_storm and rate < self.storm / 2:
+                self._in_storm = False
+                print(f"[reconnect] storm over: {rate:.1f} attempts/s")
+
+    def current_rate(self) -> float:
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for t in self._recent if now - t <= STORM_WINDOW) / STORM_WINDOW
+
+    def connect(self, client, broker: str, port: int, label: str = "mqtt", keepalive: int = 60) -> None:
+        """Blocking first connect, retried with backoff until it succeeds."""
+        failures = 0
+        while True:
+            wait = self.delay(failures)
+            if wait > 0:
+                time.sleep(wait)
+            self._attempt()
+            try:
+                client.connect(broker, port, keepalive=keepalive)
+                return
+            except Exception as e:
+                failures += 1
+                with self._lock:
+                    self.failures += 1
+                print(f"[{label}] Connection failed ({e}), retry #{failures}")
+
+    def install(self, client, label: str = "mqtt") -> None:
+        """Route paho's automatic reconnects through this policy.
+
+        Call after the client's own callbacks are set; they are chained.
+        """
+        failures = [0]
+        user_connect: Optional[Callable] = client.on_connect
+        user_disconnect: Optional[Callable] = client.on_disconnect
+        set_delay = getattr(client, "reconnect_delay_set", None)
+
+        def schedule() -> float:
+            wait = self.delay(failures[0] + 1)
+            failures[0] += 1
+            if set_delay is not None:
+                # paho doubles its own delay between min and max; pinning both makes it ours
+                set_delay(min_delay=max(wait, 0.001), max_delay=max(wait, 0.001))
+            return wait
+
+        def on_connect(client, userdata, flags, rc, properties=None):
+            if rc == 0:
+                failures[0] = 0
+                with self._lock:
+                    self.connects += 1
+            if user_connect is not None:
+                user_connect(client, userdata, flags, rc, properties)
+
+        def on_disconnect(client, userdata, *args):
+            rc = _disconnect_rc(client, args)
+            if rc != 0:
+                with self._lock:
+                    self.disconnects += 1
+                wait = schedule()
+                print(f"[{label}] Disconnected ({rc}), reconnecting in {wait:.1f}s")
+            if user_disconnect is not None:
+                user_disconnect(client, userdata, *args)
+
+        def on_connect_fail(client, userdata):
+            with self._lock:
+                self.failures += 1
+            schedule()
+
+        client.on_connect = on_connect
+        client.on_disconnect = on_disconnect
+        if hasattr(client, "on_connect_fail"):
+            client.on_connect_fail = on_connect_fail
+        reconnect = getattr(client, "reconnect", None)
+        if reconnect is not None:
+            def counted_reconnect(*a, **kw):
+                # connect() also lands here; only the loop's own reconnects are new attempts
+                if failures[0]:
+                    self._attempt()
+                return reconnect(*a, **kw)
+            client.reconnect = counted_reconnect
+
+    def summary(self) -> str:
+        with self._lock:
+            text = (f"reconnect: attempts={self.attempts} connected={self.connects} failures={self.failures} "
+                    f"disconnects={self.disconnects} peak={self.peak_rate:.1f}/s")
+            if self.bucket is not None:
+                text += f" throttled={self.throttled}"
+        return text + f" now={self.current_rate():.1f}/s"
+
+    def start_reporter(self, interval: float) -> Optional[threading.Thread]:
+        """Print the summary every `interval` s while anything changed."""
+        if interval <= 0:
+            return None
+
+        def run():
+            last = None
+            while True:
+                time.sleep(interval)
+                with self._lock:
+                    state = (self.attempts, self.connects, self.failures, self.disconnects)
+                if state != last:
+                    last = state
+                    print(f"[sub] {self.summary()}")
+
+        t = threading.Thread(target=run, daemon=True)
+        t.start()
+        return t
+
+
+def add_arguments(parser, report: bool = False) -> None:
+    g = parser.add_argument_group("reconnect")
+    g.add_argument("--reconnect-base", type=float, default=1.0,
+                   help="First backoff ceiling in seconds (doubles per consecutive failure)")
+    g.add_argument("--reconnect-cap", type=float, default=60.0, help="Maximum backoff ceiling in seconds")
+    g.add_argument("--reconnect-rate", type=float, default=0.0,
+                   help="Connect attempts/s for the whole process (0 = unlimited)")
+    g.add_argument("--reconnect-burst", type=float, default=1.0,
+                   help="Reconnect bucket depth in seconds of --reconnect-rate")
+    g.add_argument("--reconnect-storm", type=float, default=10.0,
+                   help=f"Warn when attempts/s over the last {STORM_WINDOW:g}s reach this (0 = off)")
+    if report:
+        g.add_argument("--reconnect-report", type=float, default=10.0,
+                       help="Seconds between reconnect summaries (printed only when they change)")
@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Replay schedules: compile CSV -> (interval, publish) once, cache as binary
+-------------------------------------------------------------------------
+- Chỉ compile_schedule() mới import pandas; replayer có cache còn hạn, hoặc
+  dùng synthetic schedule (--synthetic-rate), khởi động không cần pandas
+- Cache nhị phân nằm cạnh CSV: <indir>/.cache/<file>.sched, được kiểm tra
+  theo size + mtime của CSV nguồn
+- Trong một process, mỗi CSV chỉ compile / đọc một lần và dùng chung cho mọi
+  device đọc cùng file
+- Nếu dataset có giá trị đo thật (replay_values), cột values float64 được
+  cache cùng schedule; chỉ khi đó numpy mới được import lúc khởi động
+- phase_offset(): lệch pha cố định theo username (row bắt đầu hoặc dịch thời
+  gian), để các device dùng chung một CSV không publish đồng loạt
+- Runtime chỉ giữ: mảng interval float64, publish mask nén 1 bit/row và cột
+  values (nếu có); interval đã scale được dùng chung giữa các device cùng CSV
+  cùng speed/min-interval, nên chi phí riêng mỗi device gần như bằng 0
+- --start/--end: chỉ replay một lát của dataset (row index hoặc epoch); row
+  đầu tìm bằng binary search trên mảng timestamp của cache (mmap), rồi chỉ
+  đọc đúng đoạn đó; device lặp lại trong cửa sổ
+Usage:
+  python replay_schedule.py datasets/*.csv        # build/refresh caches offline
+  python replay_schedule.py --memory-report office --indir datasets
+  python replayer_security.py --start 1736880568 --end 1736884168   # epoch window
+  python replayer_security.py --start 1200 --end 4800                # row window
+"""
+
+from __future__ import annotations
+import bisect, hashlib, mmap, os, struct, threading
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+# -----------------------------------------------------------------------------
+# Canonical column candidates
+# -----------------------------------------------------------------------------
+TIMESTAMP_CANDIDATES = [
+    "timestamp", "ts", "time", "frame.time_epoch", "frame.time_relative",
+    "Time", "SniffTimestamp"
+]
+MSGTYP_CANDIDATES = ["mqtt.msgtype", "msg_type", "message_type", "packet_type", "mqtt.msgtype_str"]
+
+CACHE_DIR = ".cache"
+CACHE_MAGIC = b"RSCH"
+CACHE_VERSION = 4
+# magic, version, source size, source mtime_ns, rows, has values
+_HEADER = struct.Struct("<4sHQqQB")
+
+
+class BitMask:
+    """Read-only 0/1 flags packed 8 per byte (LSB first)."""
+
+    __slots__ = ("bits", "size")
+
+    def __init__(self, bits: bytes, size: int):
+        if len(bits) != (size + 7) // 8:
+            raise ValueError("bit mask length does not match its size")
+        self.bits = bytes(bits)
+        self.size = size
+
+    @classmethod
+    def from_flags(cls, flags: Iterable[int]) -> "BitMask":
+        packed = bytearray()
+        size = acc = 0
+        for flag in flags:
+            if flag:
+                acc |= 1 << (size & 7)
+            size += 1
+            if not size & 7:
+                packed.append(acc)
+                acc = 0
+        if size & 7:
+            packed.append(acc)
+        return cls(packed, size)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> int:
+        if i < 0:
+            i += self.size
+        if not 0 <= i < self.size:
+            raise IndexError("bit mask index out of range")
+        return (self.bits[i >> 3] >> (i & 7)) & 1
+
+    def __iter__(self) -> Iterator[int]:
+        bits = self.bits
+        return ((bits[i >> 3] >> (i & 7)) & 1 for i in range(self.size))
+
+    def count(self) -> int:
+        return sum(bin(b).count("1") for b in self.bits)
+
+    def unpack(self) -> bytearray:
+        return bytearray(self)
+
+    @classmethod
+    def from_range(cls, bits: bytes, offset: int, size: int) -> "BitMask":
+        """size flags starting at bit `offset` of bits."""
+        n = (int.from_bytes(bits, "little") >> offset) & ((1 << size) - 1)
+        return cls(n.to_bytes((size + 7) // 8, "little"), size)
+
+    def slice(self, lo: int, hi: int) -> "BitMask":
+        return BitMask.from_range(self.bits[lo >> 3:(hi + 7) >> 3], lo & 7, hi - lo)
+
+
+@dataclass
+class Schedule:
+    """Raw per-row schedule of one dataset.
+
+    deltas[i] is the unscaled gap (seconds) between row i and row i+1;
+    publish[i] is 1 when row i is an MQTT PUBLISH (bit-packed);
+    values, when the dataset carries readings, is a float64 NumPy column
+    (NaN where row i has no usable value);
+    times[i] is the row's capture time in seconds, made non-decreasing so it
+    can be binary searched; first_row is the source row of index 0 when the
+    schedule is a window of the dataset.
+    """
+    source: str
+    deltas: array
+    publish: BitMask
+    values: Optional[object] = None
+    times: Optional[array] = None
+    first_row: int = 0
+    _scaled: Dict[Tuple[float, float], array] = field(default_factory=dict, repr=False, compare=False)
+
+    def __len__(self) -> int:
+        return len(self.deltas)
+
+    def scaled(self, speed_factor: float, min_interval: float) -> array:
+        """Scaled intervals; one shared array per (speed, min_interval), so treat it as read-only."""
+        key = (float(speed_factor), float(min_interval))
+        intervals = self._scaled.get(key)
+        if intervals is None:
+            speed = max(speed_factor, 1e-6)
+            intervals = array("d", (max(d / speed, min_interval) for d in self.deltas))
+            intervals = self._scaled.setdefault(key, intervals)
+        return intervals
+
+    def window(self, lo: int, hi: int) -> "Schedule":
+        """Rows [lo, hi) as a schedule of their own (looping stays inside them)."""
+        return Schedule(self.source, self.deltas[lo:hi], self.publish.slice(lo, hi),
+                        None if self.values is None else self.values[lo:hi].copy(),
+                        None if self.times is None else self.times[lo:hi], self.first_row + lo)
+
+    def nbytes(self) -> int:
+        """Bytes held by the arrays of this schedule (deltas, mask, values, scaled copies)."""
+        n = len(self.deltas) * self.deltas.itemsize + len(self.publish.bits)
+        if self.values is not None:
+            n += self.values.nbytes
+        if self.times is not None:
+            n += len(self.times) * self.times.itemsize
+        return n + sum(len(a) * a.itemsize for a in self._scaled.values())
+
+
+# -----------------------------------------------------------------------------
+# Compilation (the only pandas path)
+# -----------------------------------------------------------------------------
+def resolve_column(df, candidates: List[str]) -> Optional[str]:
+    for c in candidates:
+        if c in df.columns:
+            return c
+    return None
+
+def _parse_timestamp_series(ts):
+    import pandas as pd
+    if pd.api.types.is_numeric_dtype(ts):
+        s = ts.astype(float)
+        if s.dropna().median() > 1e12:
+            s = s / 1000.0
+        return s
+    dt = pd.to_datetime(ts, errors="coerce", utc=True)
+    # Series.view() is gone in pandas 3; NaT stays NaN this way
+    return (dt - pd.Timestamp(0, tz="UTC")).dt.total_seconds()
+
+def _median_interval(seconds) -> float:
+    diffs = seconds.diff().dropna()
+    if diffs.empty:
+        return 1.0
+    diffs = diffs[diffs > 0]
+    if diffs.empty:
+        return 1.0
+    return float(diffs.median())
+
+def _is_publish(v) -> bool:
+    if v is None or v != v:   # missing / NaN
+        return True
+    try:
+        if str(v).strip().isdigit():
+            return int(v) == 3
+    except Exception:
+        pass
+    s = str(v).lower()
+    return ("publish" in s) and ("command" not in s) and ("req" not in s)
+
+def compile_schedule(csv_path: str, label: str = "schedule") -> Schedule:
+    import pandas as pd
+    return schedule_from_frame(pd.read_csv(csv_path, low_memory=False), csv_path, label)
+
+def schedule_from_frame(df, csv_path: str, label: str = "schedule") -> Schedule:
+    """Schedule of an already loaded dataset frame (one CSV scan shared with other passes)."""
+    import pandas as pd
+
+    ts_col = resolve_column(df, TIMESTAMP_CANDIDATES)
+    msg_col = resolve_column(df, MSGTYP_CANDIDATES)
+
+    if not ts_col:
+        print(f"[{label}] No timestamp column found; using 1.0s default interval.")
+        seconds = pd.Series(range(len(df)), dtype=float)
+        base_interval = 1.0
+    else:
+        seconds = _parse_timestamp_series(df[ts_col]).reset_index(drop=True)
+        base_interval = _median_interval(seconds)
+        if pd.isna(seconds).all():
+            seconds = pd.Series(range(len(df)), dtype=float)
+            base_interval = 1.0
+
+    # gap to the next row; missing, non-positive and the last gap fall back to the median
+    deltas = (seconds.shift(-1) - seconds).astype(float)
+    deltas = deltas.where(deltas > 0, base_interval)
+
+    if msg_col:
+        publish = bytearray(1 if _is_publish(v) else 0 for v in df[msg_col].tolist())
+    else:
+        publish = bytearray(b"\x01" * len(df))
+
+    # searchable capture times: gaps filled forward, then made non-decreasing
+    times = seconds.ffill().fillna(0.0).cummax()
+
+    import replay_values
+    values = replay_values.extract_values(df, publish, csv_path, label)
+    import numpy as np
+    mask = BitMask(np.packbits(np.frombuffer(publish, dtype=np.uint8), bitorder="little").tobytes(), len(publish))
+    return Schedule(csv_path, array("d", deltas.tolist()), mask, values, array("d", times.tolist()))
+
+
+def synthetic_schedule(rate: float) -> Schedule:
+    """Generated load profile: one publish every 1/rate seconds, no dataset needed."""
+    return Schedule(f"synthetic:{rate:g}/s", array("d", [1.0 / max(rate, 1e-6)]), BitMask(b"\x01", 1),
+                    times=array("d", [0.0]))
+
+
+# -----------------------------------------------------------------------------
+# Phase stagger
+# -----------------------------------------------------------------------------
+STAGGER_MODES = ("none", "row", "time")
+
+def phase_fraction(key: str) -> float:
+    """Deterministic value in [0, 1) derived from key (same on every run and host)."""
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2.0 ** 64
+
+def phase_offset(key: str, intervals: Sequence[float], mode: str = "row") -> Tuple[float, int]:
+    """(time shift, start row) for one device.
+
+    row : start at a row picked by key, then follow the dataset's own gaps
+    time: start at row 0 after a shift of up to one mean interval
+    A one-row schedule (synthetic) has no rows to pick from, so row mode
+    falls back to a time shift.
+    """
+    rows = len(intervals)
+    if mode == "none" or rows == 0:
+        return 0.0, 0
+    if mode not in STAGGER_MODES:
+        raise ValueError(f"unknown stagger mode {mode!r}")
+    u = phase_fraction(key)
+    if mode == "row" and rows > 1:
+        return 0.0, int(u * rows)
+    return u * (sum(intervals) / rows), 0
+
+# -----------------------------------------------------------------------------
+# Replay windows
+# -----------------------------------------------------------------------------
+# bare numbers at or above this are epoch seconds, below it row indices
+EPOCH_THRESHOLD = 1e8
+
+Position = Tuple[str, float]   # ("row", index) or ("time", seconds)
+
+def parse_position(spec: Optional[str]) -> Optional[Position]:
+    """--start/--end value: row index, epoch seconds, ISO datetime, or explicit row:N / t:SECONDS."""
+    if spec is None or str(spec).strip() == "":
+        return None
+    s = str(spec).strip()
+    if s.startswith("row:"):
+        return ("row", int(s[4:]))
+    if s.startswith("t:"):
+        return ("time", float(s[2:]))
+    try:
+        v = float(s)
+    except ValueError:
+        from datetime import datetime, timezone
+        dt = datetime.fromisoformat(s)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return ("time", dt.timestamp())
+    if v >= EPOCH_THRESHOLD or not v.is_integer():
+        return ("time", v)
+    return ("row", int(v))
+
+def resolve_window(times: Sequence[float], rows: int, start: Optional[Position] = None,
+                   end: Optional[Position] = None) -> Tuple[int, int]:
+    """[lo, hi) rows selected by start/end (both inclusive); times must be non-decreasing."""
+    lo, hi = 0, rows
+    if start is not None:
+        kind, v = start
+        lo = int(v) if kind == "row" else bisect.bisect_left(times, v)
+    if end is not None:
+        kind, v = end
+        hi = int(v) + 1 if kind == "row" else bisect.bisect_right(times, v)
+    lo, hi = max(0, min(lo, rows)), max(0, min(hi, rows))
+    if hi <= lo:
+        raise ValueError(f"empty replay window (rows {lo}..{hi - 1} of {rows})")
+    return lo, hi
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--stagger", choices=STAGGER_MODES, default="row",
+                        help="Per-username phase offset so devices sharing a CSV do not publish in lockstep")
+    parser.add_argument("--start", default=None,
+                        help="First row to replay: row index, epoch seconds, ISO time, or row:N / t:SECONDS")
+    parser.add_argument("--end", default=None, help="Last row to replay (inclusive), same forms as --start")
+
+def window_from_args(args) -> Optional[Tuple[Optional[Position], Optional[Position]]]:
+    start, end = parse_position(args.start), parse_position(args.end)
+    return (start, end) if start is not None or end is not None else None
+
+
+# -----------------------------------------------------------------------------
+# Binary cache
+# -----------------------------------------------------------------------------
+def cache_path(csv_path: str) -> str:
+    d, name = os.path.split(csv_path)
+    return os.path.join(d, CACHE_DIR, name + ".sched")
+
+def write_cache(schedule: Schedule, path: str) -> None:
+    st = os.stat(schedule.source)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_HEADER.pack(CACHE_MAGIC, CACHE_VERSION, st.st_size, st.st_mtime_ns, len(schedule),
+                             schedule.values is not None))
+        schedule.deltas.tofile(f)
+        schedule.times.tofile(f)
+        f.write(schedule.publish.bits)
+        if schedule.values is not None:
+            f.write(schedule.values.astype("<f8").tobytes())
+    os.replace(tmp, path)
+
+def read_cache(csv_path: str, path: str, window=None) -> Optional[Schedule]:
+    """Cached schedule, or only the rows of window=(start, end) positions.
+
+    The file is mapped, the window is found by binary search on the mapped
+    times array, and only the selected slices are copied out.
+    """
+    try:
+        with open(path, "rb") as f:
+            magic, version, size, mtime_ns, rows, has_values = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != CACHE_MAGIC or version != CACHE_VERSION:
+                return None
+            if os.path.exists(csv_path):
+                st = os.stat(csv_path)
+                if (st.st_size, st.st_mtime_ns) != (size, mtime_ns):
+                    return None
+            col = 8 * rows
+            off_deltas = _HEADER.size
+            off_times = off_deltas + col
+            off_mask = off_times + col
+            off_values = off_mask + (rows + 7) // 8
+            if os.fstat(f.fileno()).st_size != off_values + (col if has_values else 0):
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                lo, hi = 0, rows
+                if window is not None:
+                    with memoryview(mm) as view:
+                        times_view = view[off_times:off_mask].cast("d")
+                        try:
+                            lo, hi = resolve_window(times_view, rows, *window)
+                        finally:
+                            times_view.release()
+                deltas, times = array("d"), array("d")
+                deltas.frombytes(mm[off_deltas + 8 * lo:off_deltas + 8 * hi])
+                times.frombytes(mm[off_times + 8 * lo:off_times + 8 * hi])
+                publish = BitMask.from_range(mm[off_mask + (lo >> 3):off_mask + ((hi + 7) >> 3)], lo & 7, hi - lo)
+                values = None
+                if has_values:
+                    import numpy as np
+                    values = np.frombuffer(mm[off_values + 8 * lo:off_values + 8 * hi], dtype="<f8").copy()
+    except (OSError, EOFError, struct.error):
+        return None
+    return Schedule(csv_path, deltas, publish, values, times, lo)
+
+
+_loaded: Dict[Tuple[str, object], Schedule] = {}
+_locks: Dict[Tuple[str, object], threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+def load_schedule(csv_path: str, label: str = "schedule", use_cache: bool = True, window=None) -> Schedule:
+    """Schedule for csv_path (or its window), shared by every caller in this process.
+
+    window is (start, end) from parse_position(); a ValueError means it selects no rows.
+    """
+    key = (os.path.abspath(csv_path), window)
+    with _locks_guard:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        schedule = _loaded.get(key)
+        if schedule is not None:
+            return schedule
+        cpath = cache_path(csv_path)
+        schedule = read_cache(csv_path, cpath, window) if use_cache else None
+        if schedule is None:
+            full = _loaded.get((key[0], None))
+            if full is None:
+                full = compile_schedule(csv_path, label)
+                if use_cache:
+                    try:
+                        write_cache(full, cpath)
+                    except OSError as e:
+                        print(f"[{label}] Could not write schedule cache {cpath}: {e}")
+                _loaded[(key[0], None)] = full
+            schedule = full if window is None else full.window(*resolve_window(full.times, len(full), *window))
+        if window is not None:
+            print(f"[{label}] Window: rows {schedule.first_row}..{schedule.first_row + len(schedule) - 1}")
+        _loaded[key] = schedule
+        return schedule
+
+
+def memory_report(devices: Sequence[Tuple[str, str, str, str]], indir: str, speed_factor: float,
+                  min_interval: float, dataframe: bool = True) -> List[Dict]:
+    """Bytes per dataset and per device, next to what one DataFrame per device used to hold."""
+    users: Dict[str, List[str]] = {}
+    for _, fname, username, _ in devices:
+        users.setdefault(fname, []).append(username)
+    rows = []
+    for fname, names in users.items():
+        path = os.path.join(indir, fname)
+        if not os.path.exists(path) and not os.path.exists(cache_path(path)):
+            continue
+        schedule = load_schedule(path, fname)
+        schedule.scaled(speed_factor, min_interval)   # the one array every device of this dataset shares
+        shared = schedule.nbytes()
+        entry = {"dataset": fname, "rows": len(schedule), "devices": len(names),
+                 "shared_bytes": shared, "per_device_bytes": round(shared / len(names)),
+                 "dataframe_bytes": None}
+        if dataframe and os.path.exists(path):
+            import pandas as pd
+            entry["dataframe_bytes"] = int(pd.read_csv(path, low_memory=False).memory_usage(deep=True).sum())
+        rows.append(entry)
+    return rows
+
+
+def main():
+    import argparse, importlib, time
+    ap = argparse.ArgumentParser(description="Compile replay CSVs into binary schedule caches")
+    ap.add_argument("csv", nargs="*", help="Dataset CSV files")
+    ap.add_argument("--memory-report", metavar="ZONE", default=None,
+                    help="Print schedule memory per dataset/device for a zone replayer instead")
+    ap.add_argument("--indir", default="datasets")
+    ap.add_argument("--speed-factor", type=float, default=1.0)
+    ap.add_argument("--min-interval", type=float, default=0.05)
+    args = ap.parse_args()
+
+    if args.memory_report:
+        zone = importlib.import_module(f"replayer_{args.memory_report}")
+        report = memory_report(zone.DEVICES, args.indir, args.speed_factor, args.min_interval)
+        total_old = total_new = devices = 0
+        for r in report:
+            old = r["dataframe_bytes"]
+            print(f"{r['dataset']}: rows={r['rows']} devices={r['devices']} shared={r['shared_bytes']} B "
+                  f"per-device={r['per_device_bytes']} B"
+                  + (f" (DataFrame per device: {old} B, {old / max(r['per_device_bytes'], 1):.0f}x)" if old else ""))
+            devices += r["devices"]
+            total_new += r["shared_bytes"]
+            total_old += (old or 0) * r["devices"]
+        if devices:
+            print(f"[{args.memory_report}] {devices} devices: {total_new} B of schedules "
+                  f"({total_new / devices:.0f} B/device)"
+                  + (f" vs {total_old} B with one DataFrame per device" if total_old else ""))
+        return
+
+    if not args.csv:
+        ap.error("give dataset CSV files or --memory-report ZONE")
+    for path in args.csv:
+        t0 = time.perf_counter()
+        schedule = compile_schedule(path, os.path.basename(path))
+        write_cache(schedule, cache_path(path))
+        print(f"{path}: {len(schedule)} rows, {schedule.publish.count()} publish "
+              f"-> {cache_path(path)} ({(time.perf_counter() - t0) * 1000:.0f} ms)")
+
+if __name__ == "__main__":
+    main()
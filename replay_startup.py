@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Startup timing for replayers and subscribers
+--------------------------------------------
+- Đo thời gian từ lúc process khởi động đến publish (hoặc message) đầu tiên
+- Tuổi process lấy từ /proc trên Linux, nên tính cả thời gian interpreter
+  khởi động + import; nơi khác thì tính từ lúc import module này
+- In ra việc pandas / numpy có bị load hay không, để kiểm tra đường lazy-import
+Profiling import chi tiết:
+  python -X importtime replayer_office.py --help 2> imports.log
+"""
+
+from __future__ import annotations
+import os, sys, threading, time
+
+_IMPORTED_AT = time.time()
+
+
+def process_start_time() -> float:
+    """Wall-clock start time of this process (epoch seconds)."""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            fields = f.read().rsplit(b")", 1)[1].split()
+        start_ticks = int(fields[19])   # field 22 overall, after pid and comm
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return _IMPORTED_AT
+
+
+class StartupReport:
+    """Prints one line the first time mark() is called."""
+
+    def __init__(self, label: str, event: str = "first publish"):
+        self.label = label
+        self.event = event
+        self.elapsed_ms: float | None = None
+        self._lock = threading.Lock()
+
+    def mark(self) -> None:
+        if self.elapsed_ms is not None:
+            return
+        with self._lock:
+            if self.elapsed_ms is not None:
+                return
+            self.elapsed_ms = (time.time() - process_start_time()) * 1000.0
+        heavy = [m for m in ("pandas", "numpy") if m in sys.modules]
+        print(f"[{self.label}] startup: {self.event} {self.elapsed_ms:.0f} ms after process start "
+              f"(heavy imports: {', '.join(heavy) or 'none'})")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Global event timeline of a zone (k-way merge of device schedules)
+-----------------------------------------------------------------
+- Mỗi device sinh lazy chuỗi (deadline, device, row) theo đúng logic của
+  device_thread: publish row i tại t, rồi ngủ intervals[i]
+- heapq.merge gộp k chuỗi đã sắp xếp thành một timeline duy nhất, không
+  materialize toàn bộ sự kiện
+- rate_histogram() đếm message kỳ vọng theo cửa sổ thời gian (msg/s), dùng
+  cho scheduler lúc khởi động và cho capacity planning offline
+- Áp cùng phase offset (--stagger) như device_thread và so peak/mean với
+  trường hợp lockstep (mọi device bắt đầu từ row 0)
+Usage:
+  python replay_timeline.py --zone office --indir datasets --horizon 3600
+  python replay_timeline.py --zone storage --horizon 600 --window 0.1 --csv storage_rate.csv
+  python replay_timeline.py --zone storage --horizon 600 --stagger time
+"""
+
+from __future__ import annotations
+import argparse, heapq, importlib, os
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import replay_schedule
+
+Event = Tuple[float, str, int]   # (deadline seconds from start, device, row)
+
+
+def device_events(device: str, intervals: Sequence[float], publish: Sequence[int],
+                  start: float = 0.0, start_row: int = 0, horizon: Optional[float] = None) -> Iterator[Event]:
+    """Publish events of one device, in deadline order, looping over its schedule."""
+    rows = len(intervals)
+    if rows == 0 or not any(publish):
+        return
+    t, i = start, start_row % rows
+    while horizon is None or t < horizon:
+        if publish[i]:
+            yield (t, device, i)
+        t += intervals[i]
+        i = (i + 1) % rows
+
+
+def merge(streams: Iterable[Iterator[Event]]) -> Iterator[Event]:
+    """Lazy heap-based k-way merge of per-device event streams."""
+    return heapq.merge(*streams)
+
+
+def zone_streams(devices: Sequence[Tuple[str, str, str, str]], indir: str, speed_factor: float,
+                 min_interval: float, horizon: Optional[float],
+                 offsets: Optional[Dict[str, Tuple[float, int]]] = None,
+                 stagger: str = "none", rows=None) -> List[Iterator[Event]]:
+    """One event stream per DEVICES entry whose dataset (or schedule cache) is available.
+
+    offsets maps username -> (time shift, start row); devices without an
+    explicit offset get replay_schedule.phase_offset(username, ..., stagger).
+    rows is a --start/--end window (replay_schedule.window_from_args).
+    """
+    streams = []
+    for name, fname, username, _ in devices:
+        path = os.path.join(indir, fname)
+        if not os.path.exists(path) and not os.path.exists(replay_schedule.cache_path(path)):
+            continue
+        schedule = replay_schedule.load_schedule(path, name, window=rows)
+        intervals = schedule.scaled(speed_factor, min_interval)
+        if offsets and username in offsets:
+            start, row = offsets[username]
+        else:
+            start, row = replay_schedule.phase_offset(username, intervals, stagger)
+        streams.append(device_events(username, intervals, schedule.publish, start, row, horizon))
+    return streams
+
+
+def rate_histogram(events: Iterable[Event], window: float = 1.0,
+                   horizon: Optional[float] = None) -> List[int]:
+    """Expected messages per window; events must arrive in deadline order."""
+    counts: List[int] = []
+    for t, _, _ in events:
+        if horizon is not None and t >= horizon:
+            break
+        k = int(t // window)
+        if k >= len(counts):
+            counts.extend([0] * (k + 1 - len(counts)))
+        counts[k] += 1
+    if horizon is not None:
+        n = int(-(-horizon // window))
+        counts.extend([0] * (n - len(counts)))
+    return counts
+
+
+def peak_to_mean(counts: Sequence[int]) -> float:
+    if not counts:
+        return 0.0
+    mean = sum(counts) / len(counts)
+    return max(counts) / mean if mean > 0 else 0.0
+
+
+def burstiness(devices: Sequence[Tuple[str, str, str, str]], indir: str, speed_factor: float,
+               min_interval: float, horizon: float, stagger: str, window: float = 1.0, rows=None) -> str:
+    """Expected load with the given stagger, and its peak/mean next to the lockstep start.
+
+    window is the histogram bucket in seconds; rows the --start/--end replay window.
+    """
+    counts = rate_histogram(merge(zone_streams(devices, indir, speed_factor, min_interval,
+                                               horizon, stagger=stagger, rows=rows)), window, horizon)
+    line = f"{describe(counts, window)} (stagger={stagger})"
+    if stagger != "none":
+        lockstep = rate_histogram(merge(zone_streams(devices, indir, speed_factor, min_interval, horizon,
+                                                     rows=rows)),
+                                  window, horizon)
+        line += f" lockstep peak/mean={peak_to_mean(lockstep):.2f}"
+    return line
+
+
+def describe(counts: Sequence[int], window: float) -> str:
+    if not counts:
+        return "no events"
+    rates = sorted(c / window for c in counts)
+    q = lambda p: rates[min(len(rates) - 1, int(p * len(rates)))]
+    return (f"messages={sum(counts)} mean={sum(counts) / (len(counts) * window):.1f} msg/s "
+            f"p50={q(0.50):.1f} p99={q(0.99):.1f} peak={rates[-1]:.1f} msg/s "
+            f"peak/mean={peak_to_mean(counts):.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Expected zone load from the merged device timeline")
+    ap.add_argument("--zone", required=True, help="Zone replayer to plan (office, energy, production, security, storage)")
+    ap.add_argument("--indir", default="datasets")
+    ap.add_argument("--speed-factor", type=float, default=1.0)
+    ap.add_argument("--min-interval", type=float, default=0.05)
+    ap.add_argument("--horizon", type=float, default=3600.0, help="Seconds of timeline to expand")
+    ap.add_argument("--window", type=float, default=1.0, help="Histogram window in seconds")
+    ap.add_argument("--csv", help="Write the histogram as window_start,messages,msg_per_s")
+    replay_schedule.add_arguments(ap)
+    args = ap.parse_args()
+
+    try:
+        rows = replay_schedule.window_from_args(args)
+    except ValueError as e:
+        ap.error(f"--start/--end: {e}")
+
+    zone = importlib.import_module(f"replayer_{args.zone}")
+    streams = zone_streams(zone.DEVICES, args.indir, args.speed_factor, args.min_interval, args.horizon,
+                           stagger=args.stagger, rows=rows)
+    counts = rate_histogram(merge(streams), args.window, args.horizon)
+    print(f"[{args.zone}] devices={len(streams)} horizon={args.horizon:g}s window={args.window:g}s")
+    print(f"[{args.zone}] {describe(counts, args.window)} (stagger={args.stagger})")
+    if args.stagger != "none":
+        lockstep = rate_histogram(merge(zone_streams(zone.DEVICES, args.indir, args.speed_factor,
+                                                     args.min_interval, args.horizon, rows=rows)),
+                                  args.window, args.horizon)
+        print(f"[{args.zone}] lockstep: {describe(lockstep, args.window)}")
+    if args.csv:
+        with open(args.csv, "w", encoding="utf-8") as f:
+            f.write("window_start,messages,msg_per_s\n")
+            for k, c in enumerate(counts):
+                f.write(f"{k * args.window:g},{c},{c / args.window:g}\n")
+        print(f"Histogram written to {args.csv}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Real sensor values from the datasets instead of random noise
+------------------------------------------------------------
+- Lúc compile schedule, cột payload (mqtt.msg) của mỗi row publish được parse
+  thành một số thực; kết quả là cột NumPy float64 (NaN = không đọc được)
+- Format được nhận diện một lần cho cả file, sau đó cả cột đi qua đúng một
+  parser đã compile sẵn (regex XML / JSON / số thuần, có hoặc không hex)
+- Hot path chỉ còn values[i]; row NaN rơi về random_value_for_device
+- Dataset gotham đã chạy extract_gotham.py thì lấy thẳng từ bảng .xml.npz,
+  không decode hex XML nữa
+Formats:
+  hex-xml    : gotham, <root><CO_GT><value>2.0</value>...</root> hex-encoded
+  hex-json   : {"value": 21.5, ...} hex-encoded
+  hex-number : b"21.5" hex-encoded (MQTTset)
+  number     : 21.5 as plain text / numeric column (Edge-IIoTset)
+Usage:
+  python replay_values.py datasets/air-quality_gotham.csv
+"""
+
+from __future__ import annotations
+import json, os, re, string
+from functools import lru_cache
+from typing import Callable, Dict, Optional
+
+PAYLOAD_CANDIDATES = ["mqtt.msg", "payload", "message", "value"]
+
+# Measurement published per dataset; anything else takes the first numeric field
+VALUE_FIELDS = {
+    "air-quality_gotham.csv": "CO_GT",
+    "cooler-motor_gotham.csv": None,
+    "hydraulic-system_gotham.csv": None,
+    "predictive-maintenance_gotham.csv": None,
+}
+# Sentinels the source datasets use for "not measured" (UCI air quality: -200)
+MISSING_MARKERS = {
+    "air-quality_gotham.csv": -200.0,
+}
+
+_NUMBER = rb"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+# <Name><value>2.0</value>...</Name> or <Name>0.7255</Name>
+_XML_ANY = re.compile(rb"<([A-Za-z_][\w.\-]*)>\s*(?:<value>\s*(" + _NUMBER + rb")\s*</value>|("
+                      + _NUMBER + rb")\s*</\1>)")
+_PLAIN_NUMBER = re.compile(rb"\s*(" + _NUMBER + rb")\s*$")
+_HEX = frozenset(string.hexdigits)
+_PRINTABLE = frozenset(string.printable.encode("ascii"))
+_NAN = float("nan")
+
+
+@lru_cache(maxsize=None)
+def _xml_field(field: str):
+    tag = re.escape(field.encode("utf-8"))
+    return re.compile(rb"<" + tag + rb">\s*(?:<value>\s*(" + _NUMBER + rb")\s*</value>|("
+                      + _NUMBER + rb")\s*</" + tag + rb">)")
+
+
+def xml_fields(raw: bytes) -> Dict[str, float]:
+    """Every numeric measurement of one XML document, in document order."""
+    return {m.group(1).decode("utf-8"): float(m.group(2) or m.group(3)) for m in _XML_ANY.finditer(raw)}
+
+
+def _looks_hex(s: str) -> bool:
+    if len(s) < 2 or len(s) % 2 or not _HEX.issuperset(s):
+        return False
+    raw = bytes.fromhex(s)
+    return all(b in _PRINTABLE or b >= 0x80 for b in raw)
+
+
+def _json_value(doc, field: Optional[str]) -> float:
+    if isinstance(doc, (int, float)) and not isinstance(doc, bool):
+        return float(doc)
+    if isinstance(doc, dict):
+        if field is not None:
+            v = doc.get(field)
+            if isinstance(v, dict):
+                v = v.get("value")
+            return float(v) if isinstance(v, (int, float, str)) else _NAN
+        for v in doc.values():
+            if isinstance(v, dict):
+                v = v.get("value")
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                return float(v)
+    return _NAN
+
+
+def _kind(raw: bytes) -> Optional[str]:
+    body = raw.lstrip()
+    if body.startswith(b"<") and _XML_ANY.search(raw):
+        return "xml"
+    if body.startswith((b"{", b"[")):
+        return "json"
+    if _PLAIN_NUMBER.match(raw):
+        return "number"
+    return None
+
+
+def detect_format(sample: str) -> Optional[str]:
+    """Format of one non-empty payload cell, or None when it holds no value."""
+    s = sample.strip()
+    if _looks_hex(s):
+        kind = _kind(bytes.fromhex(s))
+        if kind is not None:
+            return "hex-" + kind
+    # "25" is valid hex too (b"%"); it only counts as hex when the decoded bytes parse
+    return _kind(s.encode("utf-8"))
+
+
+def make_parser(fmt: str, field: Optional[str] = None) -> Callable[[str], float]:
+    """Compiled cell -> float parser for one format (NaN when the cell has no value)."""
+    hexed = fmt.startswith("hex-")
+    kind = fmt[4:] if hexed else fmt
+
+    def raw_of(cell: str) -> bytes:
+        return bytes.fromhex(cell) if hexed else cell.encode("utf-8")
+
+    if kind == "xml":
+        pattern = _xml_field(field) if field else _XML_ANY
+        group = 1 if field else 2
+
+        def parse(cell: str) -> float:
+            m = pattern.search(raw_of(cell))
+            return float(m.group(group) or m.group(group + 1)) if m else _NAN
+    elif kind == "json":
+        def parse(cell: str) -> float:
+            try:
+                return _json_value(json.loads(raw_of(cell)), field)
+            except ValueError:
+                return _NAN
+    elif kind == "number":
+        def parse(cell: str) -> float:
+            m = _PLAIN_NUMBER.match(raw_of(cell))
+            return float(m.group(1)) if m else _NAN
+    else:
+        raise ValueError(f"unknown value format {fmt!r}")
+
+    def safe(cell) -> float:
+        if not isinstance(cell, str) or not cell:
+            return _NAN
+        try:
+            return parse(cell)
+        except ValueError:
+            return _NAN
+
+    return safe
+
+
+def extract_values(df, publish, csv_path: str, label: str = "values"):
+    """float64 NumPy column of measurements for the publish rows of df, or None."""
+    import numpy as np
+    import pandas as pd
+
+    import extract_gotham
+
+    mask = np.frombuffer(bytes(publish), dtype=np.uint8).astype(bool)
+    field = VALUE_FIELDS.get(os.path.basename(csv_path))
+    table = extract_gotham.load_table(csv_path)
+    col = next((c for c in PAYLOAD_CANDIDATES if c in df.columns), None)
+    if table is not None and table["fields"]:
+        # pre-extracted by extract_gotham.py
+        col, fmt = extract_gotham.table_path(csv_path), "table"
+        rows = table["row"]
+        keep = rows < len(df)
+        values = np.full(len(df), np.nan, dtype=np.float64)
+        values[rows[keep]] = table[field if field in table else table["fields"][0]][keep]
+        values[~mask] = np.nan
+    elif col is None:
+        return None
+    elif pd.api.types.is_numeric_dtype(df[col]):
+        cells = df[col]
+        values = cells.to_numpy(dtype=np.float64, na_value=np.nan).copy()
+        values[~mask] = np.nan
+        fmt = "number"
+    else:
+        cells = df[col]
+        sample = cells[mask & cells.notna().to_numpy()]
+        fmt = None
+        for cell in sample.head(20):
+            fmt = detect_format(str(cell))
+            if fmt is not None:
+                break
+        if fmt is None:
+            return None
+        parse = make_parser(fmt, field)
+        values = np.full(len(df), np.nan, dtype=np.float64)
+        idx = np.flatnonzero(mask)
+        values[idx] = [parse(c) for c in cells.to_numpy(dtype=object)[idx]]
+    marker = MISSING_MARKERS.get(os.path.basename(csv_path))
+    if marker is not None:
+        values[values == marker] = np.nan
+    found = int(np.count_nonzero(~np.isnan(values)))
+    if not found:
+        return None
+    print(f"[{label}] {found}/{int(mask.sum())} publish rows carry real values ({col}, {fmt})")
+    return values
+
+
+def add_arguments(parser) -> None:
+    parser.add_argument("--random-values", action="store_true",
+                        help="Publish random values even when the dataset carries real readings")
+
+
+def main():
+    import argparse
+    import replay_schedule
+    ap = argparse.ArgumentParser(description="Show the values extracted from replay datasets")
+    ap.add_argument("csv", nargs="+")
+    ap.add_argument("--head", type=int, default=10)
+    args = ap.parse_args()
+    for path in args.csv:
+        schedule = replay_schedule.compile_schedule(path, os.path.basename(path))
+        if schedule.values is None:
+            print(f"{path}: no extractable values")
+            continue
+        shown = [round(float(v), 4) for v in schedule.values if v == v][:args.head]
+        print(f"{path}: {shown}")
+
+if __name__ == "__main__":
+    main()
@@ -12,18 +12,27 @@ Usage:
 from __future__ import annotations
 import argparse, json, os, random, threading, time
 from datetime import datetime, timezone
-from typing import List, Optional, Tuple
-import pandas as pd
+from typing import Callable, List, Optional, Tuple
 import paho.mqtt.client as mqtt
 
-# ----------------------------------------------------------------------------- 
-# Canonical column candidates
-# -----------------------------------------------------------------------------
-TIMESTAMP_CANDIDATES = [
-    "timestamp", "ts", "time", "frame.time_epoch", "frame.time_relative",
-    "Time", "SniffTimestamp"
-]
-MSGTYP_CANDIDATES = ["mqtt.msgtype", "msg_type", "message_type", "packet_type", "mqtt.msgtype_str"]
+import replay_batch
+import replay_checkpoint
+import replay_diag
+import replay_clones
+import replay_fastpub
+import replay_faults
+import replay_gateway
+import replay_journal
+import replay_loadshape
+import replay_metrics
+import replay_mqtt5
+import replay_probes
+import replay_ratelimit
+import replay_reconnect
+import replay_schedule
+import replay_startup
+import replay_timeline
+import replay_values
 
 # ----------------------------------------------------------------------------- 
 # Zone & tenancy
@@ -88,44 +97,9 @@ DEVICES = [
 # ----------------------------------------------------------------------------- 
 # Helpers (y như file gốc)
 # -----------------------------------------------------------------------------
-def resolve_column(df: pd.DataFrame, candidates: List[str]) -> Optional[str]:
-    for c in candidates:
-        if c in df.columns:
-            return c
-    return None
-
-def _parse_timestamp_series(ts: pd.Series) -> pd.Series:
-    if pd.api.types.is_numeric_dtype(ts):
-        s = ts.astype(float)
-        if s.dropna().median() > 1e12:
-            s = s / 1000.0
-        return s
-    dt = pd.to_datetime(ts, errors="coerce", utc=True)
-    return dt.view("int64") / 1e9
-
-def _median_interval(seconds: pd.Series) -> float:
-    diffs = seconds.diff().dropna()
-    if diffs.empty:
-        return 1.0
-    diffs = diffs[diffs > 0]
-    if diffs.empty:
-        return 1.0
-    return float(diffs.median())
-
-def _is_publish(row: pd.Series, msgtype_col: Optional[str]) -> bool:
-    if not msgtype_col or msgtype_col not in row or pd.isna(row[msgtype_col]):
-        return True
-    v = row[msgtype_col]
-    try:
-        if str(v).strip().isdigit():
-            return int(v) == 3
-    except Exception:
-        pass
-    s = str(v).lower()
-    return ("publish" in s) and ("command" not in s) and ("req" not in s)
-
-def mk_client(client_id: str, username: Optional[str] = None, password: Optional[str] = None) -> mqtt.Client:
-    c = mqtt.Client(client_id=client_id)
+def mk_client(client_id: str, username: Optional[str] = None, password: Optional[str] = None,
+              protocol: int = mqtt.MQTTv311) -> mqtt.Client:
+    c = mqtt.Client(client_id=client_id, protocol=protocol)
 
     if username and password:
         c.username_pw_set(username, password)
@@ -148,7 +122,7 @@ def mk_client(client_id: str, username: Optional[str] = None, password: Optional
 
     return c
 
-def random_value_for_device(username: str) -> float:
+def random_value_for_device(username: str, rng=random) -> float:
     ranges: dict[str, Tuple[float, float]] = {
         "sensor_temp": (15.0, 40.0),
         "sensor_light": (0.0, 2000.0),
@@ -171,7 +145,7 @@ def random_value_for_device(username: str) -> float:
         "sensor_predictive": (0.0, 1.0),
     }
     lo, hi = ranges.get(username, (0.0, 100.0))
-    val = random.uniform(lo, hi)
+    val = rng.uniform(lo, hi)
     if hi - lo <= 5 or (lo == 0 and hi <= 1):
         return round(val, 3)
     elif hi <= 100:
@@ -183,83 +157,176 @@ def random_value_for_device(username: str) -> float:
 # Device thread (y như gốc, chỉ thêm "zone" vào payload)
 # -----------------------------------------------------------------------------
 def device_thread(device_name: str, csv_path: str, broker: str, port: int,
-                  username: Optional[str], password: Optional[str], speed_factor: float, min_interval: float):
+                  username: Optional[str], password: Optional[str], speed_factor: float, min_interval: float,
+                  batch_size: int = 0, batch_ms: float = 1000.0,
+                  zone_batcher: Optional[replay_batch.Batcher] = None,
+                  gateway: Optional[replay_gateway.GatewayPool] = None,
+                  stats: Optional[replay_gateway.TopologyStats] = None,
+                  client_factory: Optional[Callable[..., mqtt.Client]] = None,
+                  schedule: Optional[replay_schedule.Schedule] = None,
+                  startup: Optional[replay_startup.StartupReport] = None,
+                  journal: Optional[replay_journal.JournalWriter] = None,
+                  lateness: Optional[replay_metrics.Histogram] = None,
+                  real_values: bool = True,
+                  probes: bool = False,
+                  stagger: str = "none",
+                  limits: Optional[replay_ratelimit.RateLimits] = None,
+                  checkpoint: Optional[replay_checkpoint.Checkpoint] = None,
+                  window=None,
+                  reconnect: Optional[replay_reconnect.ReconnectPolicy] = None,
+                  load_shape: Optional[replay_loadshape.LoadShape] = None,
+                  faults: Optional[replay_faults.FaultPlan] = None):
     topic = f"factory/{TENANT}/{username}/telemetry"
     client_id = f"{ZONE}-{username}-replayer"
-    client = mk_client(client_id, username, password)
 
-    # connect with retry
-    connected = False
-    while not connected:
-        try:
-            client.connect(broker, port, keepalive=60)
-            client.loop_start()
-            connected = True
-            print(f"[{ZONE}:{device_name}] Connected to {broker}:{port}")
-        except Exception as e:
-            print(f"[{ZONE}:{device_name}] Connection failed, retrying in 5s: {e}")
-            time.sleep(5)
-
-    # load csv
+    if gateway is not None:
+        # shared gateway connection publishes on this device's own topic
+        client = gateway.acquire(username)
+    else:
+        client = (client_factory or mk_client)(client_id, username, password)
+        if stats is not None:
+            stats.track(client)
+
+        # connect with jittered backoff; later drops reconnect through the same policy
+        reconnect = reconnect or replay_reconnect.ReconnectPolicy()
+        reconnect.install(client, f"{ZONE}:{device_name}")
+        reconnect.connect(client, broker, port, f"{ZONE}:{device_name}")
+        client.loop_start()
+        print(f"[{ZONE}:{device_name}] Connected to {broker}:{port}")
+
+    publish = replay_mqtt5.publisher(client)
+    if journal is not None:
+        publish = journal.wrap(publish)
+    if limits is not None:
+        # the broker quota is per connection: devices behind a gateway share its client id
+        connection = gateway.gateway_for(username).client_id if gateway is not None else client_id
+        publish = limits.wrap(publish, ZONE, connection)
+    if faults is not None:
+        publish = faults.wrap(publish, client, ZONE, device_name, username)
+
+    def close_client():
+        if gateway is not None:
+            gateway.release(username)
+        else:
+            client.loop_stop()
+            client.disconnect()
+
+    # load schedule: binary cache when fresh, otherwise compiled from the CSV (pandas)
     try:
-        df = pd.read_csv(csv_path, low_memory=False)
-        print(f"[{ZONE}:{device_name}] Loaded {len(df)} rows from {csv_path}")
+        if schedule is None:
+            schedule = replay_schedule.load_schedule(csv_path, f"{ZONE}:{device_name}", window=window)
+        print(f"[{ZONE}:{device_name}] Loaded {len(schedule)} rows from {schedule.source}")
     except Exception as e:
         print(f"[{ZONE}:{device_name}] Error loading CSV: {e}")
-        client.loop_stop(); client.disconnect()
+        close_client()
         return
 
-    ts_col = resolve_column(df, TIMESTAMP_CANDIDATES)
-    msg_col = resolve_column(df, MSGTYP_CANDIDATES)
-
-    if not ts_col:
-        print(f"[{ZONE}:{device_name}] No timestamp column found; using 1.0s default interval.")
-        seconds = pd.Series(range(len(df)), dtype=float)
-        base_interval = 1.0
-    else:
-        seconds = _parse_timestamp_series(df[ts_col])
-        base_interval = _median_interval(seconds)
-        if pd.isna(seconds).all():
-            seconds = pd.Series(range(len(df)), dtype=float)
-            base_interval = 1.0
-
     # precompute intervals
-    intervals: List[float] = []
-    for i in range(len(df)):
-        if i < len(df) - 1 and ts_col and pd.notna(seconds.iloc[i]) and pd.notna(seconds.iloc[i+1]):
-            delta = float(seconds.iloc[i+1] - seconds.iloc[i])
-        else:
-            delta = base_interval
-        if not (delta > 0):
-            delta = base_interval
-        delta = max(delta / max(speed_factor, 1e-6), min_interval)
-        intervals.append(delta)
-
-    # publish loop
-    i = 0
+    intervals = schedule.scaled(speed_factor, min_interval)
+    publish_rows = schedule.publish
+    # readings extracted from the dataset at load time; NaN rows fall back to random
+    values = schedule.values if real_values else None
+    rows = len(schedule)
+    if load_shape is not None:
+        load_shape.register(intervals, publish_rows)
+
+    # optional batching: own envelope stream, or the shared zone aggregator
+    batcher = zone_batcher
+    if batcher is None and batch_size > 0:
+        batcher = replay_batch.Batcher(lambda body: publish(topic, body),
+                                       client_id, ZONE, batch_size, batch_ms)
+
+    # deterministic per-username phase, so devices sharing a CSV do not publish in lockstep
+    shift, i = replay_schedule.phase_offset(username, intervals, stagger)
+    seq = loops = 0
+    resumed = checkpoint.resume(username, schedule.source, rows, schedule.first_row) if checkpoint is not None else None
+    if resumed is not None:
+        i, loops, seq = resumed
+        shift = 0.0
+        print(f"[{ZONE}:{device_name}] Resuming at row {i+1}/{rows} (loop {loops})")
+    if shift > 0:
+        time.sleep(shift)
+
+    # publish loop: deadline based, so time spent publishing does not stretch the schedule
+    next_at = time.monotonic()
     try:
         while True:
-            row = df.iloc[i]
-            if _is_publish(row, msg_col):
+            if lateness is not None:
+                lateness.add(time.monotonic() - next_at)
+            if publish_rows[i]:
+                value = values[i] if values is not None else None
                 payload = {
                     "timestamp": datetime.now(timezone.utc).isoformat(),
-                    "value": random_value_for_device(username),
+                    "value": float(value) if value is not None and value == value
+                             else random_value_for_device(username),
                     "client_id": client_id,
                     "zone": ZONE,
                 }
+                probe = None
+                if probes:
+                    probe = (seq, time.time_ns())
+                    payload["seq"], payload["send_ns"] = probe
+                    payload["run"] = replay_probes.RUN_ID
+                    seq += 1
                 try:
-                    client.publish(topic, json.dumps(payload))
-                    print(f"[{ZONE}:{device_name}] Row {i+1}/{len(df)} → published: {payload}")
+                    if batcher is not None:
+                        batcher.add(payload["timestamp"], payload["value"], client_id, probe)
+                        print(f"[{ZONE}:{device_name}] Row {i+1}/{rows} → batched: {payload}")
+                    else:
+                        publish(topic, json.dumps(payload))
+                        print(f"[{ZONE}:{device_name}] Row {i+1}/{rows} → published: {payload}")
+                    if startup is not None:
+                        startup.mark()
+                    if load_shape is not None:
+                        load_shape.count()
                 except Exception as e:
                     print(f"[{ZONE}:{device_name}] Publish error: {e}")
             else:
-                print(f"[{ZONE}:{device_name}] Row {i+1}/{len(df)} skipped (msgtype not publish)")
+                print(f"[{ZONE}:{device_name}] Row {i+1}/{rows} skipped (msgtype not publish)")
 
-            time.sleep(intervals[i])
-            i = (i + 1) % len(df)
+            if load_shape is None:
+                next_at += intervals[i]
+            else:
+                # the row's interval is stretched/squeezed by the profile over the time it spans
+                next_at = load_shape.advance(next_at, intervals[i])
+            i += 1
+            if i == rows:
+                i = 0
+                loops += 1
+            if checkpoint is not None:
+                checkpoint.update(username, schedule.source, rows, i, loops, seq, schedule.first_row)
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
     finally:
-        client.loop_stop()
-        client.disconnect()
+        if batcher is not None and batcher is not zone_batcher:
+            batcher.close()
+        close_client()
+
+def start_zone_aggregator(args, client_factory: Callable[..., mqtt.Client] = mk_client,
+                          journal: Optional[replay_journal.JournalWriter] = None,
+                          limits: Optional[replay_ratelimit.RateLimits] = None,
+                          reconnect: Optional[replay_reconnect.ReconnectPolicy] = None) -> Optional[replay_batch.Batcher]:
+    """One aggregator connection that batches readings of every device in the zone."""
+    if args.batch_size <= 0 or args.batch_scope != "zone":
+        return None
+    username = args.aggregator_user or f"{ZONE}-aggregator"
+    client_id = f"{ZONE}-{username}-replayer"
+    topic = f"factory/{TENANT}/{username}/telemetry"
+    client = client_factory(client_id, username, args.aggregator_password)
+    reconnect = reconnect or replay_reconnect.ReconnectPolicy()
+    reconnect.install(client, f"{ZONE}:aggregator")
+    reconnect.connect(client, args.broker, args.port, f"{ZONE}:aggregator")
+    client.loop_start()
+    print(f"[{ZONE}:aggregator] Connected to {args.broker}:{args.port} → {topic} "
+          f"(batch {args.batch_size} / {args.batch_ms:g} ms)")
+    publish = replay_mqtt5.publisher(client)
+    if journal is not None:
+        publish = journal.wrap(publish)
+    if limits is not None:
+        publish = limits.wrap(publish, ZONE, client_id)
+    return replay_batch.Batcher(lambda body: publish(topic, body), client_id, ZONE,
+                                args.batch_size, args.batch_ms, with_source=True)
 
 # ----------------------------------------------------------------------------- 
 # CLI
@@ -271,34 +338,174 @@ def main():
     parser.add_argument("--port", type=int, default=8883, help="MQTT broker port")
     parser.add_argument("--speed-factor", type=float, default=1.0, help=">1 speeds up, <1 slows down (default 1.0)")
     parser.add_argument("--min-interval", type=float, default=0.05, help="Minimum seconds between publishes after scaling")
+    replay_batch.add_arguments(parser)
+    replay_gateway.add_arguments(parser)
+    replay_mqtt5.add_arguments(parser)
+    replay_journal.add_arguments(parser)
+    replay_values.add_arguments(parser)
+    replay_probes.add_arguments(parser)
+    replay_schedule.add_arguments(parser)
+    replay_ratelimit.add_arguments(parser)
+    replay_checkpoint.add_arguments(parser)
+    replay_reconnect.add_arguments(parser)
+    replay_loadshape.add_arguments(parser)
+    replay_clones.add_arguments(parser)
+    replay_fastpub.add_arguments(parser)
+    replay_diag.add_arguments(parser)
+    replay_faults.add_arguments(parser)
+    parser.add_argument("--synthetic-rate", type=float, default=None,
+                        help="Ignore the CSVs and publish at this generated rate (msg/s per device)")
+    parser.add_argument("--plan-horizon", type=float, default=0.0,
+                        help="Print the expected msg/s of the merged device timeline over this many seconds")
     args = parser.parse_args()
 
+    gateways = replay_gateway.plan_gateways(DEVICES, args.gateway_size, ZONE) if args.gateway_size > 0 else []
+    if args.print_gateway_acl:
+        if not gateways:
+            parser.error("--print-gateway-acl requires --gateway-size > 0")
+        print(replay_gateway.acl_rules(gateways, TENANT), end="")
+        return
+    if args.print_clone_acl:
+        if args.multiply <= 1:
+            parser.error("--print-clone-acl requires --multiply > 1")
+        print(replay_clones.clone_acl(DEVICES, args.multiply, ZONE, TENANT), end="")
+        return
+    if args.multiply > 1 and args.checkpoint:
+        parser.error("--checkpoint is not supported with --multiply")
+    replay_diag.install(args, ZONE)
+
     print("CSV Replayer (Production Zone) Starting...")
     print(f"Broker: {args.broker}:{args.port}")
     print(f"Data directory: {args.indir}")
     print(f"Speed factor: {args.speed_factor}")
     print("=" * 70)
 
+    try:
+        window = replay_schedule.window_from_args(args)
+    except ValueError as e:
+        parser.error(f"--start/--end: {e}")
+
+    if args.plan_horizon > 0 and not args.synthetic_rate:
+        report = replay_timeline.burstiness(DEVICES, args.indir, args.speed_factor, args.min_interval,
+                                            args.plan_horizon, args.stagger, rows=window)
+        print(f"Expected load ({args.plan_horizon:g}s): {report}")
+
+    if args.fast_publish and args.mqtt5:
+        parser.error("--fast-publish speaks MQTT 3.1.1 only; drop --mqtt5")
+    client_factory = mk_client
+    if args.fast_publish:
+        client_factory = replay_fastpub.make_factory(args.fast_tick_ms / 1000)
+        print(f"Fast publisher: pre-encoded QoS 0 frames, one write per {args.fast_tick_ms:g} ms tick")
+    if args.mqtt5:
+        client_factory = replay_mqtt5.make_factory(
+            mk_client, replay_mqtt5.V5Options(args.message_expiry, args.payload_format_utf8))
+        print("MQTT v5: topic aliases enabled")
+
+    journal = replay_journal.JournalWriter(args.journal) if args.journal else None
+    if journal is not None:
+        print(f"Journal: {args.journal}")
+
+    limits = replay_ratelimit.RateLimits.from_args(args)
+    reconnect = replay_reconnect.ReconnectPolicy.from_args(args)
+    load_shape = None
+    if args.load_profile:
+        try:
+            load_shape = replay_loadshape.LoadShape.load(args.load_profile)
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"--load-profile: {e}")
+        print(f"Load profile: {args.load_profile} ({load_shape.length:g}s"
+              + (", repeating)" if load_shape.repeat else ")"))
+    faults = None
+    if args.fault_plan:
+        try:
+            faults = replay_faults.FaultPlan.load(args.fault_plan, args.fault_seed)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            parser.error(f"--fault-plan: {e}")
+        faults.start_log(args.fault_log)
+        print(f"Fault plan: {args.fault_plan} ({len(faults.rules)} rules, seed {faults.seed})"
+              + (f" → {args.fault_log}" if args.fault_log else ""))
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = replay_checkpoint.Checkpoint(args.checkpoint, args.checkpoint_interval, ZONE)
+        print(f"Checkpoint: {args.checkpoint} (every {args.checkpoint_interval:g}s)")
+    zone_batcher = start_zone_aggregator(args, client_factory, journal, limits, reconnect)
+    stats = replay_gateway.TopologyStats("gateway" if gateways else "device")
+    gateway = None
+    if gateways:
+        gateway = replay_gateway.GatewayPool(gateways, client_factory, args.broker, args.port,
+                                             args.gateway_password, stats, label=ZONE, reconnect=reconnect)
+        print(f"Gateway mode: {len(DEVICES)} devices over {len(gateways)} connections")
+
+    startup = replay_startup.StartupReport(ZONE)
+    synthetic = replay_schedule.synthetic_schedule(args.synthetic_rate) if args.synthetic_rate else None
+
     threads: List[threading.Thread] = []
+    if load_shape is not None:
+        load_shape.t0 = time.monotonic()
+    if faults is not None:
+        faults.t0 = time.monotonic()
     for name, fname, username, password in DEVICES:
         path = os.path.join(args.indir, fname)
-        if not os.path.exists(path):
+        if synthetic is None and not os.path.exists(path) and not os.path.exists(replay_schedule.cache_path(path)):
             print(f"Missing {path} - skipping {name}")
             continue
-        t = threading.Thread(
-            target=device_thread,
-            args=(name, path, args.broker, args.port, username, password, args.speed_factor, args.min_interval),
-            daemon=True,
-        )
+        common = dict(batch_size=args.batch_size, batch_ms=args.batch_ms, zone_batcher=zone_batcher,
+                      gateway=gateway, stats=stats, client_factory=client_factory,
+                      schedule=synthetic, startup=startup, journal=journal,
+                      real_values=not args.random_values, probes=args.probes, stagger=args.stagger,
+                      limits=limits, window=window, reconnect=reconnect, load_shape=load_shape, faults=faults)
+        if args.multiply > 1:
+            # N clones of this device in one thread, sharing its schedule and connection
+            t = threading.Thread(
+                target=replay_clones.group_thread,
+                args=(name, path, args.broker, args.port, username, password, args.speed_factor,
+                      args.min_interval, args.multiply),
+                kwargs=dict(common, zone=ZONE, tenant=TENANT, random_value=random_value_for_device),
+                daemon=True,
+            )
+        else:
+            t = threading.Thread(
+                target=device_thread,
+                args=(name, path, args.broker, args.port, username, password, args.speed_factor, args.min_interval),
+                kwargs=dict(common, checkpoint=checkpoint),
+                daemon=True,
+            )
         t.start()
         threads.append(t)
-        print(f"Started {name} → topic factory/{TENANT}/{name}/telemetry (file: {fname}, user: {username})")
+        print(f"Started {name} → topic factory/{TENANT}/{name}/telemetry (file: {fname}, user: {username})"
+              + (f" x{args.multiply} clones" if args.multiply > 1 else ""))
+
+    if load_shape is not None:
+        replay_loadshape.start_reporter(load_shape, ZONE, args.load_log)
 
     try:
+        last_stats = time.monotonic()
         while True:
             time.sleep(1)
+            if args.stats_interval > 0 and time.monotonic() - last_stats >= args.stats_interval:
+                last_stats = time.monotonic()
+                print(f"[{ZONE}] {stats.summary()}")
+                if args.mqtt5:
+                    print(f"[{ZONE}] {replay_mqtt5.summary()}")
+                if limits is not None:
+                    print(f"[{ZONE}] {limits.summary()}")
+                if faults is not None:
+                    print(f"[{ZONE}] {faults.summary()}")
+                if reconnect.attempts > reconnect.connects or reconnect.disconnects:
+                    print(f"[{ZONE}] {reconnect.summary()}")
     except KeyboardInterrupt:
         print("\nStopping replayer...")
+        if zone_batcher is not None:
+            zone_batcher.close()
+        if journal is not None:
+            journal.close()
+            print(f"Journal: {journal.records} messages written to {args.journal}")
+        if checkpoint is not None:
+            checkpoint.close()
+            print(f"Checkpoint: positions saved to {args.checkpoint}")
+        if faults is not None:
+            faults.close()
+            print(f"Faults: {faults.summary()}")
 
 if __name__ == "__main__":
     main()